@@ -0,0 +1,195 @@
+"""Tracked backend benchmarks; run ``python benchmarks.py <name>`` from the backend directory.
+
+Each benchmark prints one JSON object. Pass ``--record FILE`` to append it,
+with a timestamp, to a JSON-lines history so regressions show up over time.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in a fresh interpreter so every sample pays the full cold-import cost.
+_STARTUP_PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import main
+result = {"import_seconds": time.perf_counter() - started}
+if sys.argv[1] == "ready":
+    async def wait_ready():
+        async with main.app.router.lifespan_context(main.app):
+            while not main.readiness.ready:
+                await asyncio.sleep(0.005)
+            result["ready_seconds"] = time.perf_counter() - started
+            result["checks"] = main.readiness.checks
+    asyncio.run(asyncio.wait_for(wait_ready(), float(sys.argv[2])))
+print(json.dumps(result))
+"""
+
+
+def _run_probe(mode: str, timeout: float) -> Dict[str, Any]:
+    completed = subprocess.run(
+        [sys.executable, "-c", _STARTUP_PROBE, mode, str(timeout)],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        timeout=timeout + 30,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "probe failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(args: argparse.Namespace) -> Dict[str, Any]:
+    """Cold ``import main`` time, and time until ``/readyz`` would pass when Supabase is configured."""
+    imports = [_run_probe("import", args.timeout)["import_seconds"] for _ in range(args.runs)]
+    result: Dict[str, Any] = {
+        "import_seconds_median": round(statistics.median(imports), 4),
+        "import_seconds_min": round(min(imports), 4),
+        "runs": args.runs,
+    }
+    try:
+        ready = [_run_probe("ready", args.timeout) for _ in range(args.runs)]
+    except (RuntimeError, subprocess.TimeoutExpired) as exc:
+        result["ready_skipped"] = str(exc)
+    else:
+        result["ready_seconds_median"] = round(statistics.median(sample["ready_seconds"] for sample in ready), 4)
+        result["checks"] = ready[-1]["checks"]
+    return result
+
+
+def _event_batch_body(count: int) -> bytes:
+    events = [
+        {
+            "event_type": "click" if i % 10 == 0 else "mousemove",
+            "x": i % 1920,
+            "y": i % 1080,
+            "ts_ms": 1_790_000_000_000 + i * 16,
+            "data": {"target": f"card-{i % 40}"} if i % 10 == 0 else None,
+        }
+        for i in range(count)
+    ]
+    return json.dumps({"events": events, "batch_id": "bench"}).encode("utf-8")
+
+
+def bench_ingest_decode(args: argparse.Namespace) -> Dict[str, Any]:
+    """CPU time to parse, validate and turn an events batch into insert rows: pydantic vs the msgspec path."""
+    import fast_decode
+    import main as app_main
+
+    body = _event_batch_body(args.events)
+
+    def pydantic_path() -> int:
+        payload = app_main.EventBatchRequest.model_validate(json.loads(body))
+        return len([app_main._event_row("psid", item) for item in payload.events])
+
+    def fast_path() -> int:
+        payload = fast_decode.decode(body, app_main.EventBatchRequest)
+        return len([app_main._event_row("psid", item) for item in payload.events])
+
+    def sample(fn: Callable[[], int]) -> float:
+        started = time.process_time()
+        fn()
+        return (time.process_time() - started) * 1000.0
+
+    result: Dict[str, Any] = {"events": args.events, "body_bytes": len(body), "runs": args.runs, "msgspec": fast_decode.AVAILABLE}
+    pydantic_ms = [sample(pydantic_path) for _ in range(args.runs)]
+    result["pydantic_ms_median"] = round(statistics.median(pydantic_ms), 3)
+    if fast_decode.AVAILABLE:
+        fast_ms = [sample(fast_path) for _ in range(args.runs)]
+        result["msgspec_ms_median"] = round(statistics.median(fast_ms), 3)
+        result["speedup"] = round(result["pydantic_ms_median"] / max(result["msgspec_ms_median"], 1e-6), 2)
+    return result
+
+
+def _compression_payloads(args: argparse.Namespace) -> Dict[str, bytes]:
+    """Bodies shaped like the large responses and upstream writes: events batch, progress list, user list, catalog."""
+    progress = [
+        {
+            "id": i,
+            "user_id": f"user-{i % 50}",
+            "video_id": f"stream-{i % 12}-clip-{i % 40}",
+            "progress": round((i % 100) / 100, 2),
+            "position_seconds": float(i % 600),
+            "task_status": "in_progress" if i % 3 else "completed",
+            "updated_at": f"2026-10-{1 + i % 28:02d}T12:{i % 60:02d}:00+00:00",
+            "created_at": "2026-10-01T09:00:00+00:00",
+        }
+        for i in range(2000)
+    ]
+    users = [{"id": i, "name": f"User {i}", "email": f"user{i}@example.com"} for i in range(5000)]
+    with open(os.path.join(BACKEND_DIR, "data", "videos.json"), "rb") as f:
+        catalog = f.read()
+    return {
+        "events_batch": _event_batch_body(args.events),
+        "video_progress_list": json.dumps(progress).encode("utf-8"),
+        "users_list": json.dumps(users).encode("utf-8"),
+        "catalog": catalog,
+    }
+
+
+def bench_compression(args: argparse.Namespace) -> Dict[str, Any]:
+    """Size saved versus CPU spent per codec and level on representative API and upstream bodies."""
+    import compression
+
+    codecs = [("gzip", 1), ("gzip", 6), ("gzip", 9)]
+    if compression.zstandard is not None:
+        codecs += [("zstd", 1), ("zstd", 3), ("zstd", 9)]
+
+    def timed(fn: Callable[[], bytes]) -> float:
+        samples = []
+        for _ in range(args.runs):
+            started = time.process_time()
+            fn()
+            samples.append((time.process_time() - started) * 1000.0)
+        return statistics.median(samples)
+
+    payloads: Dict[str, Any] = {}
+    for name, body in _compression_payloads(args).items():
+        results = {}
+        for encoding, level in codecs:
+            packed = compression.compress(body, encoding, level)
+            compress_ms = timed(lambda: compression.compress(body, encoding, level))
+            decompress_ms = timed(lambda: compression.decompress(packed, encoding, len(body)))
+            results[f"{encoding}-{level}"] = {
+                "bytes": len(packed),
+                "ratio": round(len(body) / len(packed), 2),
+                "compress_ms": round(compress_ms, 3),
+                "decompress_ms": round(decompress_ms, 3),
+                "compress_mb_s": round(len(body) / 1e6 / (compress_ms / 1000.0), 1) if compress_ms else None,
+            }
+        payloads[name] = {"bytes": len(body), "codecs": results}
+    return {"runs": args.runs, "zstd": compression.zstandard is not None, "payloads": payloads}
+
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], Dict[str, Any]]] = {
+    "startup": bench_startup,
+    "ingest_decode": bench_ingest_decode,
+    "compression": bench_compression,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--events", type=int, default=10_000, help="events per batch for ingest_decode and compression")
+    parser.add_argument("--record", help="append the result to this JSON-lines file")
+    args = parser.parse_args()
+    result = {"benchmark": args.benchmark, "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    result.update(BENCHMARKS[args.benchmark](args))
+    line = json.dumps(result, sort_keys=True)
+    print(line)
+    if args.record:
+        with open(args.record, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""Two-tier cache: in-process L1 plus an optional shared L2 spoken over the Redis protocol.
+
+Each worker keeps a small TTL/LRU L1. When ``CACHE_REDIS_URL`` is set
+(``redis://host:port/db`` for a Redis-compatible server, or ``fake://`` for
+the embedded in-process stand-in used by tests), values are also stored in
+L2 and every invalidation is broadcast on a pub/sub channel so other
+workers drop their L1 copies. Without it the cache is L1-only.
+
+Group invalidation uses tags: a tag's version lives in L2 and is folded
+into the cache key, so replacing the version retires every key under it.
+Versions are random and expire a while after every entry they could name,
+so tag keys do not pile up in L2 and an expired tag never revives old
+entries. L2 errors never fail a request; the loader is used instead.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "exploreyou:cache:invalidate"
+_MISSING = object()
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"__dt__": value.isoformat()}
+    raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+
+def _json_hook(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1 and "__dt__" in obj:
+        return datetime.fromisoformat(obj["__dt__"])
+    return obj
+
+
+def encode(value: Any) -> bytes:
+    return json.dumps(value, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+
+def decode(raw: bytes) -> Any:
+    return json.loads(raw, object_hook=_json_hook)
+
+
+class LocalCache:
+    """Per-process TTL + LRU map."""
+
+    def __init__(self, max_entries: int = 10_000) -> None:
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class RedisError(Exception):
+    pass
+
+
+_Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class RedisClient:
+    """Minimal RESP2 client: a small pool of command connections plus one subscriber connection."""
+
+    def __init__(
+        self, host: str, port: int, *, db: int = 0, password: Optional[str] = None, timeout: float = 1.0, pool_size: int = 8
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.pool_size = max(1, pool_size)
+        self._idle: List[_Connection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._subscriber: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _pack(*args: Any) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    @classmethod
+    async def _read_reply(cls, reader: asyncio.StreamReader) -> Any:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(body.decode("utf-8"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = await reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(body)
+            if count < 0:
+                return None
+            return [await cls._read_reply(reader) for _ in range(count)]
+        raise RedisError(f"Unexpected reply prefix {kind!r}")
+
+    async def _open(self) -> _Connection:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        if self.password:
+            writer.write(self._pack("AUTH", self.password))
+            await writer.drain()
+            await self._read_reply(reader)
+        if self.db:
+            writer.write(self._pack("SELECT", self.db))
+            await writer.drain()
+            await self._read_reply(reader)
+        return reader, writer
+
+    async def execute(self, *args: Any) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else None
+            reusable = False
+            try:
+                if connection is None:
+                    connection = await self._open()
+                reader, writer = connection
+                writer.write(self._pack(*args))
+                await writer.drain()
+                try:
+                    reply = await asyncio.wait_for(self._read_reply(reader), self.timeout)
+                except RedisError:
+                    # An error reply is a complete reply; the connection is still in step.
+                    reusable = True
+                    raise
+                reusable = True
+                return reply
+            finally:
+                # A timeout or cancellation can leave a reply in flight, so only reuse clean connections.
+                if reusable:
+                    self._idle.append(connection)
+                elif connection is not None:
+                    connection[1].close()
+
+    async def _reset(self) -> None:
+        idle, self._idle = self._idle, []
+        for _reader, writer in idle:
+            writer.close()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.execute("GET", key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.execute("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    async def delete(self, *keys: str) -> None:
+        await self.execute("DEL", *keys)
+
+    async def publish(self, channel: str, message: bytes) -> None:
+        await self.execute("PUBLISH", channel, message)
+
+    async def subscribe(self, channel: str, callback: Callable[[bytes], None]) -> None:
+        async def listen() -> None:
+            while True:
+                try:
+                    reader, writer = await self._open()
+                    writer.write(self._pack("SUBSCRIBE", channel))
+                    await writer.drain()
+                    while True:
+                        reply = await self._read_reply(reader)
+                        if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                            callback(reply[2])
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.warning("Cache invalidation subscriber disconnected; retrying", exc_info=True)
+                    await asyncio.sleep(1.0)
+
+        self._subscriber = asyncio.create_task(listen())
+
+    async def close(self) -> None:
+        if self._subscriber is not None:
+            self._subscriber.cancel()
+            self._subscriber = None
+        await self._reset()
+
+
+class FakeRedisServer:
+    """In-process stand-in for a Redis server shared by several ``FakeRedis`` clients."""
+
+    def __init__(self) -> None:
+        self.data: Dict[str, Tuple[Optional[float], bytes]] = {}
+        self.channels: Dict[str, List[Callable[[bytes], None]]] = {}
+
+    def _live(self, key: str) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires < time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+
+class FakeRedis:
+    def __init__(self, server: FakeRedisServer) -> None:
+        self.server = server
+        self._callbacks: List[Tuple[str, Callable[[bytes], None]]] = []
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.server._live(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self.server.data[key] = (time.monotonic() + ttl, value)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.server.data.pop(key, None)
+
+    async def publish(self, channel: str, message: bytes) -> None:
+        for callback in list(self.server.channels.get(channel, [])):
+            callback(message)
+
+    async def subscribe(self, channel: str, callback: Callable[[bytes], None]) -> None:
+        self.server.channels.setdefault(channel, []).append(callback)
+        self._callbacks.append((channel, callback))
+
+    async def close(self) -> None:
+        for channel, callback in self._callbacks:
+            self.server.channels.get(channel, []).remove(callback)
+        self._callbacks.clear()
+
+
+_fake_server = FakeRedisServer()
+
+
+def connect_l2(url: Optional[str]) -> Optional[Any]:
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "fake":
+        return FakeRedis(_fake_server)
+    if parsed.scheme not in ("redis", "tcp"):
+        raise ValueError(f"Unsupported cache URL scheme: {parsed.scheme}")
+    db = int(parsed.path.lstrip("/") or 0)
+    pool_size = int(os.getenv("CACHE_REDIS_POOL_SIZE", "") or 8)
+    return RedisClient(parsed.hostname or "127.0.0.1", parsed.port or 6379, db=db, password=parsed.password, pool_size=pool_size)
+
+
+class CacheTier:
+    """Owns the L1 store, the optional L2 client and cross-worker invalidation."""
+
+    def __init__(self, l2: Optional[Any] = None, *, prefix: str = "exploreyou", l1_entries: int = 10_000) -> None:
+        self.l1 = LocalCache(l1_entries)
+        self.l2 = l2
+        self.prefix = prefix
+        self.worker_id = uuid.uuid4().hex
+        self._started = False
+        self._event_handlers: List[Callable[[Dict[str, Any]], None]] = []
+
+    async def start(self) -> None:
+        if self.l2 is None or self._started:
+            return
+        self._started = True
+        try:
+            await self.l2.subscribe(INVALIDATION_CHANNEL, self._on_message)
+        except Exception:
+            logger.warning("Cache invalidation subscription failed", exc_info=True)
+
+    async def close(self) -> None:
+        if self.l2 is not None:
+            await self.l2.close()
+        self._started = False
+
+    def _on_message(self, raw: bytes) -> None:
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return
+        if message.get("origin") == self.worker_id:
+            return
+        for key in message.get("keys", []):
+            self.l1.delete(key)
+        event = message.get("event")
+        if event is not None:
+            for handler in self._event_handlers:
+                handler(event)
+
+    def on_event(self, handler: Callable[[Dict[str, Any]], None]) -> None:
+        """Receive application events published by other workers on the invalidation channel."""
+        self._event_handlers.append(handler)
+
+    async def publish_event(self, event: Dict[str, Any]) -> None:
+        if self.l2 is None:
+            return
+        payload = json.dumps({"origin": self.worker_id, "event": event}, default=str).encode("utf-8")
+        await self.l2_call("publish", INVALIDATION_CHANNEL, payload)
+
+    async def l2_call(self, method: str, *args: Any) -> Any:
+        if self.l2 is None:
+            return None
+        try:
+            return await getattr(self.l2, method)(*args)
+        except Exception:
+            logger.warning("Cache L2 %s failed", method, exc_info=True)
+            return None
+
+    async def broadcast(self, keys: List[str]) -> None:
+        for key in keys:
+            self.l1.delete(key)
+        payload = json.dumps({"origin": self.worker_id, "keys": keys}).encode("utf-8")
+        await self.l2_call("publish", INVALIDATION_CHANNEL, payload)
+
+
+class TieredCache:
+    """A named cache region with its own TTLs; negative results (``None``) are cached too."""
+
+    def __init__(self, tier: CacheTier, name: str, *, l1_ttl: float, l2_ttl: float) -> None:
+        self.tier = tier
+        self.name = name
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+
+    def _key(self, key: str) -> str:
+        return f"{self.tier.prefix}:{self.name}:{key}"
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.tier.prefix}:{self.name}:tag:{tag}"
+
+    @property
+    def _tag_ttl(self) -> float:
+        # Outlives every entry stored under the version, so "0" after expiry names nothing still cached.
+        return 2 * max(self.l1_ttl, self.l2_ttl)
+
+    async def _tag_version(self, tag: str) -> str:
+        tag_key = self._tag_key(tag)
+        version = self.tier.l1.get(tag_key)
+        if version is _MISSING:
+            raw = await self.tier.l2_call("get", tag_key)
+            version = raw.decode("utf-8") if raw else "0"
+            self.tier.l1.set(tag_key, version, self.l2_ttl)
+        return version
+
+    async def _full_key(self, key: str, tag: Optional[str]) -> str:
+        if tag is None:
+            return self._key(key)
+        return self._key(f"{key}@{tag}:{await self._tag_version(tag)}")
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], *, tag: Optional[str] = None) -> Any:
+        full_key = await self._full_key(key, tag)
+        value = self.tier.l1.get(full_key)
+        if value is not _MISSING:
+            return value
+        raw = await self.tier.l2_call("get", full_key)
+        if raw is not None:
+            try:
+                value = decode(raw)
+            except ValueError:
+                value = _MISSING
+            if value is not _MISSING:
+                self.tier.l1.set(full_key, value, self.l1_ttl)
+                return value
+        value = await loader()
+        await self._store(full_key, value)
+        return value
+
+    async def _store(self, full_key: str, value: Any) -> None:
+        self.tier.l1.set(full_key, value, self.l1_ttl)
+        try:
+            raw = encode(value)
+        except TypeError:
+            return
+        await self.tier.l2_call("set", full_key, raw, self.l2_ttl)
+
+    async def set(self, key: str, value: Any) -> None:
+        """Write-through after a committed update; peers drop their stale L1 copy."""
+        full_key = self._key(key)
+        await self._store(full_key, value)
+        await self.tier.broadcast([full_key])
+        self.tier.l1.set(full_key, value, self.l1_ttl)
+
+    async def invalidate(self, key: str) -> None:
+        full_key = self._key(key)
+        await self.tier.l2_call("delete", full_key)
+        await self.tier.broadcast([full_key])
+
+    async def invalidate_tag(self, tag: str) -> None:
+        tag_key = self._tag_key(tag)
+        # Random rather than incremented, so a version reused after the tag key expired cannot match old entries.
+        version = uuid.uuid4().hex[:16]
+        if self.tier.l2 is None:
+            self.tier.l1.set(tag_key, version, self._tag_ttl)
+            return
+        await self.tier.l2_call("set", tag_key, version.encode("utf-8"), self._tag_ttl)
+        await self.tier.broadcast([tag_key])
+
+
+cache_tier = CacheTier(connect_l2(os.getenv("CACHE_REDIS_URL")))
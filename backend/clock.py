@@ -0,0 +1,78 @@
+"""Process-wide time service; timestamps are integer epoch milliseconds (UTC) until the storage boundary.
+
+Wall time is derived from ``time.monotonic_ns`` anchored to ``time.time_ns``,
+so timestamps never step backwards within a process when NTP adjusts the
+system clock; the anchor is refreshed lazily every ``reanchor_seconds``.
+Reading the clock is two integer operations on one ``monotonic_ns`` call,
+so there is no background ticker. Convert to ``datetime`` or ISO strings only
+when talking to Supabase or building API responses.
+"""
+import time
+from datetime import datetime, timezone
+from typing import Optional, Union
+
+UTC = timezone.utc
+
+
+class Clock:
+    def __init__(self, *, reanchor_seconds: float = 60.0) -> None:
+        self.reanchor_seconds = reanchor_seconds
+        self._anchor()
+        self._last = 0
+
+    def _anchor(self) -> None:
+        self._wall_anchor_ns = time.time_ns()
+        self._mono_anchor_ns = time.monotonic_ns()
+        self._next_anchor_ns = self._mono_anchor_ns + int(self.reanchor_seconds * 1_000_000_000)
+
+    def now_ms(self) -> int:
+        """Precise epoch milliseconds; never smaller than a previously returned value."""
+        mono_ns = time.monotonic_ns()
+        if mono_ns >= self._next_anchor_ns:
+            self._anchor()
+        value = (self._wall_anchor_ns + mono_ns - self._mono_anchor_ns) // 1_000_000
+        if value < self._last:
+            return self._last
+        self._last = value
+        return value
+
+    def coarse_ms(self) -> int:
+        """Request-level stamps; kept as a separate name for call sites that do not need precision."""
+        return self.now_ms()
+
+
+def datetime_to_ms(value: Optional[datetime]) -> Optional[int]:
+    """Naive datetimes are taken as UTC, matching what the frontend and Supabase send."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return int(value.timestamp() * 1000)
+
+
+def ms_to_datetime(value: Optional[int]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value / 1000.0, tz=UTC)
+
+
+def ms_to_iso(value: int) -> str:
+    seconds, millis = divmod(int(value), 1000)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + f".{millis:03d}+00:00"
+
+
+def to_ms(value: Union[int, float, str, datetime, None]) -> Optional[int]:
+    """Normalise any stored timestamp representation (ms, ISO string, datetime) to epoch ms."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return datetime_to_ms(value)
+    if isinstance(value, str):
+        try:
+            return datetime_to_ms(datetime.fromisoformat(value.replace("Z", "+00:00")))
+        except ValueError:
+            return None
+    return int(value)
+
+
+clock = Clock()
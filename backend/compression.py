@@ -0,0 +1,207 @@
+"""Negotiated HTTP compression: gzip from the stdlib, zstd when ``zstandard`` is installed.
+
+``CompressionMiddleware`` compresses a response when all of these hold:
+
+- the client's ``Accept-Encoding`` allows a supported coding (zstd wins ties);
+- the content type is textual;
+- the body is at least ``COMPRESSION_MIN_BYTES`` long.
+
+Streamed responses such as timeline NDJSON are compressed chunk by chunk,
+with a flush after each chunk so nothing is held back. Event streams, media
+files and range responses pass through untouched. Strong ETags are downgraded
+to weak ones (``W/"..."``), which ``main._etag_matches`` accepts.
+
+``decompress`` undoes a request ``Content-Encoding`` and caps the decompressed
+size. ``compress`` is also used for request bodies sent upstream by
+``supabase_client``.
+"""
+import asyncio
+import io
+import os
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.datastructures import MutableHeaders
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Server preference when the client weighs codings equally.
+ENCODINGS: Tuple[str, ...] = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "") or 1024)
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "") or 6)
+ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "") or 3)
+# Compressing or decompressing bodies larger than this runs in a worker thread instead of on the event loop.
+OFFLOAD_BYTES = 1024 * 1024
+
+_COMPRESSIBLE_PREFIXES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "application/xml", "image/svg+xml")
+_PASSTHROUGH_TYPES = ("text/event-stream",)
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Best supported coding for an ``Accept-Encoding`` header, or None for identity."""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        if name:
+            weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class Compressor:
+    """Incremental encoder; ``compress`` output is flushed so it can be sent right away."""
+
+    def __init__(self, encoding: str, level: Optional[int] = None) -> None:
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._gzip = zlib.compressobj(GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+        elif encoding == "zstd" and zstandard is not None:
+            self._zstd = zstandard.ZstdCompressor(level=ZSTD_LEVEL if level is None else level).compressobj()
+        else:
+            raise UnsupportedEncoding(encoding)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "gzip":
+            return self._gzip.compress(chunk) + self._gzip.flush(zlib.Z_SYNC_FLUSH)
+        return self._zstd.compress(chunk) + self._zstd.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        if self.encoding == "gzip":
+            return self._gzip.flush(zlib.Z_FINISH)
+        return self._zstd.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    compressor = Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+
+def decompress(data: bytes, encoding: str, limit: int) -> bytes:
+    """Decode ``data``; raises ``BodyTooLarge`` past ``limit`` bytes and ``ValueError`` on corrupt input."""
+    encoding = encoding.strip().lower()
+    if encoding in ("", "identity"):
+        if len(data) > limit:
+            raise BodyTooLarge(limit)
+        return data
+    if encoding in ("gzip", "x-gzip"):
+        out = bytearray()
+        try:
+            while data:
+                # One decompressor per gzip member; concatenated members are valid gzip.
+                decoder = zlib.decompressobj(31)
+                out += decoder.decompress(data, limit + 1 - len(out))
+                if decoder.unconsumed_tail or len(out) > limit:
+                    raise BodyTooLarge(limit)
+                if not decoder.eof:
+                    raise ValueError("Truncated gzip body")
+                data = decoder.unused_data
+        except zlib.error as exc:
+            raise ValueError(f"Malformed gzip body: {exc}") from None
+        return bytes(out)
+    if encoding == "zstd" and zstandard is not None:
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+                out = reader.read(limit + 1)
+        except zstandard.ZstdError as exc:
+            raise ValueError(f"Malformed zstd body: {exc}") from None
+        if len(out) > limit:
+            raise BodyTooLarge(limit)
+        return out
+    raise UnsupportedEncoding(encoding)
+
+
+def _compressible(headers: MutableHeaders, status: int) -> bool:
+    if status < 200 or status in (204, 206, 304) or "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "").lower()
+    return content_type.startswith(_COMPRESSIBLE_PREFIXES) and not content_type.startswith(_PASSTHROUGH_TYPES)
+
+
+class CompressionMiddleware:
+    """Pure ASGI, so streamed responses keep streaming."""
+
+    def __init__(self, app: Any, *, minimum_size: int = MIN_BYTES) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value.decode("latin-1") for key, value in scope.get("headers", []) if key == b"accept-encoding"), "")
+        encoding = negotiate(accept) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        held: List[Dict[str, Any]] = []
+        state: Dict[str, Any] = {"mode": "pending", "compressor": None}
+
+        async def compressing_send(message: Dict[str, Any]) -> None:
+            mode = state["mode"]
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if _compressible(headers, message["status"]):
+                    headers.add_vary_header("Accept-Encoding")
+                    held.append(message)
+                else:
+                    state["mode"] = "identity"
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or mode == "identity":
+                await send(message)
+                return
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if mode == "pending":
+                start = held.pop()
+                headers = MutableHeaders(scope=start)
+                if not more and len(body) < self.minimum_size:
+                    state["mode"] = "identity"
+                    await send(start)
+                    await send(message)
+                    return
+                headers["Content-Encoding"] = encoding
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+                if not more:
+                    state["mode"] = "identity"
+                    compressed = await asyncio.to_thread(compress, body, encoding) if len(body) > OFFLOAD_BYTES else compress(body, encoding)
+                    headers["Content-Length"] = str(len(compressed))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": compressed, "more_body": False})
+                    return
+                del headers["Content-Length"]
+                state["mode"] = "stream"
+                state["compressor"] = Compressor(encoding)
+                await send(start)
+            compressor: Compressor = state["compressor"]
+            chunk = compressor.compress(body) if body else b""
+            if not more:
+                chunk += compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more})
+
+        await self.app(scope, receive, compressing_send)
@@ -0,0 +1,110 @@
+"""Compiled decoding for the hot ingestion request bodies.
+
+``msgspec`` is optional. When installed, ``decode`` parses and validates a
+raw body into structs that mirror the pydantic models in ``main.py`` (same
+names, defaults and ``ge``/``le`` bounds) in one pass, without building
+intermediate dicts or model instances. Bodies the strict decoder rejects,
+such as ``"3"`` for an int, are re-validated with the pydantic model. Accepted
+input and 422 responses therefore stay exactly what pydantic would produce.
+"""
+from datetime import datetime
+from typing import Annotated, Any, Dict, List, Optional, Type
+
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+AVAILABLE = msgspec is not None
+
+_DECODERS: Dict[str, Any] = {}
+
+if msgspec is not None:
+    NonNegativeInt = Annotated[int, msgspec.Meta(ge=0)]
+    NonNegativeFloat = Annotated[float, msgspec.Meta(ge=0.0)]
+    Fraction = Annotated[float, msgspec.Meta(ge=0.0, le=1.0)]
+
+    class _Struct(msgspec.Struct):
+        # The handlers treat payloads like pydantic models; keep the two methods they use.
+        def dict(self) -> Dict[str, Any]:
+            return msgspec.to_builtins(self)
+
+        def copy(self, deep: bool = False) -> "_Struct":
+            changes = {name: list(getattr(self, name)) for name in self.__struct_fields__ if deep and isinstance(getattr(self, name), list)}
+            return msgspec.structs.replace(self, **changes)
+
+    class EventItem(_Struct):
+        event_type: str
+        x: Optional[int] = None
+        y: Optional[int] = None
+        data: Optional[dict] = None
+        timestamp: Optional[datetime] = None
+        ts_ms: Optional[int] = None
+
+    class EventBatchRequest(_Struct):
+        events: List[EventItem]
+        batch_id: Optional[str] = None
+
+    class EndSessionRequest(_Struct):
+        ended_at: Optional[datetime] = None
+        duration_seconds: Optional[int] = None
+
+    class CursorDwellItem(_Struct):
+        target_key: str
+        duration_ms: NonNegativeInt
+        entry_count: Optional[NonNegativeInt] = 0
+        label: Optional[str] = None
+        center_x: Optional[int] = None
+        center_y: Optional[int] = None
+        radius: Optional[int] = None
+        metadata: Optional[dict] = None
+
+    class CursorDwellBatchRequest(_Struct):
+        items: List[CursorDwellItem]
+
+    class IngestSessionItem(_Struct):
+        psid: str
+        events: List[EventItem] = msgspec.field(default_factory=list)
+        cursor: List[CursorDwellItem] = msgspec.field(default_factory=list)
+        end: Optional[EndSessionRequest] = None
+
+    class IngestEnvelopeRequest(_Struct):
+        sessions: List[IngestSessionItem]
+        envelope_id: Optional[str] = None
+
+    class VideoProgressRequest(_Struct):
+        user_id: str
+        video_id: str
+        progress: Fraction
+        position_seconds: NonNegativeFloat
+        video_url: Optional[str] = None
+        duration_seconds: Optional[NonNegativeFloat] = None
+        stream_selected: Optional[str] = None
+        task_status: Optional[str] = None
+        event_name: Optional[str] = None
+        event_timestamp: Optional[datetime] = None
+        user_email: Optional[str] = None
+
+    for _struct in (EventBatchRequest, CursorDwellBatchRequest, IngestEnvelopeRequest, VideoProgressRequest):
+        _DECODERS[_struct.__name__] = msgspec.json.Decoder(_struct)
+
+
+def _validate(body: bytes, model: Type[BaseModel]) -> BaseModel:
+    try:
+        return model.model_validate_json(body or b"null")
+    except ValidationError as exc:
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in exc.errors()])
+
+
+def decode(body: bytes, model: Type[BaseModel]) -> Any:
+    """Decode ``body`` as ``model``: a struct when msgspec accepts it, otherwise the pydantic instance."""
+    decoder = _DECODERS.get(model.__name__)
+    if decoder is not None:
+        try:
+            return decoder.decode(body)
+        except msgspec.MsgspecError:
+            pass
+    return _validate(body, model)
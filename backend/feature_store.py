@@ -0,0 +1,346 @@
+"""Per-user engagement feature vectors and in-memory stream recommendations.
+
+Every user key owns a row of one float32 matrix; columns are interned
+features named ``dwell:<target>`` (seconds of cursor dwell),
+``stream:<id>`` (completion ratio of a stream's videos) and
+``score:<source>`` (points earned / possible for a score source). The
+ingestion handlers update single cells, so maintaining the store costs
+O(1) per write. Ranking multiplies the viewer's vector with a small
+stream-profile matrix that is rebuilt lazily after writes. The profile
+mixes the features attributed to each stream with the centroid of users
+who have largely completed it. The state is saved to an ``.npz`` file so
+a restart keeps what this worker has learned. Each worker leases its own
+file (``features-<slot>.npz`` next to ``path``, see ``worker_slots``)
+instead of all of them overwriting one; saving snapshots the arrays on the
+event loop and writes them in a thread.
+
+Keys and feature names come from clients, so both axes are bounded. Past
+``max_rows`` user keys the least recently used tenth of the rows is evicted.
+Past ``max_columns`` distinct dwell/score features, new names share one of
+``OVERFLOW_BUCKETS`` hashed columns per feature kind.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from prefetch import STREAM_SEQUENCES
+from worker_slots import claim_slot
+
+logger = logging.getLogger(__name__)
+
+# Mirrors the STREAMS list in my-app/app/study-streams/page.tsx.
+STREAM_IDS = ("consulting", "commerce", "math", "arts")
+# Users above this completion contribute to a stream's centroid.
+MEMBER_COMPLETION = 0.5
+CENTROID_WEIGHT = 0.5
+OVERFLOW_BUCKETS = 32
+
+
+def stream_of(text: Optional[str], streams: Sequence[str] = STREAM_IDS) -> Optional[str]:
+    """First stream id appearing as a token, e.g. ``next-video-consulting-segment-1`` -> ``consulting``."""
+    if not text:
+        return None
+    for token in re.split(r"[^a-z0-9]+", text.lower()):
+        if token in streams:
+            return token
+    return None
+
+
+def _unit(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+class FeatureStore:
+    def __init__(
+        self,
+        *,
+        streams: Sequence[str] = STREAM_IDS,
+        path: Optional[str] = None,
+        centroid_min_users: int = 3,
+        save_interval: float = 60.0,
+        max_rows: int = 20_000,
+        max_columns: int = 256,
+    ) -> None:
+        self.streams = tuple(streams)
+        self.path = path
+        self.centroid_min_users = centroid_min_users
+        self.save_interval = save_interval
+        self.max_rows = max(1, max_rows)
+        self.max_columns = max(1, max_columns)
+        # Least recently used first; values are dense matrix row indexes.
+        self._rows: "OrderedDict[str, int]" = OrderedDict()
+        self._cols: Dict[str, int] = {}
+        self._col_names: List[str] = []
+        self._col_stream: List[int] = []
+        self._matrix = np.zeros((64, 64), dtype=np.float32)
+        # Auxiliary state so ratios can be updated incrementally.
+        self._video_progress: Dict[Tuple[int, str], float] = {}
+        self._stream_progress: Dict[Tuple[int, int], float] = {}
+        self._stream_videos: Dict[Tuple[int, int], int] = {}
+        self._score_totals: Dict[Tuple[int, int], Tuple[float, float]] = {}
+        self._named_columns = 0
+        self._profile: Optional[np.ndarray] = None
+        self._dwell_mask: Optional[np.ndarray] = None
+        self._loaded = False
+        self._unsaved = False
+        self._slot_path: Optional[str] = None
+        self._lease = None
+
+    # -- interning ---------------------------------------------------------------
+
+    def _row(self, key: str) -> int:
+        self._load()
+        row = self._rows.get(key)
+        if row is not None:
+            self._rows.move_to_end(key)
+            return row
+        if len(self._rows) >= self.max_rows:
+            self._evict(len(self._rows) - self.max_rows + max(1, self.max_rows // 10))
+        row = self._rows[key] = len(self._rows)
+        self._grow()
+        return row
+
+    def _evict(self, count: int) -> None:
+        """Drop the ``count`` least recently used rows and renumber the rest densely."""
+        for _ in range(count):
+            self._rows.popitem(last=False)
+        kept = np.array(list(self._rows.values()), dtype=np.int64)
+        renumber = {int(old): new for new, old in enumerate(kept)}
+        self._matrix[: len(kept)] = self._matrix[kept]
+        self._matrix[len(kept) :] = 0.0
+        for key in self._rows:
+            self._rows[key] = renumber[self._rows[key]]
+        for state in (self._video_progress, self._stream_progress, self._stream_videos, self._score_totals):
+            moved = {(renumber[row], other): value for (row, other), value in state.items() if row in renumber}
+            state.clear()
+            state.update(moved)
+        self._touch()
+
+    def _col(self, name: str, stream: Optional[str]) -> int:
+        col = self._cols.get(name)
+        if col is not None:
+            return col
+        kind = name.partition(":")[0]
+        if kind != "stream" and self._named_columns >= self.max_columns:
+            # Attribution is meaningless for a column shared by unrelated names.
+            name, stream = f"{kind}:#{zlib.crc32(name.encode('utf-8')) % OVERFLOW_BUCKETS}", None
+            col = self._cols.get(name)
+            if col is not None:
+                return col
+        elif kind != "stream":
+            self._named_columns += 1
+        col = self._cols[name] = len(self._col_names)
+        self._col_names.append(name)
+        self._col_stream.append(self.streams.index(stream) if stream in self.streams else -1)
+        self._grow()
+        return col
+
+    def _grow(self) -> None:
+        rows, cols = self._matrix.shape
+        need_rows, need_cols = len(self._rows), len(self._col_names)
+        if need_rows <= rows and need_cols <= cols:
+            return
+        max_cols = self.max_columns + 2 * OVERFLOW_BUCKETS + len(self.streams)
+        grown = np.zeros((max(rows, need_rows, min(need_rows * 2, self.max_rows)), max(cols, need_cols, min(need_cols * 2, max_cols))), dtype=np.float32)
+        grown[:rows, :cols] = self._matrix
+        self._matrix = grown
+
+    def _touch(self) -> None:
+        self._profile = None
+        self._unsaved = True
+
+    # -- ingestion ---------------------------------------------------------------
+
+    def record_dwell(self, user_key: str, target_key: str, duration_ms: int, metadata: Optional[Dict[str, Any]] = None) -> None:
+        stream = (metadata or {}).get("stream") or stream_of(target_key, self.streams)
+        row = self._row(user_key)
+        col = self._col(f"dwell:{target_key}", stream)
+        self._matrix[row, col] += duration_ms / 1000.0
+        self._touch()
+
+    def record_progress(self, user_key: str, video_id: str, progress: float) -> None:
+        stream = stream_of(video_id, self.streams)
+        if stream is None:
+            return
+        row = self._row(user_key)
+        col = self._col(f"stream:{stream}", stream)
+        stream_index = self.streams.index(stream)
+        previous = self._video_progress.get((row, video_id))
+        if previous is not None and progress <= previous:
+            return
+        if previous is None:
+            self._stream_videos[(row, stream_index)] = self._stream_videos.get((row, stream_index), 0) + 1
+        self._video_progress[(row, video_id)] = progress
+        total = self._stream_progress.get((row, stream_index), 0.0) + progress - (previous or 0.0)
+        self._stream_progress[(row, stream_index)] = total
+        expected = max(len(STREAM_SEQUENCES.get(stream, ())), self._stream_videos[(row, stream_index)])
+        self._matrix[row, col] = min(1.0, total / expected)
+        self._touch()
+
+    def record_score(self, user_key: str, source: Optional[str], earned: float, possible: float) -> None:
+        source = source or "unknown"
+        row = self._row(user_key)
+        col = self._col(f"score:{source}", stream_of(source, self.streams))
+        total_earned, total_possible = self._score_totals.get((row, col), (0.0, 0.0))
+        total_earned += earned
+        total_possible += possible
+        self._score_totals[(row, col)] = (total_earned, total_possible)
+        self._matrix[row, col] = total_earned / total_possible if total_possible else 0.0
+        self._touch()
+
+    # -- scoring -----------------------------------------------------------------
+
+    def _transform(self, values: np.ndarray) -> np.ndarray:
+        # Dwell seconds are heavy-tailed; log1p keeps one long hover from dominating.
+        return np.where(self._dwell_mask, np.log1p(values), values)
+
+    def _build(self) -> None:
+        n_rows, n_cols = len(self._rows), len(self._col_names)
+        self._dwell_mask = np.array([name.startswith("dwell:") for name in self._col_names], dtype=bool)
+        features = self._transform(self._matrix[:n_rows, :n_cols])
+        profile = np.zeros((len(self.streams), n_cols), dtype=np.float32)
+        col_stream = np.array(self._col_stream, dtype=np.int64)
+        attributed = np.nonzero(col_stream >= 0)[0]
+        profile[col_stream[attributed], attributed] = 1.0
+        profile = _unit(profile)
+        for index, stream in enumerate(self.streams):
+            col = self._cols.get(f"stream:{stream}")
+            if col is None:
+                continue
+            members = features[:, col] >= MEMBER_COMPLETION
+            if int(members.sum()) >= self.centroid_min_users:
+                profile[index] += CENTROID_WEIGHT * _unit(features[members].mean(axis=0))
+        self._profile = _unit(profile)
+
+    def user_vector(self, keys: Iterable[str]) -> np.ndarray:
+        """Sum of the rows for every identity alias of one viewer."""
+        self._load()
+        vector = np.zeros(len(self._col_names), dtype=np.float32)
+        for key in set(keys):
+            row = self._rows.get(key)
+            if row is not None:
+                self._rows.move_to_end(key)
+                vector += self._matrix[row, : len(self._col_names)]
+        return vector
+
+    def recommend(self, keys: Iterable[str]) -> Tuple[List[Dict[str, Any]], float]:
+        """Return streams ranked by cosine similarity and the scoring time in milliseconds."""
+        self._load()
+        if self._profile is None or self._profile.shape[1] != len(self._col_names):
+            self._build()
+        vector = self.user_vector(keys)
+        started = time.perf_counter()
+        user = _unit(self._transform(vector))
+        scores = self._profile @ user
+        order = np.argsort(-scores, kind="stable")
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        ranked = []
+        for index in order:
+            stream = self.streams[index]
+            col = self._cols.get(f"stream:{stream}")
+            ranked.append(
+                {
+                    "stream": stream,
+                    "score": round(float(scores[index]), 4),
+                    "completion": round(float(vector[col]), 4) if col is not None else 0.0,
+                }
+            )
+        return ranked, elapsed_ms
+
+    # -- persistence -------------------------------------------------------------
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path:
+            return
+        base, extension = os.path.splitext(self.path)
+        slot, self._lease = claim_slot(lambda slot: f"{base}-{slot}{extension}.lease")
+        self._slot_path = f"{base}-{slot}{extension}"
+        if not os.path.exists(self._slot_path):
+            return
+        try:
+            with np.load(self._slot_path, allow_pickle=False) as data:
+                rows = [str(key) for key in data["rows"]]
+                cols = [str(name) for name in data["cols"]]
+                self._rows = OrderedDict((key, index) for index, key in enumerate(rows))
+                self._cols = {name: index for index, name in enumerate(cols)}
+                self._col_names = cols
+                self._named_columns = sum(1 for name in cols if not name.startswith("stream:") and ":#" not in name)
+                self._col_stream = [int(value) for value in data["col_stream"]]
+                self._matrix = np.zeros((max(64, len(rows) * 2), max(64, len(cols) * 2)), dtype=np.float32)
+                self._matrix[: len(rows), : len(cols)] = data["matrix"]
+                for row, video, value in zip(data["vp_rows"], data["vp_videos"], data["vp_values"]):
+                    self._video_progress[(int(row), str(video))] = float(value)
+                for (row, video), value in self._video_progress.items():
+                    stream = stream_of(video, self.streams)
+                    key = (row, self.streams.index(stream))
+                    self._stream_progress[key] = self._stream_progress.get(key, 0.0) + value
+                    self._stream_videos[key] = self._stream_videos.get(key, 0) + 1
+                for row, col, earned, possible in zip(data["sc_rows"], data["sc_cols"], data["sc_earned"], data["sc_possible"]):
+                    self._score_totals[(int(row), int(col))] = (float(earned), float(possible))
+        except (OSError, KeyError, ValueError):
+            logger.warning("Could not load feature store from %s; starting empty", self._slot_path, exc_info=True)
+
+    def snapshot(self) -> Optional[Dict[str, np.ndarray]]:
+        """Copies of the state to save, or None when nothing changed; call on the event loop."""
+        if self._slot_path is None or not self._unsaved:
+            return None
+        progress = list(self._video_progress.items())
+        scores = list(self._score_totals.items())
+        self._unsaved = False
+        return {
+            "rows": np.array(sorted(self._rows, key=self._rows.__getitem__), dtype=str),
+            "cols": np.array(self._col_names, dtype=str),
+            "col_stream": np.array(self._col_stream, dtype=np.int16),
+            "matrix": self._matrix[: len(self._rows), : len(self._col_names)].copy(),
+            "vp_rows": np.array([row for (row, _video), _value in progress], dtype=np.int64),
+            "vp_videos": np.array([video for (_row, video), _value in progress], dtype=str),
+            "vp_values": np.array([value for _key, value in progress], dtype=np.float32),
+            "sc_rows": np.array([row for (row, _col), _totals in scores], dtype=np.int64),
+            "sc_cols": np.array([col for (_row, col), _totals in scores], dtype=np.int64),
+            "sc_earned": np.array([totals[0] for _key, totals in scores], dtype=np.float64),
+            "sc_possible": np.array([totals[1] for _key, totals in scores], dtype=np.float64),
+        }
+
+    def _write(self, path: str, snapshot: Dict[str, np.ndarray]) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, **snapshot)
+        os.replace(tmp_path, path)
+
+    async def save(self) -> None:
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return
+        try:
+            await asyncio.to_thread(self._write, self._slot_path, snapshot)
+        except Exception:
+            self._unsaved = True
+            raise
+
+    async def run(self) -> None:
+        """Periodically persist the store; run as a background task."""
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save()
+            except Exception:
+                logger.exception("Saving the feature store failed")
+
+
+feature_store = FeatureStore(
+    path=os.getenv("FEATURE_STORE_PATH") or os.path.join(os.path.dirname(__file__), "data", "features.npz"),
+    save_interval=float(os.getenv("FEATURE_STORE_SAVE_SECONDS", "") or 60.0),
+    max_rows=int(os.getenv("FEATURE_STORE_MAX_ROWS", "") or 20_000),
+    max_columns=int(os.getenv("FEATURE_STORE_MAX_COLUMNS", "") or 256),
+)
@@ -0,0 +1,174 @@
+"""Cursor heatmaps binned from raw event coordinates, cached per page per hour.
+
+Each (page, hour, user, event type) bucket keeps a fixed-resolution count
+grid of ``BASE_CELL_PX`` cells over a ``MAX_WIDTH`` x ``MAX_HEIGHT`` pixel
+canvas, plus the highest event id folded into it. Refreshing a bucket only
+fetches events with a larger id, so an open hour is re-binned incrementally.
+Ids can commit out of order and the telemetry spool replays events late, so
+the id keyset may skip some. Once an hour is older than ``settle_seconds``
+and ``can_settle()`` allows it (no spooled writes pending), the hour is
+re-scanned in full one last time and then never fetched again.
+A request sums the hourly grids and block-sums them down to the requested
+cell size. A base grid is about 130 KB, so the range is capped at
+``MAX_RANGE_HOURS``, the cache holds at most ``max_grids`` of them and no
+more than ``max_concurrency`` hours are fetched at once.
+"""
+import asyncio
+import base64
+import math
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from clock import clock
+
+HOUR_MS = 3_600_000
+BASE_CELL_PX = 16
+MAX_WIDTH = 3840
+MAX_HEIGHT = 2160
+GRID_SHAPE = (MAX_HEIGHT // BASE_CELL_PX, MAX_WIDTH // BASE_CELL_PX)
+MAX_RANGE_HOURS = 24 * 7
+
+# loader(page, start_ms, end_ms, after_id, user_id, event_type, limit) -> rows with id, x, y
+PointLoader = Callable[[str, int, int, int, Optional[int], Optional[str], int], Awaitable[List[Dict[str, Any]]]]
+BucketKey = Tuple[str, int, Optional[int], Optional[str]]
+
+
+class _HourGrid:
+    __slots__ = ("counts", "last_id", "checked_at", "settled")
+
+    def __init__(self) -> None:
+        self.counts: Optional[np.ndarray] = None  # allocated on the first point
+        self.last_id = 0
+        self.checked_at = 0.0
+        self.settled = False
+
+
+def bin_points(rows: List[Dict[str, Any]], counts: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """Add event coordinates to a base grid; points outside the canvas are dropped."""
+    if not rows:
+        return counts
+    xs = np.fromiter((row["x"] for row in rows), dtype=np.int64, count=len(rows))
+    ys = np.fromiter((row["y"] for row in rows), dtype=np.int64, count=len(rows))
+    inside = (xs >= 0) & (xs < MAX_WIDTH) & (ys >= 0) & (ys < MAX_HEIGHT)
+    # Fixed-width 2D histogram: flatten cell coordinates and count them in one pass.
+    cells = (ys[inside] // BASE_CELL_PX) * GRID_SHAPE[1] + xs[inside] // BASE_CELL_PX
+    binned = np.bincount(cells, minlength=GRID_SHAPE[0] * GRID_SHAPE[1]).astype(np.uint32).reshape(GRID_SHAPE)
+    if counts is None:
+        return binned
+    counts += binned
+    return counts
+
+
+def rebin(counts: np.ndarray, cell: int, width: int, height: int) -> np.ndarray:
+    """Crop the base grid to ``width`` x ``height`` pixels and block-sum it into ``cell``-pixel bins."""
+    factor = cell // BASE_CELL_PX
+    rows = math.ceil(height / cell)
+    cols = math.ceil(width / cell)
+    cropped = np.zeros((rows * factor, cols * factor), dtype=np.uint32)
+    source = counts[: rows * factor, : cols * factor]
+    cropped[: source.shape[0], : source.shape[1]] = source
+    return cropped.reshape(rows, factor, cols, factor).sum(axis=(1, 3), dtype=np.uint32)
+
+
+def encode_counts(counts: np.ndarray) -> str:
+    """Row-major little-endian uint32 counts, base64 encoded."""
+    return base64.b64encode(counts.astype("<u4").tobytes()).decode("ascii")
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+def encode_png(counts: np.ndarray) -> bytes:
+    """Render counts as an RGBA PNG: log-scaled black-red-yellow-white ramp, empty cells transparent."""
+    scaled = np.log1p(counts.astype(np.float32))
+    peak = float(scaled.max())
+    level = scaled / peak if peak > 0 else scaled
+    rgba = np.empty(counts.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = np.clip(level * 3.0, 0.0, 1.0) * 255
+    rgba[..., 1] = np.clip(level * 3.0 - 1.0, 0.0, 1.0) * 255
+    rgba[..., 2] = np.clip(level * 3.0 - 2.0, 0.0, 1.0) * 255
+    rgba[..., 3] = np.where(counts > 0, 96 + level * 159, 0).astype(np.uint8)
+    height, width = counts.shape
+    # Each scanline is prefixed with filter type 0 (None).
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)]).tobytes()
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", header) + _png_chunk(b"IDAT", zlib.compress(raw, 6)) + _png_chunk(b"IEND", b"")
+
+
+class HeatmapCache:
+    def __init__(
+        self,
+        loader: PointLoader,
+        *,
+        max_grids: int = 256,
+        refresh_seconds: float = 30.0,
+        settle_seconds: float = 600.0,
+        page_size: int = 1000,
+        max_concurrency: int = 4,
+        can_settle: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        self.loader = loader
+        self.can_settle = can_settle
+        self.max_grids = max_grids
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.refresh_seconds = refresh_seconds
+        self.settle_seconds = settle_seconds
+        self.page_size = page_size
+        self._grids: "OrderedDict[BucketKey, _HourGrid]" = OrderedDict()
+        self._inflight: Dict[BucketKey, "asyncio.Task[_HourGrid]"] = {}
+
+    async def grid(self, page: str, start_ms: int, end_ms: int, *, user_id: Optional[int] = None, event_type: Optional[str] = None) -> np.ndarray:
+        """Summed base grid for every hour overlapping ``[start_ms, end_ms)``."""
+        first_hour = start_ms // HOUR_MS
+        last_hour = -(-end_ms // HOUR_MS)
+        hours = await asyncio.gather(*(self._hour((page, hour, user_id, event_type)) for hour in range(first_hour, last_hour)))
+        total = np.zeros(GRID_SHAPE, dtype=np.uint32)
+        for hour in hours:
+            if hour.counts is not None:
+                total += hour.counts
+        return total
+
+    async def _hour(self, key: BucketKey) -> _HourGrid:
+        grid = self._grids.get(key)
+        if grid is not None:
+            self._grids.move_to_end(key)
+            if grid.settled or time.monotonic() - grid.checked_at < self.refresh_seconds:
+                return grid
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._refresh(key, grid or _HourGrid()))
+            task.add_done_callback(lambda _task: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _refresh(self, key: BucketKey, grid: _HourGrid) -> _HourGrid:
+        page, hour, user_id, event_type = key
+        start_ms, end_ms = hour * HOUR_MS, (hour + 1) * HOUR_MS
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            # Decide before fetching so events committed during the fetch are not skipped.
+            settled = clock.coarse_ms() >= end_ms + self.settle_seconds * 1000 and (self.can_settle is None or self.can_settle())
+            # The final fetch starts from scratch to pick up events the incremental keyset skipped.
+            counts, last_id = (None, 0) if settled else (grid.counts, grid.last_id)
+            while True:
+                rows = await self.loader(page, start_ms, end_ms, last_id, user_id, event_type, self.page_size)
+                counts = bin_points(rows, counts)
+                if rows:
+                    last_id = max(int(row["id"]) for row in rows)
+                if len(rows) < self.page_size:
+                    break
+        grid.counts, grid.last_id = counts, last_id
+        grid.checked_at = time.monotonic()
+        grid.settled = settled
+        self._grids[key] = grid
+        self._grids.move_to_end(key)
+        while len(self._grids) > self.max_grids:
+            self._grids.popitem(last=False)
+        return grid
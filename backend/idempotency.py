@@ -0,0 +1,134 @@
+"""Bounded dedupe store for ``Idempotency-Key`` protected endpoints."""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 200
+
+
+class IdempotencyStore:
+    """LRU of completed responses keyed by idempotency key, with optional JSON-lines persistence.
+
+    Concurrent requests carrying the same key share the first request's
+    result instead of running the handler twice. Failed handlers leave no
+    entry behind so the client can retry.
+    """
+
+    def __init__(self, *, max_entries: int = 50_000, ttl_seconds: float = 24 * 3600, path: Optional[str] = None) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._in_flight: Dict[str, "asyncio.Future[Any]"] = {}
+        self._loaded = False
+        self._log = None
+        self._log_lines = 0
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._log_lines += 1
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("t", 0) >= cutoff:
+                        self._remember(record["k"], record.get("r"), record["t"])
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._log = open(self.path, "a", encoding="utf-8")
+
+    def _remember(self, key: str, result: Any, stored_at: float) -> None:
+        self._entries[key] = (stored_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _persist(self, key: str, result: Any, stored_at: float) -> None:
+        if self._log is None:
+            return
+        self._log.write(json.dumps({"k": key, "t": stored_at, "r": result}, separators=(",", ":"), default=str) + "\n")
+        self._log.flush()
+        self._log_lines += 1
+        if self._log_lines > 2 * self.max_entries:
+            self._compact()
+
+    def _compact(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, (stored_at, result) in self._entries.items():
+                f.write(json.dumps({"k": key, "t": stored_at, "r": result}, separators=(",", ":"), default=str) + "\n")
+        self._log.close()
+        os.replace(tmp_path, self.path)
+        self._log = open(self.path, "a", encoding="utf-8")
+        self._log_lines = len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        self._load()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, result = entry
+        if time.time() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    async def run(self, key: str, handler: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return ``(result, replayed)``; ``handler`` runs at most once per key while the entry lives."""
+        cached = self.get(key)
+        if cached is not None:
+            return cached, True
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending), True
+        future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await handler()
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            stored_at = time.time()
+            self._remember(key, result, stored_at)
+            try:
+                self._persist(key, result, stored_at)
+            except OSError:
+                logger.warning("Failed to persist idempotency key", exc_info=True)
+            return result, False
+        finally:
+            self._in_flight.pop(key, None)
+
+
+def normalize_key(raw: Optional[str]) -> Optional[str]:
+    if not raw:
+        return None
+    key = raw.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None
+    return key
+
+
+idempotency_store = IdempotencyStore(
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "") or 50_000),
+    ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "") or 24 * 3600),
+    path=os.getenv("IDEMPOTENCY_STORE_PATH") or None,
+)
@@ -0,0 +1,99 @@
+"""In-process pub/sub feeding the ``/live/updates`` Server-Sent Events stream.
+
+Handlers publish after a write commits; every open stream subscribed to the
+topic receives the event without touching Supabase. Each subscriber owns a
+bounded queue, and a slow tab drops its oldest events rather than holding
+memory. When a relay is attached (the cache tier's L2 pub/sub), events also
+reach streams held by other workers.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+Relay = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Comment frames keep proxies from closing idle streams.
+HEARTBEAT_SECONDS = float(os.getenv("LIVE_UPDATES_HEARTBEAT_SECONDS", "") or 15.0)
+
+
+class Subscription:
+    def __init__(self, topics: Iterable[str], max_queue: int) -> None:
+        self.topics = frozenset(topics)
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def offer(self, message: Dict[str, Any]) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class LiveBroker:
+    def __init__(self, *, max_subscribers: int = 1000, max_queue: int = 32) -> None:
+        self.max_subscribers = max_subscribers
+        self.max_queue = max_queue
+        self.relay: Optional[Relay] = None
+        self.origin = uuid.uuid4().hex
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self._count = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return self._count
+
+    def subscribe(self, topics: Iterable[str]) -> Optional[Subscription]:
+        """Register a subscriber; None when this worker already holds ``max_subscribers`` streams."""
+        if self._count >= self.max_subscribers:
+            return None
+        subscription = Subscription(topics, self.max_queue)
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        for topic in subscription.topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._topics[topic]
+        self._count -= 1
+
+    def deliver(self, message: Dict[str, Any]) -> None:
+        """Fan a message out to local subscribers; also the entry point for relayed messages."""
+        if message.get("origin") == self.origin and message.get("relayed"):
+            return
+        for subscription in list(self._topics.get(message["topic"], ())):
+            subscription.offer(message)
+
+    async def publish(self, topic: str, event: str, data: Any) -> None:
+        message = {"topic": topic, "event": event, "data": data, "origin": self.origin}
+        self.deliver(message)
+        if self.relay is not None:
+            try:
+                await self.relay(dict(message, relayed=True))
+            except Exception:
+                logger.warning("Relaying live update failed", exc_info=True)
+
+
+def format_sse(event: str, data: Any, event_id: Optional[int] = None) -> bytes:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":"), default=str))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+live_updates = LiveBroker(
+    max_subscribers=int(os.getenv("LIVE_UPDATES_MAX_SUBSCRIBERS", "") or 1000),
+    max_queue=int(os.getenv("LIVE_UPDATES_QUEUE", "") or 32),
+)
@@ -0,0 +1,287 @@
+"""Queue-based structured logging.
+
+``configure()`` puts one ``QueuedHandler`` on the root logger and on
+uvicorn's loggers. On the calling thread it does only constant work:
+
+- a duplicate check;
+- capturing the request's correlation id;
+- a non-blocking put on a bounded queue.
+
+A daemon writer thread formats each record as one JSON line, tracebacks
+included, and writes it to stderr and, when ``LOG_FILE`` is set, that file.
+
+Repeats of the same warning or error (same logger, call site, message
+template and exception type) are counted, not queued, after
+``LOG_DUPLICATE_BURST`` occurrences within ``LOG_DUPLICATE_WINDOW_SECONDS``.
+The writer reports each suppressed count once the window closes. When the
+queue is full, records are dropped and counted the same way. During an error
+storm the event loop therefore never waits on formatting or disk.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
+REQUEST_ID_HEADER = "x-request-id"
+_VALID_REQUEST_ID = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+_MAX_DUPLICATE_KEYS = 1024
+# Attributes every LogRecord has; anything else was passed through ``extra=`` and is emitted as a field.
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "correlation_id"}
+
+_Key = Tuple[str, str, int, Any, Optional[type]]
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class _DuplicateWindow:
+    __slots__ = ("started", "seen", "suppressed", "sample")
+
+    def __init__(self, started: float) -> None:
+        self.started = started
+        self.seen = 0
+        self.suppressed = 0
+        self.sample: Optional[logging.LogRecord] = None
+
+
+class QueuedHandler(logging.Handler):
+    def __init__(self, *, max_queue: int = 10_000, duplicate_window: float = 10.0, duplicate_burst: int = 5) -> None:
+        super().__init__()
+        self.queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self.duplicate_window = duplicate_window
+        self.duplicate_burst = duplicate_burst
+        self.dropped = 0
+        self._windows: Dict[_Key, _DuplicateWindow] = {}
+        self._closed: List[_DuplicateWindow] = []
+        self._windows_lock = threading.Lock()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if record.levelno >= logging.WARNING and self._suppress(record):
+                return
+            # The message is rendered now because its args may change after this call returns.
+            # The traceback is kept as objects and only formatted on the writer thread.
+            record.msg = record.getMessage()
+            record.args = None
+            record.correlation_id = correlation_id.get()
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _suppress(self, record: logging.LogRecord) -> bool:
+        exc_type = record.exc_info[0] if record.exc_info else None
+        key = (record.name, record.pathname, record.lineno, record.msg, exc_type)
+        now = time.monotonic()
+        with self._windows_lock:
+            window = self._windows.get(key)
+            if window is None or now - window.started >= self.duplicate_window:
+                if window is None and len(self._windows) >= _MAX_DUPLICATE_KEYS:
+                    return False
+                if window is not None and window.suppressed:
+                    self._closed.append(window)
+                window = self._windows[key] = _DuplicateWindow(now)
+            window.seen += 1
+            if window.seen <= self.duplicate_burst:
+                return False
+            window.suppressed += 1
+            window.sample = record
+            return True
+
+    def sweep(self, *, final: bool = False) -> List[logging.LogRecord]:
+        """Summary records for windows that closed with suppressed repeats (all windows when ``final``)."""
+        now = time.monotonic()
+        with self._windows_lock:
+            closed, self._closed = self._closed, []
+            for key, window in list(self._windows.items()):
+                if final or now - window.started >= self.duplicate_window:
+                    del self._windows[key]
+                    closed.append(window)
+            dropped, self.dropped = self.dropped, 0
+        summaries = [_summary(window.sample, window.suppressed) for window in closed if window.suppressed and window.sample is not None]
+        if dropped:
+            summaries.append(logging.makeLogRecord({"name": __name__, "levelno": logging.WARNING, "levelname": "WARNING", "msg": f"Log queue full; dropped {dropped} records"}))
+        return summaries
+
+
+def _summary(sample: logging.LogRecord, count: int) -> logging.LogRecord:
+    record = logging.makeLogRecord(
+        {
+            "name": sample.name,
+            "levelno": sample.levelno,
+            "levelname": sample.levelname,
+            "pathname": sample.pathname,
+            "lineno": sample.lineno,
+            "msg": f"Suppressed {count} repeats: {sample.getMessage()}",
+        }
+    )
+    record.suppressed = count
+    record.correlation_id = getattr(sample, "correlation_id", None)
+    return record
+
+
+def format_record(record: logging.LogRecord) -> str:
+    entry: Dict[str, Any] = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+        "level": record.levelname,
+        "logger": record.name,
+        "msg": record.getMessage(),
+    }
+    if getattr(record, "correlation_id", None):
+        entry["correlation_id"] = record.correlation_id
+    if record.levelno >= logging.WARNING:
+        entry["at"] = f"{record.pathname}:{record.lineno}"
+    for key, value in vars(record).items():
+        if key not in _RECORD_ATTRS and not key.startswith("_"):
+            entry[key] = value
+    if record.exc_info and record.exc_info[0] is not None:
+        entry["exc"] = "".join(traceback.format_exception(*record.exc_info))
+    elif record.exc_text:
+        entry["exc"] = record.exc_text
+    return json.dumps(entry, default=str)
+
+
+class _Flush:
+    """Queue marker; the writer sets ``done`` once everything queued before it is written."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+
+
+class LogWriter:
+    """Drains a ``QueuedHandler`` on a daemon thread and writes JSON lines to the given streams."""
+
+    def __init__(self, handler: QueuedHandler, streams: List[TextIO], *, sweep_seconds: float = 1.0) -> None:
+        self.handler = handler
+        self.streams = streams
+        self.sweep_seconds = sweep_seconds
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Write everything queued so far, plus all pending duplicate summaries."""
+        marker = _Flush()
+        try:
+            self.handler.queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def _run(self) -> None:
+        next_sweep = time.monotonic() + self.sweep_seconds
+        while True:
+            try:
+                batch = [self.handler.queue.get(timeout=self.sweep_seconds)]
+            except queue.Empty:
+                batch = []
+            while len(batch) < 512 and not isinstance(batch[-1] if batch else None, _Flush):
+                try:
+                    batch.append(self.handler.queue.get_nowait())
+                except queue.Empty:
+                    break
+            flushes = [item for item in batch if isinstance(item, _Flush)]
+            records = [item for item in batch if not isinstance(item, _Flush)]
+            if flushes or time.monotonic() >= next_sweep:
+                # A flush reports open windows too; it usually precedes shutdown.
+                records.extend(self.handler.sweep(final=bool(flushes)))
+                next_sweep = time.monotonic() + self.sweep_seconds
+            if records:
+                self._write(records)
+            for marker in flushes:
+                marker.done.set()
+
+    def _write(self, records: List[logging.LogRecord]) -> None:
+        lines = []
+        for record in records:
+            try:
+                lines.append(format_record(record))
+            except Exception:
+                lines.append(json.dumps({"level": "ERROR", "logger": __name__, "msg": f"Unformattable record from {record.name}"}))
+        text = "\n".join(lines) + "\n"
+        for stream in self.streams:
+            try:
+                stream.write(text)
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+
+
+_writer: Optional[LogWriter] = None
+
+
+def configure() -> Optional[LogWriter]:
+    """Install the pipeline once per process; ``LOG_PIPELINE=0`` keeps the stock logging setup."""
+    global _writer
+    if _writer is not None or os.getenv("LOG_PIPELINE", "1").lower() in ("0", "false", "no"):
+        return _writer
+    handler = QueuedHandler(
+        max_queue=int(os.getenv("LOG_QUEUE_SIZE", "") or 10_000),
+        duplicate_window=float(os.getenv("LOG_DUPLICATE_WINDOW_SECONDS", "") or 10.0),
+        duplicate_burst=int(os.getenv("LOG_DUPLICATE_BURST", "") or 5),
+    )
+    streams: List[TextIO] = [sys.stderr]
+    if os.getenv("LOG_FILE"):
+        streams.append(open(os.environ["LOG_FILE"], "a", encoding="utf-8"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    # uvicorn configures its loggers before importing the app; route them (and its
+    # "Exception in ASGI application" tracebacks) through the queue as well.
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers = []
+        logger.propagate = True
+    _writer = LogWriter(handler, streams)
+    _writer.start()
+    atexit.register(flush)
+    return _writer
+
+
+def flush() -> None:
+    """Drain the queue; called on app shutdown. The writer keeps running for later records."""
+    if _writer is not None:
+        _writer.flush()
+
+
+class CorrelationIdMiddleware:
+    """Binds ``correlation_id`` per request from ``X-Request-ID`` (or a new id) and echoes it back."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        supplied = next((value.decode("latin-1") for key, value in scope.get("headers", []) if key == REQUEST_ID_HEADER.encode()), "")
+        request_id = supplied if _VALID_REQUEST_ID.fullmatch(supplied) else new_correlation_id()
+        token = correlation_id.set(request_id)
+
+        async def send_with_id(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (REQUEST_ID_HEADER.encode(), request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            correlation_id.reset(token)
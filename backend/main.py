@@ -1,16 +1,24 @@
 """FastAPI backend for exploreyou project using Supabase as the datastore."""
 
+import asyncio
+import hashlib
+import hmac
+import ipaddress
 import json
+import logging
+import mimetypes
 import os
 import uuid
-from datetime import datetime, timedelta
-import datetime as _dt
+from contextlib import asynccontextmanager
+from datetime import datetime
 from types import SimpleNamespace
-from typing import Dict, List, Optional, Sequence, Tuple
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Type
+from urllib.parse import quote
 
-from fastapi import FastAPI, HTTPException, Request, Response, status
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 try:
@@ -20,10 +28,31 @@ try:
 except ImportError:
     pass
 
-from passlib.context import CryptContext
-
-from supabase_client import close_client as close_supabase_client, is_enabled as supabase_enabled
+import log_pipeline
+
+log_pipeline.configure()
+
+from cache import TieredCache, cache_tier
+from clock import clock, datetime_to_ms, ms_to_iso, to_ms
+from compression import OFFLOAD_BYTES as DECOMPRESS_OFFLOAD_BYTES, BodyTooLarge, CompressionMiddleware, UnsupportedEncoding, decompress
+from fast_decode import decode as decode_body
+from feature_store import feature_store
+from heatmap import BASE_CELL_PX, HOUR_MS, MAX_HEIGHT, MAX_RANGE_HOURS, MAX_WIDTH, HeatmapCache, encode_counts, encode_png, rebin
+from idempotency import idempotency_store, normalize_key as normalize_idempotency_key
+from live_updates import HEARTBEAT_SECONDS as LIVE_HEARTBEAT_SECONDS, format_sse, live_updates
+from prefetch import STREAM_SEQUENCES, predict as predict_next_clips
+from rate_limit import RateLimitExceeded, admit_telemetry
+from readiness import Readiness
+from replay import ReplayCache, dwell_item, event_pages, merge_timeline, move_item, progress_item
+from scheduler import Scheduler
+from session_tokens import anonymous_tokens, is_anonymous as is_anonymous_token
+from supabase_client import close_client as close_supabase_client, connect as connect_supabase, is_enabled as supabase_enabled, probe_table
 import supabase_repo as sb_repo
+from video_cache import is_safe_name as is_safe_video_name, video_cache
+from video_catalog import VideoCatalog
+from telemetry_spool import STAGE_DONE, SpoolRecord, is_transient_failure, telemetry_spool
+from traffic_capture import TrafficCaptureMiddleware, recorder_from_env as traffic_recorder_from_env
+from trajectory import STORAGE_ENABLED as TRAJECTORY_STORAGE_ENABLED, decode_segment
 
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, "data")
@@ -31,12 +60,84 @@ USERS_FILE = os.path.join(DATA_DIR, "users.json")
 VIDEOS_FILE = os.path.join(DATA_DIR, "videos.json")
 TEXTS_FILE = os.path.join(DATA_DIR, "texts.json")
 
-if not supabase_enabled():
-    raise RuntimeError("Supabase credentials are required to run the backend")
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Tables the handlers below read or write; probed during warm-up so a missing migration fails readiness, not a request.
+SUPABASE_TABLES = sb_repo.TABLES + ((sb_repo.CURSOR_TRAJECTORIES_TABLE,) if TRAJECTORY_STORAGE_ENABLED else ())
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+_pwd_context = None
+readiness = Readiness()
+scheduler = Scheduler(
+    sb_repo.try_acquire_lease,
+    sb_repo.release_lease,
+    lease_seconds=int(os.getenv("SCHEDULER_LEASE_SECONDS", "") or 30),
+)
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1").lower() not in ("0", "false", "no")
+# Proxies (IPs or CIDRs, comma separated) whose X-Forwarded-For is honoured when rate limiting by client IP.
+TRUSTED_PROXIES = [ipaddress.ip_network(value.strip(), strict=False) for value in os.getenv("TRUSTED_PROXIES", "").split(",") if value.strip()]
+# Cap on compressed ingestion bodies once inflated, so a small upload cannot expand without bound.
+MAX_DECOMPRESSED_BODY_BYTES = int(os.getenv("MAX_DECOMPRESSED_BODY_BYTES", "") or 16 * 1024 * 1024)
+
+
+def _password_context():
+    """passlib and the bcrypt backend load on first use instead of at import."""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not supabase_enabled():
+        raise RuntimeError("Supabase credentials are required to run the backend")
+    if not os.getenv("SESSION_TOKEN_SECRET") and (os.getenv("IDEMPOTENCY_STORE_PATH") or os.getenv("TELEMETRY_SPOOL_DIR")):
+        # Persisted idempotency and spool keys hold _caller_hash values, which a per-process random key breaks.
+        raise RuntimeError("SESSION_TOKEN_SECRET is required when IDEMPOTENCY_STORE_PATH or TELEMETRY_SPOOL_DIR is set")
+    await cache_tier.start()
+    app.state.telemetry_replayer = asyncio.create_task(telemetry_spool.run())
+    app.state.catalog_refresher = asyncio.create_task(video_catalog.run())
+    app.state.feature_saver = asyncio.create_task(feature_store.run())
+    app.state.warmup = asyncio.create_task(readiness.warm_up())
+    app.state.scheduler = asyncio.create_task(scheduler.run()) if SCHEDULER_ENABLED else None
+    try:
+        yield
+    finally:
+        app.state.warmup.cancel()
+        if app.state.scheduler is not None:
+            app.state.scheduler.cancel()
+            await asyncio.gather(app.state.scheduler, return_exceptions=True)
+        app.state.telemetry_replayer.cancel()
+        app.state.catalog_refresher.cancel()
+        app.state.feature_saver.cancel()
+        await feature_store.save()
+        await telemetry_spool.close()
+        if traffic_recorder is not None:
+            await asyncio.to_thread(traffic_recorder.close)
+        await cache_tier.close()
+        await close_supabase_client()
+        log_pipeline.flush()
+
+
+app = FastAPI(lifespan=lifespan)
+
+session_cache = TieredCache(cache_tier, "session", l1_ttl=30.0, l2_ttl=300.0)
+user_cache = TieredCache(cache_tier, "user", l1_ttl=30.0, l2_ttl=300.0)
+score_cache = TieredCache(cache_tier, "score", l1_ttl=10.0, l2_ttl=300.0)
+progress_cache = TieredCache(cache_tier, "video_progress", l1_ttl=10.0, l2_ttl=120.0)
+video_catalog = VideoCatalog(VIDEOS_FILE)
+heatmaps = HeatmapCache(
+    sb_repo.fetch_event_points,
+    max_grids=int(os.getenv("HEATMAP_CACHE_GRIDS", "") or 256),
+    refresh_seconds=float(os.getenv("HEATMAP_REFRESH_SECONDS", "") or 30.0),
+    max_concurrency=int(os.getenv("HEATMAP_CONCURRENCY", "") or 4),
+    can_settle=lambda: len(telemetry_spool) == 0,
+)
+replay_cache = ReplayCache(max_items=int(os.getenv("REPLAY_CACHE_ITEMS", "") or 200_000))
+live_updates.relay = cache_tier.publish_event
+cache_tier.on_event(live_updates.deliver)
+traffic_recorder = traffic_recorder_from_env()
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,6 +146,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(log_pipeline.CorrelationIdMiddleware)
+if traffic_recorder is not None:
+    # Added last so it is outermost and times the whole stack.
+    app.add_middleware(TrafficCaptureMiddleware, recorder=traffic_recorder)
 
 
 class RegisterRequest(BaseModel):
@@ -99,6 +205,7 @@ class EventItem(BaseModel):
 
 class EventBatchRequest(BaseModel):
     events: List[EventItem]
+    batch_id: Optional[str] = None
 
 
 class EndSessionRequest(BaseModel):
@@ -121,6 +228,18 @@ class CursorDwellBatchRequest(BaseModel):
     items: List[CursorDwellItem]
 
 
+class IngestSessionItem(BaseModel):
+    psid: str
+    events: List[EventItem] = Field(default_factory=list)
+    cursor: List[CursorDwellItem] = Field(default_factory=list)
+    end: Optional[EndSessionRequest] = None
+
+
+class IngestEnvelopeRequest(BaseModel):
+    sessions: List[IngestSessionItem]
+    envelope_id: Optional[str] = None
+
+
 class ScoreEventRequest(BaseModel):
     points_earned: float = Field(ge=0.0)
     points_possible: float = Field(ge=0.0)
@@ -165,9 +284,72 @@ class VideoProgressResponse(BaseModel):
     created_at: datetime
 
 
-@app.on_event("shutdown")
-async def shutdown_event() -> None:
-    await close_supabase_client()
+async def _request_body(request: Request) -> bytes:
+    """Raw body with any ``Content-Encoding`` (gzip, or zstd when installed) undone."""
+    body = await request.body()
+    encoding = request.headers.get("content-encoding")
+    if not encoding:
+        return body
+    try:
+        if len(body) > DECOMPRESS_OFFLOAD_BYTES:
+            return await asyncio.to_thread(decompress, body, encoding, MAX_DECOMPRESSED_BODY_BYTES)
+        return decompress(body, encoding, MAX_DECOMPRESSED_BODY_BYTES)
+    except UnsupportedEncoding:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"Unsupported Content-Encoding: {encoding}")
+    except BodyTooLarge:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Decompressed body too large")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+def _decoded_body(model: Type[BaseModel]):
+    """Request body as ``model``, decoded through the msgspec fast path when it is installed."""
+
+    async def dependency(request: Request):
+        return decode_body(await _request_body(request), model)
+
+    return Depends(dependency)
+
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_handler(request: Request, exc: RateLimitExceeded) -> JSONResponse:
+    return JSONResponse(
+        {"detail": exc.reason},
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": exc.retry_after_header},
+    )
+
+
+async def _probe_schema() -> None:
+    await asyncio.gather(*(probe_table(table) for table in SUPABASE_TABLES))
+
+
+async def _warm_password_hashing() -> None:
+    await asyncio.to_thread(lambda: _password_context().hash("warm-up"))
+
+
+readiness.add_step("supabase_connect", connect_supabase)
+readiness.add_step("supabase_schema", _probe_schema)
+readiness.add_step("video_catalog", lambda: video_catalog.refresh(), required=False)
+readiness.add_step("password_hashing", _warm_password_hashing, required=False)
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    report = readiness.report()
+    status_code = status.HTTP_200_OK if report["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(report, status_code=status_code, headers={"Cache-Control": "no-store"})
+
+
+@app.get("/scheduler")
+async def scheduler_status():
+    """Lease holder state and per-job run counts and timings for this worker."""
+    return JSONResponse(scheduler.report(), headers={"Cache-Control": "no-store"})
 
 
 def read_json(path: str) -> List[Dict[str, object]]:
@@ -189,19 +371,11 @@ def write_json(path: str, payload: List[Dict[str, object]]) -> None:
 
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password[:72])
+    return _password_context().hash(password[:72])
 
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
-
-
-def _to_naive_utc(dt: Optional[_dt.datetime]) -> Optional[datetime]:
-    if dt is None:
-        return None
-    if dt.tzinfo is not None:
-        return dt.astimezone(_dt.timezone.utc).replace(tzinfo=None)
-    return dt
+    return _password_context().verify(plain, hashed)
 
 
 def _calculate_session_score(click_count: int, event_count: int, duration_seconds: int | None) -> float:
@@ -212,6 +386,18 @@ def _calculate_session_score(click_count: int, event_count: int, duration_second
     return clicks * 3.0 + events * 1.5 + duration_component
 
 
+def _page_session_end_fields(session: Dict[str, object], ended_at: int, duration: Optional[int]) -> Dict[str, object]:
+    created_at = to_ms(session.get("created_at"))
+    if duration is None and created_at is not None:
+        duration = max(0, (ended_at - created_at) // 1000)
+    return {
+        "ended_at": ended_at,
+        "duration_seconds": duration,
+        "last_event_at": session.get("last_event_at") or ended_at,
+        "score": _calculate_session_score(int(session.get("click_count") or 0), int(session.get("event_count") or 0), duration),
+    }
+
+
 def _score_response(record: Optional[Dict[str, object]]) -> ScoreSummaryResponse:
     if not record:
         return ScoreSummaryResponse(total_points=0.0, total_possible=0.0, score_percent=0.0)
@@ -250,26 +436,123 @@ async def create_session(user_id: Optional[int], lifetime_minutes: int = 60 * 24
 
 
 async def get_user_by_session(session_id: Optional[str]) -> Optional[SimpleNamespace]:
-    if not session_id:
+    # Anonymous tokens are never bound to a user; answer without a lookup.
+    if not session_id or is_anonymous_token(session_id):
         return None
-    session = await sb_repo.get_session(session_id)
+    session = await session_cache.get_or_load(session_id, lambda: sb_repo.get_session(session_id))
     if not session:
         return None
     expires_at = session.get("expires_at")
-    if isinstance(expires_at, datetime) and expires_at.replace(tzinfo=None) < datetime.utcnow():
+    if expires_at is not None and to_ms(expires_at) < clock.coarse_ms():
         return None
     user_id = session.get("user_id")
     if user_id is None:
         return None
-    user_record = await sb_repo.get_user_by_id(user_id)
+    user_record = await user_cache.get_or_load(str(user_id), lambda: _load_public_user(user_id))
     if not user_record:
         return None
     return SimpleNamespace(**user_record)
 
 
+async def _linkable_session_id(sid_cookie: Optional[str]) -> Optional[str]:
+    """Session id a page session may reference; anonymous tokens get a row on first use."""
+    if not is_anonymous_token(sid_cookie):
+        return sid_cookie
+    expires_ms = anonymous_tokens.verify(sid_cookie)
+    if expires_ms is None:
+        return None
+    await session_cache.get_or_load(sid_cookie, lambda: sb_repo.ensure_anonymous_session(sid_cookie, expires_ms))
+    return sid_cookie
+
+
+async def _load_public_user(user_id: int) -> Optional[Dict[str, object]]:
+    record = await sb_repo.get_user_by_id(user_id)
+    return _public_user(record) if record else None
+
+
+def _progress_tag(user_id: Optional[str], user_email: Optional[str]) -> str:
+    return f"uid:{user_id}" if user_id else f"email:{(user_email or '').lower()}"
+
+
+async def _invalidate_progress(user_id: str, *user_emails: Optional[str]) -> None:
+    """Drop cached lists keyed by ``user_id`` and by each email the written row had or now has."""
+    await progress_cache.invalidate_tag(_progress_tag(user_id, None))
+    for tag in {_progress_tag(None, email) for email in user_emails if email}:
+        await progress_cache.invalidate_tag(tag)
+
+
+async def _load_video_progress(user_id: Optional[str], user_email: Optional[str], video_id: Optional[str], limit: int) -> List[Dict[str, object]]:
+    filters = {"user_id": user_id, "user_email": user_email, "video_id": video_id}
+    return await progress_cache.get_or_load(
+        f"{user_id or ''}|{user_email or ''}|{video_id or ''}|{limit}",
+        lambda: sb_repo.list_video_progress(filters, limit=limit),
+        tag=_progress_tag(user_id, user_email),
+    )
+
+
+def _score_topic(score_user_id: str) -> str:
+    return f"score:{score_user_id}"
+
+
+def _progress_topics(user_id: Optional[str], user_email: Optional[str]) -> List[str]:
+    topics = []
+    if user_id:
+        topics.append(f"progress:{user_id}")
+    if user_email:
+        topics.append(f"progress:email:{user_email.lower()}")
+    return topics
+
+
+def _progress_feature_key(user_id: Optional[str], user_email: Optional[str]) -> str:
+    return f"email:{user_email.lower()}" if user_email else f"uid:{user_id}"
+
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def _client_ip(request: Request) -> Optional[str]:
+    """The peer address, or the right-most untrusted X-Forwarded-For hop when the peer is a trusted proxy."""
+    peer = request.client.host if request.client else None
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded or peer is None or not _is_trusted_proxy(peer):
+        return peer
+    hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+def _admit_tracking(request: Request, psid: str) -> None:
+    admit_telemetry(_client_ip(request), request.cookies.get("session_id") or psid)
+
+
+def _idempotency_scope(request: Request, body_key: Optional[str], owner: Optional[str] = None) -> Optional[str]:
+    """Scope a client ``Idempotency-Key`` (or body batch id) to the route and caller."""
+    key = normalize_idempotency_key(request.headers.get("idempotency-key") or body_key)
+    if not key:
+        return None
+    caller = request.cookies.get("session_id") or (owner or "").lower()
+    # Scoped keys end up in the spool and IDEMPOTENCY_STORE_PATH, so the caller is only kept as a keyed hash.
+    return f"{request.url.path}|{_caller_hash(caller) or ''}|{key}"
+
+
+def _caller_hash(value: Optional[str]) -> Optional[str]:
+    """Keyed hash standing in for a session cookie (or email) wherever it would be persisted."""
+    return anonymous_tokens.fingerprint(value) if value else None
+
+
 async def _resolve_score_identity(request: Request, fallback_email: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
-    sid_cookie = request.cookies.get("session_id")
-    user = await get_user_by_session(sid_cookie)
+    user = await get_user_by_session(request.cookies.get("session_id"))
+    return _score_identity(user, fallback_email)
+
+
+def _score_identity(user: Optional[SimpleNamespace], fallback_email: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
     email = fallback_email or None
     user_id: Optional[str] = None
     if user:
@@ -307,11 +590,21 @@ async def login(request: Request, response: Response, payload: LoginRequest):
 @app.post("/logout")
 async def logout(request: Request, response: Response):
     sid = request.cookies.get("session_id")
-    if sid:
+    if sid and not is_anonymous_token(sid):
         await sb_repo.delete_session(sid)
-    new_sid = await create_session(None)
-    response.set_cookie(key="session_id", value=new_sid, httponly=True, samesite="lax", secure=False, path="/")
-    return JSONResponse({"detail": "Logged out"})
+        await session_cache.invalidate(sid)
+    token, _expires_ms = anonymous_tokens.issue()
+    response.set_cookie(
+        key="session_id",
+        value=token,
+        max_age=anonymous_tokens.lifetime_seconds,
+        httponly=True,
+        samesite="lax",
+        secure=False,
+        path="/",
+    )
+    # A plain dict keeps the cookie set on ``response``; a returned JSONResponse would drop it.
+    return {"detail": "Logged out"}
 
 
 @app.get("/me")
@@ -341,6 +634,7 @@ async def update_user_db(email: str, payload: Dict[str, object]):
     result = await sb_repo.update_user(email, updates)
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
+    await user_cache.invalidate(str(result["id"]))
     return _public_user(result)
 
 
@@ -350,6 +644,7 @@ async def delete_user_db(email: str):
     if not existing:
         raise HTTPException(status_code=404, detail="User not found")
     await sb_repo.delete_user(email)
+    await user_cache.invalidate(str(existing["id"]))
     return {"detail": "User deleted."}
 
 
@@ -358,6 +653,36 @@ def get_videos():
     return read_json(VIDEOS_FILE)
 
 
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+@app.get("/videos/catalog")
+async def get_video_catalog(request: Request):
+    items, etag = await video_catalog.snapshot()
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=60"}
+    if _etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(items, headers=headers)
+
+
+@app.api_route("/videos/stream/{name:path}", methods=["GET", "HEAD"])
+async def stream_video(name: str):
+    """Serve a catalog video from the local disk cache; Range/If-Range handling is done by FileResponse."""
+    # Checked before any cache lookup or storage call, which is made with the service-role key.
+    if not is_safe_video_name(name) or not await video_catalog.contains(name):
+        raise HTTPException(status_code=404, detail="Video not found")
+    path = await video_cache.path_for(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    media_type = mimetypes.guess_type(name)[0] or "video/mp4"
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "public, max-age=86400"})
+
+
 @app.post("/videos", response_model=Video)
 def add_video(video: Video):
     videos = read_json(VIDEOS_FILE)
@@ -430,155 +755,633 @@ async def start_page_session(request: Request, payload: StartSessionRequest):
     sid_cookie = request.cookies.get("session_id")
     user = await get_user_by_session(sid_cookie)
     psid = str(uuid.uuid4())
-    await sb_repo.create_page_session(psid, user_session_id=sid_cookie, user_id=(user.id if user else None), page=payload.page)
+    await sb_repo.create_page_session(psid, user_session_id=await _linkable_session_id(sid_cookie), user_id=(user.id if user else None), page=payload.page)
     return StartSessionResponse(id=psid)
 
 
-def _build_event_timestamp(item: EventRequest | EventItem) -> datetime:
+def _event_ts_ms(item: EventRequest | EventItem) -> int:
     if item.ts_ms is not None:
-        return datetime.utcfromtimestamp(item.ts_ms / 1000.0)
-    return _to_naive_utc(item.timestamp) or datetime.utcnow()
+        return int(item.ts_ms)
+    return datetime_to_ms(item.timestamp) or clock.coarse_ms()
 
 
-@app.post("/page-sessions/{psid}/event")
-async def record_event(psid: str, payload: EventRequest):
-    ts = _build_event_timestamp(payload)
-    event = {
+def _event_row(psid: str, item: EventRequest | EventItem) -> Dict[str, object]:
+    return {
         "page_session_id": psid,
-        "event_type": payload.event_type,
-        "event_timestamp": ts,
-        "data": json.dumps(payload.data) if payload.data is not None else None,
-        "x": payload.x,
-        "y": payload.y,
+        "event_type": item.event_type,
+        "event_timestamp": _event_ts_ms(item),
+        "data": json.dumps(item.data) if item.data is not None else None,
+        "x": item.x,
+        "y": item.y,
+    }
+
+
+def _event_counter_updates(session: Dict[str, object], events: List[Dict[str, object]]) -> Dict[str, object]:
+    latest_ts = max(evt["event_timestamp"] for evt in events)
+    clicks = sum(1 for evt in events if evt["event_type"] == "click")
+    updates: Dict[str, object] = {
+        "event_count": int(session.get("event_count") or 0) + len(events),
+        "last_event_at": latest_ts,
     }
-    await sb_repo.insert_events([event])
+    if clicks:
+        updates["click_count"] = int(session.get("click_count") or 0) + clicks
+    return updates
+
+
+async def _bump_event_counters(psid: str, events: List[Dict[str, object]]) -> None:
     session = await sb_repo.get_page_session(psid)
     if not session:
         raise HTTPException(status_code=404, detail="Page session not found")
-    updates = {
-        "event_count": int(session.get("event_count") or 0) + 1,
-        "last_event_at": ts,
-    }
-    if payload.event_type == "click":
-        updates["click_count"] = int(session.get("click_count") or 0) + 1
-    await sb_repo.update_page_session(psid, updates)
+    await sb_repo.update_page_session(psid, _event_counter_updates(session, events))
+
+
+async def _ingest_events(psid: str, events: List[Dict[str, object]], batch_key: Optional[str] = None) -> bool:
+    """Insert events and bump counters; spool whatever is left on a transient failure.
+
+    Returns False when the batch was spooled. If the insert already went
+    through, the spooled batch is marked ``inserted`` so replay only
+    applies the counter update.
+    """
+    stage: Optional[str] = None
+    try:
+        await sb_repo.insert_events(events)
+        stage = "inserted"
+        await _bump_event_counters(psid, events)
+    except Exception as exc:
+        if not is_transient_failure(exc):
+            raise
+        key = telemetry_spool.append("events", {"psid": psid, "events": events}, key=batch_key)
+        if stage:
+            telemetry_spool.mark(key, stage)
+        return False
+    return True
+
+
+def _restore_event_rows(rows: List[Dict[str, object]]) -> List[Dict[str, object]]:
+    restored = []
+    for row in rows:
+        evt = dict(row)
+        # Batches spooled before timestamps became epoch ms carry ISO strings.
+        evt["event_timestamp"] = to_ms(evt["event_timestamp"])
+        restored.append(evt)
+    return restored
+
+
+async def _replay_events(records: List[SpoolRecord], mark) -> None:
+    to_insert = [record for record in records if record.stage is None]
+    rows = [row for record in to_insert for row in _restore_event_rows(record.payload["events"])]
+    if rows:
+        try:
+            await sb_repo.insert_events(rows)
+        except Exception as exc:
+            if is_transient_failure(exc):
+                raise
+            # One bad batch must not take the rest of the segment with it; retry batch by batch.
+            rejected = await _insert_spooled_events_individually(to_insert, mark)
+            records = [record for record in records if record.key not in rejected]
+        else:
+            for record in to_insert:
+                mark(record.key, "inserted")
+    by_psid: Dict[str, List[SpoolRecord]] = {}
+    for record in records:
+        by_psid.setdefault(record.payload["psid"], []).append(record)
+    for psid, group in by_psid.items():
+        events = [row for record in group for row in _restore_event_rows(record.payload["events"])]
+        try:
+            await _bump_event_counters(psid, events)
+        except HTTPException:
+            pass
+        for record in group:
+            mark(record.key, STAGE_DONE)
+
+
+async def _insert_spooled_events_individually(records: List[SpoolRecord], mark) -> Set[str]:
+    """Insert each spooled batch on its own; returns the keys of batches Supabase rejected."""
+    rejected: Set[str] = set()
+    for record in records:
+        try:
+            await sb_repo.insert_events(_restore_event_rows(record.payload["events"]))
+        except Exception as exc:
+            if is_transient_failure(exc):
+                raise
+            logger.exception("Dropping spooled event batch %s for %s after replay failure", record.key, record.payload["psid"])
+            mark(record.key, STAGE_DONE)
+            rejected.add(record.key)
+            continue
+        mark(record.key, "inserted")
+    return rejected
+
+
+@app.post("/page-sessions/{psid}/event")
+async def record_event(psid: str, request: Request, payload: EventRequest):
+    _admit_tracking(request, psid)
+    if not await _ingest_events(psid, [_event_row(psid, payload)]):
+        return {"detail": "event deferred"}
     return {"detail": "event recorded"}
 
 
 @app.post("/page-sessions/{psid}/events-batch")
-async def record_events_batch(psid: str, payload: EventBatchRequest):
+async def record_events_batch(psid: str, request: Request, response: Response, payload: EventBatchRequest = _decoded_body(EventBatchRequest)):
     items = payload.events or []
     if not items:
         return {"inserted": 0}
-    events = []
-    click_increment = 0
-    latest_ts = datetime.utcnow()
+    idem_key = _idempotency_scope(request, payload.batch_id)
+
+    async def ingest() -> Dict[str, int]:
+        _admit_tracking(request, psid)
+        events = [_event_row(psid, item) for item in items]
+        if not await _ingest_events(psid, events, batch_key=idem_key):
+            return {"inserted": 0, "deferred": len(events)}
+        return {"inserted": len(events)}
+
+    if not idem_key:
+        return await ingest()
+    result, replayed = await idempotency_store.run(idem_key, ingest)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+def _require_page_session_owner(session: Dict[str, object], sid_cookie: Optional[str], sid_hash: Optional[str] = None) -> None:
+    """403 unless the page session is unlinked or linked to this client's session cookie (or its ``_caller_hash``)."""
+    owner = session.get("user_session_id")
+    if not owner or (sid_cookie and owner == sid_cookie):
+        return
+    if sid_hash and hmac.compare_digest(_caller_hash(str(owner)), sid_hash):
+        return
+    raise HTTPException(status_code=403, detail="Page session does not belong to this client")
+
+
+async def _apply_cursor_dwell(psid: str, sid_cookie: Optional[str], items: Sequence[CursorDwellItem], *, sid_hash: Optional[str] = None) -> int:
+    """Merge dwell deltas into the stored per-target totals for a page session.
+
+    Spool replays pass only ``sid_hash``: ownership is still checked, but the
+    session cannot be linked or attributed to a user from a hash.
+    """
+    user = await get_user_by_session(sid_cookie)
+    session = await sb_repo.get_page_session(psid)
+    if not session:
+        raise HTTPException(status_code=404, detail="Page session not found")
+    session_updates: Dict[str, object] = {}
+    _require_page_session_owner(session, sid_cookie, sid_hash)
+    if not session.get("user_session_id") and sid_cookie:
+        linked = await _linkable_session_id(sid_cookie)
+        if linked:
+            session_updates["user_session_id"] = linked
+    if session.get("user_id") is None and user:
+        session_updates["user_id"] = user.id
+    target_keys = [item.target_key for item in items]
+    existing = await sb_repo.fetch_cursor_dwell(psid, target_keys)
+    existing_map = {row["target_key"]: row for row in existing}
+    now = clock.coarse_ms()
+    upserts = _dwell_records(psid, items, existing_map, now)
+    await sb_repo.upsert_cursor_dwell(upserts)
+    _record_dwell_features(psid, sid_hash or _caller_hash(sid_cookie), user, items)
+    session_updates.update(_dwell_counter_updates(session, items, now))
+    if session_updates:
+        await sb_repo.update_page_session(psid, session_updates)
+    return len(upserts)
+
+
+def _dwell_records(psid: str, items: Sequence[CursorDwellItem], existing_map: Dict[str, Dict[str, object]], now: int) -> List[Dict[str, object]]:
+    """Stored per-target totals plus these deltas, ready for ``upsert_cursor_dwell``."""
+    upserts: List[Dict[str, object]] = []
     for item in items:
-        ts = _build_event_timestamp(item)
-        latest_ts = max(latest_ts, ts)
-        if item.event_type == "click":
-            click_increment += 1
-        events.append(
+        prev = existing_map.get(item.target_key, {})
+        upserts.append(
             {
                 "page_session_id": psid,
-                "event_type": item.event_type,
-                "event_timestamp": ts,
-                "data": json.dumps(item.data) if item.data is not None else None,
-                "x": item.x,
-                "y": item.y,
+                "target_key": item.target_key,
+                "target_label": item.label if item.label is not None else prev.get("target_label"),
+                "center_x": item.center_x if item.center_x is not None else prev.get("center_x"),
+                "center_y": item.center_y if item.center_y is not None else prev.get("center_y"),
+                "radius": item.radius if item.radius is not None else prev.get("radius"),
+                "extra_metadata": item.metadata if item.metadata is not None else prev.get("extra_metadata"),
+                "total_duration_ms": int(prev.get("total_duration_ms") or 0) + int(item.duration_ms),
+                "total_entries": int(prev.get("total_entries") or 0) + int(item.entry_count or 0),
+                "first_seen": prev.get("first_seen") or now,
+                "last_updated": now,
             }
         )
-    await sb_repo.insert_events(events)
-    session = await sb_repo.get_page_session(psid)
-    if not session:
-        raise HTTPException(status_code=404, detail="Page session not found")
-    updates = {
-        "event_count": int(session.get("event_count") or 0) + len(events),
-        "click_count": int(session.get("click_count") or 0) + click_increment,
-        "last_event_at": latest_ts,
-    }
-    await sb_repo.update_page_session(psid, updates)
-    return {"inserted": len(events)}
+    return upserts
+
+
+def _dwell_counter_updates(session: Dict[str, object], items: Sequence[CursorDwellItem], now: int) -> Dict[str, object]:
+    duration_total = sum(int(item.duration_ms) for item in items)
+    entry_total = sum(int(item.entry_count or 0) for item in items)
+    if not duration_total and not entry_total:
+        return {}
+    return {"last_event_at": now, "event_count": int(session.get("event_count") or 0) + entry_total}
+
+
+def _record_dwell_features(psid: str, sid_hash: Optional[str], user: Optional[SimpleNamespace], items: Sequence[CursorDwellItem]) -> None:
+    feature_key = f"user:{user.id}" if user else f"session:{sid_hash}" if sid_hash else f"page:{psid}"
+    for item in items:
+        feature_store.record_dwell(feature_key, item.target_key, int(item.duration_ms), item.metadata)
+
+
+def _merge_dwell_items(items: Sequence[CursorDwellItem]) -> List[CursorDwellItem]:
+    merged: Dict[str, CursorDwellItem] = {}
+    for item in items:
+        prev = merged.get(item.target_key)
+        if prev is None:
+            merged[item.target_key] = item.copy()
+            continue
+        prev.duration_ms += item.duration_ms
+        prev.entry_count = (prev.entry_count or 0) + (item.entry_count or 0)
+        for field in ("label", "center_x", "center_y", "radius", "metadata"):
+            value = getattr(item, field)
+            if value is not None:
+                setattr(prev, field, value)
+    return list(merged.values())
+
+
+async def _replay_cursor_dwell(records: List[SpoolRecord], mark) -> None:
+    groups: Dict[Tuple[str, Optional[str]], List[SpoolRecord]] = {}
+    for record in records:
+        groups.setdefault((record.payload["psid"], record.payload.get("sid_hash")), []).append(record)
+    for (psid, sid_hash), group in groups.items():
+        items = [CursorDwellItem(**item) for record in group for item in record.payload["items"]]
+        try:
+            await _apply_cursor_dwell(psid, None, _merge_dwell_items(items), sid_hash=sid_hash)
+        except HTTPException:
+            pass
+        for record in group:
+            mark(record.key, STAGE_DONE)
 
 
 @app.post("/page-sessions/{psid}/cursor-dwell")
-async def record_cursor_dwell(psid: str, request: Request, payload: CursorDwellBatchRequest):
+async def record_cursor_dwell(psid: str, request: Request, payload: CursorDwellBatchRequest = _decoded_body(CursorDwellBatchRequest)):
     items = payload.items or []
     normalized = [item for item in items if item.duration_ms > 0 or (item.entry_count or 0) > 0]
     if not normalized:
         return {"updated": 0}
+    _admit_tracking(request, psid)
     sid_cookie = request.cookies.get("session_id")
-    user = await get_user_by_session(sid_cookie)
+    try:
+        updated = await _apply_cursor_dwell(psid, sid_cookie, normalized)
+    except Exception as exc:
+        if not is_transient_failure(exc):
+            raise
+        items_payload = [item.dict() for item in normalized]
+        telemetry_spool.append("cursor_dwell", {"psid": psid, "sid_hash": _caller_hash(sid_cookie), "items": items_payload})
+        return {"updated": 0, "deferred": len(normalized)}
+    return {"updated": updated}
+
+
+telemetry_spool.register("events", _replay_events)
+telemetry_spool.register("cursor_dwell", _replay_cursor_dwell)
+
+
+@app.post("/page-sessions/{psid}/end")
+async def end_page_session(psid: str, payload: EndSessionRequest):
+    ended_at = datetime_to_ms(payload.ended_at) or clock.coarse_ms()
     session = await sb_repo.get_page_session(psid)
     if not session:
         raise HTTPException(status_code=404, detail="Page session not found")
-    session_updates: Dict[str, object] = {}
-    if session.get("user_session_id"):
-        if not sid_cookie or session["user_session_id"] != sid_cookie:
-            raise HTTPException(status_code=403, detail="Page session does not belong to this client")
-    elif sid_cookie:
-        session_updates["user_session_id"] = sid_cookie
-    if session.get("user_id") is None and user:
-        session_updates["user_id"] = user.id
-    target_keys = [item.target_key for item in normalized]
-    existing = await sb_repo.fetch_cursor_dwell(psid, target_keys)
-    existing_map = {row["target_key"]: row for row in existing}
-    now = datetime.utcnow()
-    duration_total = 0
-    entry_total = 0
-    upserts: List[Dict[str, object]] = []
-    for item in normalized:
-        prev = existing_map.get(item.target_key, {})
-        total_duration = int(prev.get("total_duration_ms") or 0) + int(item.duration_ms)
-        total_entries = int(prev.get("total_entries") or 0) + int(item.entry_count or 0)
-        duration_total += int(item.duration_ms)
-        entry_total += int(item.entry_count or 0)
-        first_seen = prev.get("first_seen") or now
-        record = {
-            "page_session_id": psid,
-            "target_key": item.target_key,
-            "target_label": item.label if item.label is not None else prev.get("target_label"),
-            "center_x": item.center_x if item.center_x is not None else prev.get("center_x"),
-            "center_y": item.center_y if item.center_y is not None else prev.get("center_y"),
-            "radius": item.radius if item.radius is not None else prev.get("radius"),
-            "extra_metadata": item.metadata if item.metadata is not None else prev.get("extra_metadata"),
-            "total_duration_ms": total_duration,
-            "total_entries": total_entries,
-            "first_seen": first_seen,
-            "last_updated": now,
-        }
-        upserts.append(record)
-    await sb_repo.upsert_cursor_dwell(upserts)
-    if duration_total or entry_total:
-        session_updates["last_event_at"] = now
-        session_updates["event_count"] = int(session.get("event_count") or 0) + entry_total
-    if session_updates:
-        await sb_repo.update_page_session(psid, session_updates)
-    return {"updated": len(upserts)}
+    await sb_repo.end_page_session(psid, _page_session_end_fields(session, ended_at, payload.duration_seconds))
+    return {"detail": "session ended"}
 
 
-@app.post("/page-sessions/{psid}/end")
-async def end_page_session(psid: str, payload: EndSessionRequest):
-    ended_at = _to_naive_utc(payload.ended_at) or datetime.utcnow()
+async def _replay_page_session_end(records: List[SpoolRecord], mark) -> None:
+    sessions = {row["id"]: row for row in await sb_repo.get_page_sessions([record.payload["psid"] for record in records])}
+    for record in records:
+        session = sessions.get(record.payload["psid"])
+        if session is not None and session.get("ended_at") is None:
+            fields = _page_session_end_fields(session, record.payload["ended_at"], record.payload.get("duration_seconds"))
+            await sb_repo.end_page_session(record.payload["psid"], fields)
+        mark(record.key, STAGE_DONE)
+
+
+telemetry_spool.register("page_session_end", _replay_page_session_end)
+
+
+def _merge_ingest_items(items: Sequence[IngestSessionItem]) -> Dict[str, IngestSessionItem]:
+    merged: Dict[str, IngestSessionItem] = {}
+    for item in items:
+        prev = merged.get(item.psid)
+        if prev is None:
+            merged[item.psid] = item.copy(deep=True)
+            continue
+        prev.events.extend(item.events)
+        prev.cursor.extend(item.cursor)
+        prev.end = item.end or prev.end
+    for item in merged.values():
+        item.cursor = _merge_dwell_items([entry for entry in item.cursor if entry.duration_ms > 0 or (entry.entry_count or 0) > 0])
+    return merged
+
+
+@app.post("/page-sessions/ingest")
+async def ingest_page_sessions(request: Request, response: Response, payload: IngestEnvelopeRequest = _decoded_body(IngestEnvelopeRequest)):
+    """Events, cursor-dwell deltas and end markers for many page sessions in one request.
+
+    Ownership is checked once against the caller's session cookie; the
+    contents are then written with one bulk call per table. Sessions that
+    are unknown or belong to another client are reported and skipped.
+    """
+    if not payload.sessions:
+        return {"sessions": {}}
+    idem_key = _idempotency_scope(request, payload.envelope_id)
+
+    async def ingest() -> Dict[str, object]:
+        parts = _merge_ingest_items(payload.sessions)
+        sid_cookie = request.cookies.get("session_id")
+        _admit_tracking(request, next(iter(parts)))
+        event_rows = {psid: [_event_row(psid, item) for item in part.events] for psid, part in parts.items()}
+        results: Dict[str, Dict[str, object]] = {}
+        accepted = parts
+        stage: Optional[str] = None
+        try:
+            user = await get_user_by_session(sid_cookie)
+            sessions = {row["id"]: row for row in await sb_repo.get_page_sessions(list(parts))}
+            accepted = {}
+            for psid, part in parts.items():
+                session = sessions.get(psid)
+                if session is None:
+                    results[psid] = {"status": "not_found"}
+                elif session.get("user_session_id") and session["user_session_id"] != sid_cookie:
+                    results[psid] = {"status": "forbidden"}
+                else:
+                    accepted[psid] = part
+            linked = None
+            if sid_cookie and any(not sessions[psid].get("user_session_id") for psid in accepted):
+                linked = await _linkable_session_id(sid_cookie)
+            cursor_psids = [psid for psid, part in accepted.items() if part.cursor]
+            target_keys = {item.target_key for psid in cursor_psids for item in accepted[psid].cursor}
+            existing = await sb_repo.fetch_cursor_dwell_many(cursor_psids, sorted(target_keys))
+            existing_map: Dict[str, Dict[str, Dict[str, object]]] = {}
+            for row in existing:
+                existing_map.setdefault(row["page_session_id"], {})[row["target_key"]] = row
+
+            now = clock.coarse_ms()
+            dwell_rows: List[Dict[str, object]] = []
+            session_rows: List[Dict[str, object]] = []
+            for psid, part in accepted.items():
+                session = sessions[psid]
+                updates: Dict[str, object] = {}
+                if event_rows[psid]:
+                    updates.update(_event_counter_updates(session, event_rows[psid]))
+                if part.cursor:
+                    dwell_rows.extend(_dwell_records(psid, part.cursor, existing_map.get(psid, {}), now))
+                    dwell_updates = _dwell_counter_updates({**session, **updates}, part.cursor, now)
+                    if "last_event_at" in updates and "last_event_at" in dwell_updates:
+                        dwell_updates["last_event_at"] = max(updates["last_event_at"], dwell_updates["last_event_at"])
+                    updates.update(dwell_updates)
+                if linked and not session.get("user_session_id"):
+                    updates["user_session_id"] = linked
+                if user and session.get("user_id") is None:
+                    updates["user_id"] = user.id
+                if part.end is not None:
+                    ended_at = datetime_to_ms(part.end.ended_at) or now
+                    updates.update(_page_session_end_fields({**session, **updates}, ended_at, part.end.duration_seconds))
+                if updates:
+                    session_rows.append({"id": psid, **updates})
+
+            await sb_repo.insert_events([row for psid in accepted for row in event_rows[psid]])
+            stage = "inserted"
+            await sb_repo.upsert_cursor_dwell(dwell_rows)
+            stage = "cursor"
+            await sb_repo.bulk_update_page_sessions(session_rows)
+        except Exception as exc:
+            if not is_transient_failure(exc):
+                raise
+            _spool_ingest(accepted, event_rows, sid_cookie, stage, idem_key)
+            for psid, part in accepted.items():
+                results[psid] = {"status": "deferred", "events": len(part.events), "cursor": len(part.cursor), "ended": part.end is not None}
+            return {"sessions": results}
+        for psid, part in accepted.items():
+            _record_dwell_features(psid, _caller_hash(sid_cookie), user, part.cursor)
+            results[psid] = {"status": "ok", "events": len(part.events), "cursor": len(part.cursor), "ended": part.end is not None}
+        return {"sessions": results}
+
+    if not idem_key:
+        return await ingest()
+    result, replayed = await idempotency_store.run(idem_key, ingest)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+def _spool_ingest(
+    accepted: Dict[str, IngestSessionItem],
+    event_rows: Dict[str, List[Dict[str, object]]],
+    sid_cookie: Optional[str],
+    stage: Optional[str],
+    idem_key: Optional[str],
+) -> None:
+    """Hand the unwritten parts of an envelope to the per-kind spool replayers.
+
+    Once dwell rows are written (stage ``cursor``), only the session counters
+    are missing; dwell is not re-spooled to avoid double counting, so its
+    entry counts are not added to ``event_count``.
+    """
+    for psid, part in accepted.items():
+        if event_rows[psid]:
+            key = telemetry_spool.append("events", {"psid": psid, "events": event_rows[psid]}, key=f"{idem_key}|{psid}" if idem_key else None)
+            if stage:
+                telemetry_spool.mark(key, "inserted")
+        if part.cursor and stage in (None, "inserted"):
+            items_payload = [item.dict() for item in part.cursor]
+            telemetry_spool.append("cursor_dwell", {"psid": psid, "sid_hash": _caller_hash(sid_cookie), "items": items_payload})
+        if part.end is not None:
+            ended_at = datetime_to_ms(part.end.ended_at) or clock.coarse_ms()
+            telemetry_spool.append("page_session_end", {"psid": psid, "ended_at": ended_at, "duration_seconds": part.end.duration_seconds})
+
+
+PAGE_SESSION_IDLE_MINUTES = int(os.getenv("PAGE_SESSION_IDLE_MINUTES", "") or 30)
+MAINTENANCE_BATCH = 200
+MAINTENANCE_MAX_BATCHES = 25
+
+
+async def _purge_sessions_job() -> Dict[str, int]:
+    now = clock.coarse_ms()
+    purged = 0
+    for _ in range(MAINTENANCE_MAX_BATCHES):
+        ids = await sb_repo.purge_sessions(now, now - anonymous_tokens.lifetime_seconds * 1000, MAINTENANCE_BATCH)
+        for sid in ids:
+            await session_cache.invalidate(sid)
+        purged += len(ids)
+        if len(ids) < MAINTENANCE_BATCH:
+            break
+    return {"purged": purged}
+
+
+async def _close_abandoned_page_sessions_job() -> Dict[str, int]:
+    """Score page sessions that never called ``/end`` as if they ended at their last event."""
+    idle_before = clock.coarse_ms() - PAGE_SESSION_IDLE_MINUTES * 60_000
+    closed = 0
+    for _ in range(MAINTENANCE_MAX_BATCHES):
+        sessions = await sb_repo.list_abandoned_page_sessions(idle_before, MAINTENANCE_BATCH)
+        closes = []
+        for session in sessions:
+            ended_at = to_ms(session.get("last_event_at") or session.get("created_at")) or idle_before
+            closes.append((session, _page_session_end_fields(session, ended_at, None)))
+        # Sessions that received events since the read are skipped; a later run sees them again if still idle.
+        closed += await sb_repo.close_idle_page_sessions(closes)
+        if len(sessions) < MAINTENANCE_BATCH:
+            break
+    return {"closed": closed}
+
+
+async def _warm_stream_openers_job() -> Dict[str, int]:
+    """Keep the first clips of every stream in the host's shared disk cache."""
+    names = [step.object_name for steps in STREAM_SEQUENCES.values() for step in steps[:2]]
+    paths = await asyncio.gather(*(video_cache.path_for(name) for name in names), return_exceptions=True)
+    return {"cached": sum(1 for path in paths if isinstance(path, str)), "clips": len(names)}
+
+
+scheduler.add_job("purge_sessions", _purge_sessions_job, every=600.0, delay=30.0)
+scheduler.add_job("close_abandoned_page_sessions", _close_abandoned_page_sessions_job, every=300.0, delay=60.0)
+scheduler.add_job("warm_stream_openers", _warm_stream_openers_job, every=1800.0, delay=5.0)
+
+
+@app.get("/page-sessions/heatmap")
+async def get_page_heatmap(
+    request: Request,
+    page: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    event_type: Optional[str] = None,
+    cell: int = 32,
+    width: int = 1920,
+    height: int = 1080,
+    format: str = "json",
+):
+    """Event coordinates for ``page`` binned into ``cell``-pixel squares; hour-aligned, last 24 hours by default.
+
+    ``user_id`` narrows the map to one user and is only allowed for that user's own session.
+    """
+    if format not in ("json", "png"):
+        raise HTTPException(status_code=400, detail="format must be json or png")
+    if cell % BASE_CELL_PX or not BASE_CELL_PX <= cell <= 256:
+        raise HTTPException(status_code=400, detail=f"cell must be a multiple of {BASE_CELL_PX} between {BASE_CELL_PX} and 256")
+    width = max(1, min(width, MAX_WIDTH))
+    height = max(1, min(height, MAX_HEIGHT))
+    end_ms = datetime_to_ms(until) or clock.coarse_ms()
+    start_ms = datetime_to_ms(since) or end_ms - 24 * HOUR_MS
+    if start_ms >= end_ms:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    if end_ms - start_ms > MAX_RANGE_HOURS * HOUR_MS:
+        raise HTTPException(status_code=400, detail=f"Time range is limited to {MAX_RANGE_HOURS} hours")
+    if user_id is not None:
+        user = await get_user_by_session(request.cookies.get("session_id"))
+        if user is None:
+            raise HTTPException(status_code=401, detail="Sign in to view a per-user heatmap")
+        if user.id != user_id:
+            raise HTTPException(status_code=403, detail="Per-user heatmaps are limited to your own account")
+    base = await heatmaps.grid(page, start_ms, end_ms, user_id=user_id, event_type=event_type)
+    counts = rebin(base, cell, width, height)
+    headers = {"Cache-Control": "private, max-age=30"}
+    if format == "png":
+        return Response(encode_png(counts), media_type="image/png", headers=headers)
+    return JSONResponse(
+        {
+            "page": page,
+            "since": ms_to_iso(start_ms // HOUR_MS * HOUR_MS),
+            "until": ms_to_iso(-(-end_ms // HOUR_MS) * HOUR_MS),
+            "cell": cell,
+            "shape": list(counts.shape),
+            "total": int(counts.sum()),
+            "max": int(counts.max()),
+            "dtype": "uint32",
+            "counts": encode_counts(counts),
+        },
+        headers=headers,
+    )
+
+
+@app.get("/page-sessions/{psid}/trajectory")
+async def get_page_session_trajectory(psid: str, request: Request, since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Cursor path of a page session as ``[t_ms, x, y]`` points, from trajectory segments and any move rows."""
+    end_ms = datetime_to_ms(until) or clock.coarse_ms() + 1
+    start_ms = datetime_to_ms(since) or 0
+    if start_ms >= end_ms:
+        raise HTTPException(status_code=400, detail="since must be before until")
     session = await sb_repo.get_page_session(psid)
     if not session:
         raise HTTPException(status_code=404, detail="Page session not found")
-    duration = payload.duration_seconds
-    if duration is None and session.get("created_at"):
-        duration = int((ended_at - session["created_at"]).total_seconds())
-    updates = {
-        "ended_at": ended_at,
-        "duration_seconds": duration,
-        "last_event_at": session.get("last_event_at") or ended_at,
-        "score": _calculate_session_score(int(session.get("click_count") or 0), int(session.get("event_count") or 0), duration),
+    _require_page_session_owner(session, request.cookies.get("session_id"))
+    segments_task = sb_repo.fetch_trajectory_segments(psid, start_ms, end_ms) if TRAJECTORY_STORAGE_ENABLED else asyncio.sleep(0, [])
+    segments, rows = await asyncio.gather(segments_task, sb_repo.fetch_move_events(psid, start_ms, end_ms))
+    points = [point for segment in segments for point in decode_segment(segment) if start_ms <= point[0] < end_ms]
+    points.extend((to_ms(row["event_timestamp"]), row["x"], row["y"]) for row in rows)
+    points.sort()
+    return {
+        "page_session_id": psid,
+        "points": points,
+        "segments": len(segments),
+        "simplified": any(segment.get("stored_points") != segment.get("point_count") for segment in segments),
     }
-    await sb_repo.end_page_session(psid, updates)
-    return {"detail": "session ended"}
+
+
+REPLAY_PAGE_SIZE = 1000
+# Ended sessions are cached only once late (spooled) writes are unlikely to still arrive.
+REPLAY_SETTLE_MS = 60_000
+
+
+async def _timeline_extras(psid: str, session: Dict[str, object]) -> List[Dict[str, object]]:
+    """Trajectory moves, dwell totals and the owner's video progress during the session, as timeline items."""
+    created_ms = to_ms(session.get("created_at")) or 0
+    ended_ms = to_ms(session.get("ended_at")) or clock.coarse_ms()
+    email = None
+    user_id = session.get("user_id")
+    if user_id is not None:
+        user_record = await user_cache.get_or_load(str(user_id), lambda: _load_public_user(user_id))
+        email = user_record.get("email") if user_record else None
+    segments, dwell, progress = await asyncio.gather(
+        sb_repo.fetch_trajectory_segments(psid, created_ms, ended_ms + 1) if TRAJECTORY_STORAGE_ENABLED else asyncio.sleep(0, []),
+        sb_repo.list_cursor_dwell(psid),
+        sb_repo.list_video_progress({"user_email": email}, limit=100) if email else asyncio.sleep(0, []),
+    )
+    items = [move_item(point) for segment in segments for point in decode_segment(segment)]
+    items.extend(dwell_item(row) for row in dwell)
+    items.extend(progress_item(row) for row in progress if created_ms <= (to_ms(row.get("last_event_at")) or 0) <= ended_ms)
+    return items
+
+
+def _ndjson(items: Sequence[Dict[str, object]]) -> bytes:
+    return "".join(json.dumps(item, separators=(",", ":")) + "\n" for item in items).encode("utf-8")
+
+
+@app.get("/page-sessions/{psid}/timeline")
+async def get_page_session_timeline(psid: str, request: Request):
+    """Stream a page session's ordered timeline as NDJSON, one chunk per keyset page of events."""
+    headers = {"Cache-Control": "private, no-cache"}
+    session = await sb_repo.get_page_session(psid)
+    if not session:
+        raise HTTPException(status_code=404, detail="Page session not found")
+    _require_page_session_owner(session, request.cookies.get("session_id"))
+    cached = replay_cache.get(psid)
+    if cached is not None:
+
+        async def replay_cached():
+            for start in range(0, len(cached), REPLAY_PAGE_SIZE):
+                yield _ndjson(cached[start : start + REPLAY_PAGE_SIZE])
+
+        return StreamingResponse(replay_cached(), media_type="application/x-ndjson", headers={**headers, "X-Replay-Cache": "hit"})
+
+    extras = await _timeline_extras(psid, session)
+    ended_ms = to_ms(session.get("ended_at"))
+    settled = ended_ms is not None and ended_ms < clock.coarse_ms() - REPLAY_SETTLE_MS
+
+    async def stream():
+        collected: Optional[List[Dict[str, object]]] = [] if settled else None
+        async for chunk in merge_timeline(event_pages(sb_repo.fetch_event_page, psid, REPLAY_PAGE_SIZE), extras):
+            if collected is not None:
+                collected.extend(chunk)
+                if len(collected) > replay_cache.max_items // 4:
+                    collected = None
+            yield _ndjson(chunk)
+        if collected is not None:
+            replay_cache.put(psid, collected)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers={**headers, "X-Replay-Cache": "miss"})
 
 
 @app.post("/video-progress", response_model=VideoProgressResponse)
-async def upsert_video_progress(payload: VideoProgressRequest):
-    event_time = _to_naive_utc(payload.event_timestamp) or datetime.utcnow()
+async def upsert_video_progress(payload: VideoProgressRequest = _decoded_body(VideoProgressRequest)):
+    event_time = datetime_to_ms(payload.event_timestamp) or clock.coarse_ms()
     record = {
         "id": str(uuid.uuid4()),
         "user_id": payload.user_id,
@@ -595,11 +1398,20 @@ async def upsert_video_progress(payload: VideoProgressRequest):
         "updated_at": event_time,
     }
     existing = await sb_repo.list_video_progress({"user_id": payload.user_id, "video_id": payload.video_id}, limit=1)
+    previous_email = None
     if existing:
         record["id"] = existing[0]["id"]
         record["created_at"] = existing[0].get("created_at")
+        previous_email = existing[0].get("user_email")
     result = await sb_repo.upsert_video_progress(record)
-    return _video_progress_response(result)
+    # A write carrying only user_id still changes lists cached under the row's stored email.
+    await _invalidate_progress(payload.user_id, payload.user_email, previous_email)
+    feature_store.record_progress(_progress_feature_key(payload.user_id, payload.user_email), payload.video_id, record["progress"])
+    response = _video_progress_response(result)
+    data = jsonable_encoder(response)
+    for topic in _progress_topics(payload.user_id, payload.user_email):
+        await live_updates.publish(topic, "progress", data)
+    return response
 
 
 @app.get("/video-progress", response_model=List[VideoProgressResponse])
@@ -607,28 +1419,171 @@ async def list_video_progress(user_id: Optional[str] = None, user_email: Optiona
     if not user_id and not user_email:
         raise HTTPException(status_code=400, detail="user_id or user_email must be provided")
     limit = max(1, min(limit, 100))
-    records = await sb_repo.list_video_progress({"user_id": user_id, "user_email": user_email, "video_id": video_id}, limit=limit)
+    records = await _load_video_progress(user_id, user_email, video_id, limit)
     return [_video_progress_response(record) for record in records]
 
 
+@app.get("/videos/next-assets")
+async def get_next_assets(stream: str, user_id: Optional[str] = None, user_email: Optional[str] = None, lookahead: int = 2):
+    """Predict the next clips of ``stream`` for this viewer, pre-sign them and warm the disk cache."""
+    if stream not in STREAM_SEQUENCES:
+        raise HTTPException(status_code=404, detail="Unknown stream")
+    rows = await _load_video_progress(user_id, user_email, None, 20) if user_id or user_email else []
+    latest, steps = predict_next_clips(stream, rows, lookahead)
+    names = [step.object_name for step in steps]
+    signed = await video_catalog.ensure_signed(names)
+    video_cache.prefetch(names)
+    assets = []
+    links = []
+    for step in steps:
+        url, expires_at = signed.get(step.object_name, (None, None))
+        assets.append(
+            {
+                "video_id": step.progress_id,
+                "file_name": step.object_name,
+                "url": url,
+                "expires_at": int(expires_at) if expires_at else None,
+                "stream_url": f"/videos/stream/{quote(step.object_name)}",
+            }
+        )
+        if url:
+            links.append(f'<{url}>; rel=prefetch; as=video')
+    current = None
+    if latest is not None:
+        current = {
+            "video_id": latest["video_id"],
+            "progress": latest.get("progress"),
+            "position_seconds": latest.get("position_seconds"),
+        }
+    headers = {"Cache-Control": "private, no-cache"}
+    if links:
+        headers["Link"] = ", ".join(links)
+    return JSONResponse({"stream": stream, "current": current, "assets": assets}, headers=headers)
+
+
 @app.get("/scores/me", response_model=ScoreSummaryResponse)
 async def get_my_score(request: Request, user_email: Optional[str] = None):
     user_id, email = await _resolve_score_identity(request, user_email)
     if not user_id:
         raise HTTPException(status_code=401, detail="Unable to resolve user for score lookup")
-    record = await sb_repo.get_user_score(user_id)
+    record = await score_cache.get_or_load(user_id, lambda: sb_repo.get_user_score(user_id))
     return _score_response(record)
 
 
 @app.post("/scores/events", response_model=ScoreSummaryResponse)
-async def record_score_event(request: Request, payload: ScoreEventRequest):
-    user_id, email = await _resolve_score_identity(request, payload.user_email)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Unable to resolve user for score update")
-    points = max(payload.points_earned, 0.0)
-    possible = max(payload.points_possible, 0.0) or points
-    current = await sb_repo.get_user_score(user_id)
-    total_points = float(current.get("total_points") or 0.0) + points if current else points
-    total_possible = float(current.get("total_possible") or 0.0) + possible if current else possible
-    record = await sb_repo.upsert_user_score(user_id, email, total_points, total_possible)
-    return _score_response(record)
+async def record_score_event(request: Request, response: Response, payload: ScoreEventRequest):
+    async def apply() -> Dict[str, object]:
+        user_id, email = await _resolve_score_identity(request, payload.user_email)
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Unable to resolve user for score update")
+        points = max(payload.points_earned, 0.0)
+        possible = max(payload.points_possible, 0.0) or points
+        current = await sb_repo.get_user_score(user_id)
+        total_points = float(current.get("total_points") or 0.0) + points if current else points
+        total_possible = float(current.get("total_possible") or 0.0) + possible if current else possible
+        record = await sb_repo.upsert_user_score(user_id, email, total_points, total_possible)
+        await score_cache.set(user_id, record)
+        feature_store.record_score(user_id, payload.source, points, possible)
+        summary = _score_response(record).dict()
+        await live_updates.publish(_score_topic(user_id), "score", summary)
+        return summary
+
+    idem_key = _idempotency_scope(request, None, owner=payload.user_email)
+    if not idem_key:
+        return await apply()
+    result, replayed = await idempotency_store.run(idem_key, apply)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+@app.get("/bootstrap")
+async def bootstrap(request: Request, user_id: Optional[str] = None, user_email: Optional[str] = None, progress_limit: int = 20):
+    """User, score, recent progress and the video catalog for page load, resolving the session once."""
+    user = await get_user_by_session(request.cookies.get("session_id"))
+    score_user_id, email = _score_identity(user, user_email)
+    progress_email = user_email or (email if not user_id else None)
+    progress_limit = max(1, min(progress_limit, 100))
+
+    async def load_score() -> Optional[ScoreSummaryResponse]:
+        if not score_user_id:
+            return None
+        return _score_response(await score_cache.get_or_load(score_user_id, lambda: sb_repo.get_user_score(score_user_id)))
+
+    async def load_progress() -> List[VideoProgressResponse]:
+        if not user_id and not progress_email:
+            return []
+        records = await _load_video_progress(user_id, progress_email, None, progress_limit)
+        return [_video_progress_response(record) for record in records]
+
+    score, progress, (catalog, catalog_etag) = await asyncio.gather(load_score(), load_progress(), video_catalog.snapshot())
+    body = jsonable_encoder(
+        {
+            "user": _public_user(user.__dict__) if user else None,
+            "score": score,
+            "progress": progress,
+        }
+    )
+    # The catalog already has a content hash; fold it in rather than re-hashing every item.
+    digest = hashlib.sha256(json.dumps([catalog_etag, body], sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    etag = '"' + digest.hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body["catalog"] = catalog
+    return JSONResponse(body, headers=headers)
+
+
+@app.get("/recommendations")
+async def get_recommendations(request: Request, user_id: Optional[str] = None, user_email: Optional[str] = None):
+    """Rank study streams for this viewer from their dwell, completion and score features."""
+    score_user_id, email = await _resolve_score_identity(request, user_email)
+    sid_cookie = request.cookies.get("session_id")
+    keys = []
+    if score_user_id:
+        keys.append(score_user_id)
+    if sid_cookie:
+        keys.append(f"session:{_caller_hash(sid_cookie)}")
+    if email:
+        keys.append(_progress_feature_key(None, email))
+    if user_id:
+        keys.append(_progress_feature_key(user_id, None))
+    if not keys:
+        raise HTTPException(status_code=400, detail="A session, user_id or user_email is required")
+    streams, scored_ms = feature_store.recommend(keys)
+    return {"streams": streams, "scored_in_ms": round(scored_ms, 4)}
+
+
+@app.get("/live/updates")
+async def live_updates_stream(request: Request, user_id: Optional[str] = None, user_email: Optional[str] = None):
+    """Server-Sent Events stream of ``score`` and ``progress`` updates for this viewer, replacing polling."""
+    score_user_id, _email = await _resolve_score_identity(request, user_email)
+    topics = _progress_topics(user_id, user_email)
+    if score_user_id:
+        topics.append(_score_topic(score_user_id))
+    if not topics:
+        raise HTTPException(status_code=400, detail="A session, user_id or user_email is required")
+    subscription = live_updates.subscribe(topics)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many live streams", headers={"Retry-After": "30"})
+
+    async def stream():
+        event_id = 0
+        try:
+            yield b"retry: 3000\n\n" + format_sse("ready", {"topics": sorted(subscription.topics)})
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), timeout=LIVE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                event_id += 1
+                yield format_sse(message["event"], message["data"], event_id)
+        finally:
+            live_updates.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
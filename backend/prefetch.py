@@ -0,0 +1,56 @@
+"""Fixed clip sequences per study stream and prediction of the clips a viewer needs next."""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# A clip counts as finished at the same threshold the study-streams resume logic uses.
+COMPLETED_PROGRESS = 0.95
+MAX_LOOKAHEAD = 4
+
+
+@dataclass(frozen=True)
+class StreamStep:
+    progress_id: str
+    """``video_id`` the frontend records in ``video_progress`` while this clip plays."""
+    object_name: str
+    """Object name in the video bucket."""
+
+
+STREAM_SEQUENCES: Dict[str, Tuple[StreamStep, ...]] = {
+    "consulting": (
+        StreamStep("consulting-intro", "ExploreYou Intro.mp4"),
+        StreamStep("consulting-prompt", "in flight option for excited.mp4"),
+        StreamStep("consulting-market-intel", "Monday 630 am.mp4"),
+        StreamStep("consulting", "Airplane Video.mp4"),
+        StreamStep("next-video-consulting-segment-1", "task2 partner first day.mp4"),
+        StreamStep("next-video-consulting-segment-2", "2.2 Monday10am.mp4"),
+    ),
+}
+
+
+def _is_finished(row: Dict[str, Any]) -> bool:
+    if (row.get("task_status") or "") == "completed":
+        return True
+    if (row.get("event_name") or "").endswith("_completed"):
+        return True
+    return float(row.get("progress") or 0.0) >= COMPLETED_PROGRESS
+
+
+def predict(
+    stream: str, progress_rows: Sequence[Dict[str, Any]], lookahead: int
+) -> Tuple[Optional[Dict[str, Any]], List[StreamStep]]:
+    """Return the latest progress row within ``stream`` and the clips to warm.
+
+    ``progress_rows`` must be newest first. The clip in progress is included
+    (its tail still has to buffer), followed by up to ``lookahead`` clips.
+    Once the latest clip is finished, the window starts at the one after it.
+    """
+    steps = STREAM_SEQUENCES[stream]
+    position = {step.progress_id: index for index, step in enumerate(steps)}
+    latest = next((row for row in progress_rows if row.get("video_id") in position), None)
+    start = 0
+    if latest is not None:
+        start = position[latest["video_id"]]
+        if _is_finished(latest):
+            start += 1
+    lookahead = max(0, min(lookahead, MAX_LOOKAHEAD))
+    return latest, list(steps[start : start + 1 + lookahead])
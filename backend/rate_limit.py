@@ -0,0 +1,129 @@
+"""Token-bucket rate limiting and admission control for the FastAPI backend."""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a caller is over budget; carries the suggested retry delay."""
+
+    def __init__(self, retry_after: float, reason: str = "rate limit exceeded") -> None:
+        super().__init__(reason)
+        self.retry_after = max(retry_after, 0.0)
+        self.reason = reason
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_take(self, cost: float = 1.0, now: Optional[float] = None) -> float:
+        """Take ``cost`` tokens; return 0 on success or the seconds until enough tokens exist."""
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (cost - self.tokens) / self.rate
+
+
+class KeyedRateLimiter:
+    """One token bucket per key, bounded to ``max_keys`` most recently used keys."""
+
+    def __init__(self, rate: float, burst: float, *, max_keys: int = 10_000) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def check(self, key: str, cost: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        wait = bucket.try_take(cost)
+        if wait > 0:
+            raise RateLimitExceeded(wait)
+
+
+class AdmissionController:
+    """Global concurrency limit for Supabase-bound work with a reserve for high priority callers.
+
+    Every Supabase request holds a slot for its duration. Low-priority work
+    (telemetry) is shed as soon as in-flight work reaches ``low_priority_limit``
+    so the remaining slots stay available for login, score and progress calls,
+    which queue for a slot instead of being rejected.
+    """
+
+    def __init__(self, max_concurrency: int, low_priority_limit: int) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.low_priority_limit = max(0, min(low_priority_limit, self.max_concurrency))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+
+    def check_low_priority(self) -> None:
+        if self.in_flight >= self.low_priority_limit:
+            raise RateLimitExceeded(1.0, "server busy")
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+
+session_limiter = KeyedRateLimiter(
+    _env_float("RATE_LIMIT_SESSION_PER_SEC", 5.0),
+    _env_float("RATE_LIMIT_SESSION_BURST", 20.0),
+)
+ip_limiter = KeyedRateLimiter(
+    _env_float("RATE_LIMIT_IP_PER_SEC", 20.0),
+    _env_float("RATE_LIMIT_IP_BURST", 60.0),
+)
+admission = AdmissionController(
+    int(_env_float("SUPABASE_MAX_CONCURRENCY", 32)),
+    int(_env_float("SUPABASE_TELEMETRY_CONCURRENCY", 20)),
+)
+
+
+def admit_telemetry(client_ip: Optional[str], session_key: Optional[str]) -> None:
+    """Admission check for low-priority tracking writes; raises ``RateLimitExceeded``."""
+    if session_key:
+        session_limiter.check(session_key)
+    if client_ip:
+        ip_limiter.check(client_ip)
+    admission.check_low_priority()
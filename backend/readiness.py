@@ -0,0 +1,67 @@
+"""Startup warm-up steps and the readiness state behind ``/healthz`` and ``/readyz``."""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+WarmupStep = Callable[[], Awaitable[Any]]
+
+
+class Readiness:
+    """Runs registered warm-up steps once at startup and reports whether the worker may take traffic.
+
+    Required steps are retried with capped exponential backoff until they
+    pass; the worker stays unready (``/readyz`` answers 503) meanwhile.
+    Optional steps run once and only affect the report.
+    """
+
+    def __init__(self, *, retry_interval: float = 1.0, max_retry_interval: float = 30.0) -> None:
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.started_at = time.monotonic()
+        self.ready_at: Optional[float] = None
+        self.checks: Dict[str, Dict[str, Any]] = {}
+        self._steps: List[Tuple[str, WarmupStep, bool]] = []
+
+    def add_step(self, name: str, step: WarmupStep, *, required: bool = True) -> None:
+        self._steps.append((name, step, required))
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = (self.ready_at or time.monotonic()) - self.started_at
+        return {
+            "ready": self.ready,
+            "startup_seconds": round(elapsed, 4),
+            "checks": self.checks,
+        }
+
+    async def _run_step(self, name: str, step: WarmupStep) -> bool:
+        started = time.perf_counter()
+        try:
+            await step()
+        except Exception as exc:
+            self.checks[name] = {"ok": False, "error": f"{type(exc).__name__}: {exc}"}
+            logger.warning("Warm-up step %s failed: %s", name, exc)
+            return False
+        self.checks[name] = {"ok": True, "seconds": round(time.perf_counter() - started, 4)}
+        return True
+
+    async def warm_up(self) -> None:
+        """Run all steps concurrently, then retry failed required steps until they pass."""
+        self.started_at = time.monotonic()
+        pending = self._steps
+        delay = self.retry_interval
+        while True:
+            results = await asyncio.gather(*(self._run_step(name, step) for name, step, _required in pending))
+            pending = [entry for entry, ok in zip(pending, results) if not ok and entry[2]]
+            if not pending:
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_interval)
+        self.ready_at = time.monotonic()
+        logger.info("Ready after %.3fs", self.ready_at - self.started_at)
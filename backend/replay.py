@@ -0,0 +1,118 @@
+"""Ordered read-back of a page session for ``GET /page-sessions/{psid}/timeline``.
+
+Events are read in keyset pages on ``(event_timestamp, id)``, backed by
+``ix_events_session_timeline`` (``my-app/scripts/006_create_events_timeline_index.sql``).
+The small side sources are merged in by timestamp as pages stream out:
+trajectory moves, dwell totals and video progress. ``ReplayCache`` keeps the
+merged timelines of recently replayed sessions that have ended. It is an
+LRU bounded by total item count. Open sessions are always read fresh, because
+late or spooled events can still land before the last keyset position.
+"""
+import json
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from clock import to_ms
+
+Item = Dict[str, Any]
+# loader(psid, after, limit) -> event rows ordered by (event_timestamp, id); ``after`` is the last row's
+# (event_timestamp, id) exactly as returned, since milliseconds would cut off microsecond timestamps
+EventPageLoader = Callable[[str, Optional[Tuple[str, int]], int], Awaitable[List[Dict[str, Any]]]]
+
+
+def event_item(row: Dict[str, Any]) -> Item:
+    data = row.get("data")
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError:
+            pass
+    return {"t": to_ms(row["event_timestamp"]), "kind": "event", "id": row["id"], "type": row["event_type"], "x": row.get("x"), "y": row.get("y"), "data": data}
+
+
+def move_item(point: Tuple[int, int, int]) -> Item:
+    return {"t": point[0], "kind": "move", "x": point[1], "y": point[2]}
+
+
+def dwell_item(row: Dict[str, Any]) -> Item:
+    return {
+        "t": to_ms(row.get("last_updated") or row.get("first_seen")),
+        "kind": "dwell",
+        "target_key": row["target_key"],
+        "label": row.get("target_label"),
+        "total_duration_ms": row.get("total_duration_ms"),
+        "total_entries": row.get("total_entries"),
+        "first_seen": to_ms(row.get("first_seen")),
+    }
+
+
+def progress_item(row: Dict[str, Any]) -> Item:
+    return {
+        "t": to_ms(row.get("last_event_at") or row.get("updated_at")),
+        "kind": "progress",
+        "video_id": row["video_id"],
+        "progress": row.get("progress"),
+        "position_seconds": row.get("position_seconds"),
+        "task_status": row.get("task_status"),
+        "event_name": row.get("event_name"),
+    }
+
+
+async def event_pages(loader: EventPageLoader, psid: str, page_size: int) -> AsyncIterator[List[Item]]:
+    after: Optional[Tuple[str, int]] = None
+    while True:
+        rows = await loader(psid, after, page_size)
+        if rows:
+            after = (str(rows[-1]["event_timestamp"]), rows[-1]["id"])
+            yield [event_item(row) for row in rows]
+        if len(rows) < page_size:
+            return
+
+
+async def merge_timeline(pages: AsyncIterator[List[Item]], extras: List[Item]) -> AsyncIterator[List[Item]]:
+    """Interleave time-ordered event pages with ``extras``, one output chunk per page."""
+    extras = sorted(extras, key=lambda item: item["t"] or 0)
+    pending = 0
+    async for page in pages:
+        horizon = page[-1]["t"]
+        start = pending
+        while pending < len(extras) and (extras[pending]["t"] or 0) <= horizon:
+            pending += 1
+        yield sorted(page + extras[start:pending], key=lambda item: item["t"] or 0)
+    if pending < len(extras):
+        yield extras[pending:]
+
+
+class ReplayCache:
+    def __init__(self, *, max_items: int = 200_000, max_sessions: int = 64) -> None:
+        self.max_items = max_items
+        self.max_sessions = max_sessions
+        self._timelines: "OrderedDict[str, List[Item]]" = OrderedDict()
+        self._items = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, psid: str) -> Optional[List[Item]]:
+        timeline = self._timelines.get(psid)
+        if timeline is None:
+            self.misses += 1
+            return None
+        self._timelines.move_to_end(psid)
+        self.hits += 1
+        return timeline
+
+    def put(self, psid: str, timeline: List[Item]) -> None:
+        # One session may use at most a quarter of the budget so a huge replay cannot flush the rest.
+        if len(timeline) > self.max_items // 4:
+            return
+        self.discard(psid)
+        self._timelines[psid] = timeline
+        self._items += len(timeline)
+        while self._items > self.max_items or len(self._timelines) > self.max_sessions:
+            _, evicted = self._timelines.popitem(last=False)
+            self._items -= len(evicted)
+
+    def discard(self, psid: str) -> None:
+        timeline = self._timelines.pop(psid, None)
+        if timeline is not None:
+            self._items -= len(timeline)
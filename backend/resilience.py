@@ -0,0 +1,150 @@
+"""Retry policy and circuit breakers used by the Supabase client."""
+import os
+import random
+import time
+from typing import Dict, Optional
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling Supabase while a table's circuit is open."""
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"Supabase circuit for '{name}' is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open (single probe) -> closed."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, *, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def before_call(self) -> bool:
+        """Admit a call or raise ``CircuitOpenError``; True when the call is the half-open probe.
+
+        A probe must be followed by ``release_probe`` (in a ``finally``) so a
+        cancelled or otherwise unrecorded probe does not hold the slot forever.
+        """
+        if self.state == self.CLOSED:
+            return False
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.reset_timeout - now
+            if remaining > 0:
+                raise CircuitOpenError(self.name, remaining)
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self._probe_in_flight:
+            raise CircuitOpenError(self.name, self.reset_timeout)
+        self._probe_in_flight = True
+        return True
+
+    def release_probe(self) -> None:
+        """Free the probe slot without recording an outcome; a no-op once one was recorded."""
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN and time.monotonic() < self.opened_at + self.reset_timeout
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(name: str) -> CircuitBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            name,
+            failure_threshold=int(_env_float("SUPABASE_BREAKER_FAILURES", 5)),
+            reset_timeout=_env_float("SUPABASE_BREAKER_RESET_SECONDS", 10.0),
+        )
+        _breakers[name] = breaker
+    return breaker
+
+
+def breaker_states() -> Dict[str, str]:
+    return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+class RetryPolicy:
+    """Capped exponential backoff with full jitter, bounded per call and globally.
+
+    ``max_attempts`` and ``max_elapsed`` bound a single call; the retry budget
+    (a token bucket refilled by successful first attempts) keeps retries to a
+    fraction of overall traffic so a brownout does not multiply load.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        max_elapsed: float,
+        budget_ratio: float,
+        budget_min: float,
+    ) -> None:
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.budget_ratio = budget_ratio
+        self.budget_min = budget_min
+        self._budget = budget_min
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(0.0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def record_request(self) -> None:
+        self._budget = min(self._budget + self.budget_ratio, self.budget_min + 100 * self.budget_ratio)
+
+    def try_spend(self) -> bool:
+        if self._budget >= 1.0:
+            self._budget -= 1.0
+            return True
+        return False
+
+
+retry_policy = RetryPolicy(
+    max_attempts=int(_env_float("SUPABASE_RETRY_ATTEMPTS", 3)),
+    base_delay=_env_float("SUPABASE_RETRY_BASE_SECONDS", 0.1),
+    max_delay=_env_float("SUPABASE_RETRY_MAX_DELAY_SECONDS", 1.0),
+    max_elapsed=_env_float("SUPABASE_RETRY_MAX_ELAPSED_SECONDS", 3.0),
+    budget_ratio=_env_float("SUPABASE_RETRY_BUDGET_RATIO", 0.2),
+    budget_min=_env_float("SUPABASE_RETRY_BUDGET_MIN", 10.0),
+)
@@ -0,0 +1,128 @@
+"""In-process scheduler for periodic maintenance jobs, run by one elected worker.
+
+Every worker runs ``Scheduler.run``, but jobs only execute on the worker
+that holds the named lease (``scheduler_leases`` row, see
+``my-app/scripts/003_create_scheduler_leases.sql``). The leader renews it
+every third of ``lease_seconds``. If that worker dies, the lease lapses
+and another worker takes over within ``lease_seconds``. Jobs run one at a
+time and are timed; ``report()`` backs ``GET /scheduler``.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from clock import clock, ms_to_iso
+
+logger = logging.getLogger(__name__)
+
+AcquireLease = Callable[[str, str, int], Awaitable[bool]]
+ReleaseLease = Callable[[str, str], Awaitable[None]]
+
+
+@dataclass
+class Job:
+    name: str
+    fn: Callable[[], Awaitable[Any]]
+    interval: float
+    next_due: float = 0.0
+    runs: int = 0
+    failures: int = 0
+    last_started_ms: Optional[int] = None
+    last_duration_ms: Optional[float] = None
+    total_duration_ms: float = 0.0
+    last_result: Any = None
+    last_error: Optional[str] = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_started_at": ms_to_iso(self.last_started_ms) if self.last_started_ms else None,
+            "last_duration_ms": round(self.last_duration_ms, 2) if self.last_duration_ms is not None else None,
+            "mean_duration_ms": round(self.total_duration_ms / self.runs, 2) if self.runs else None,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+class Scheduler:
+    def __init__(
+        self,
+        acquire: AcquireLease,
+        release: ReleaseLease,
+        *,
+        lease_name: str = "maintenance",
+        lease_seconds: int = 30,
+        tick_seconds: float = 1.0,
+    ) -> None:
+        self.acquire = acquire
+        self.release = release
+        self.lease_name = lease_name
+        self.lease_seconds = lease_seconds
+        self.tick_seconds = tick_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._jobs: List[Job] = []
+        self._lease_checked = 0.0
+
+    def add_job(self, name: str, fn: Callable[[], Awaitable[Any]], *, every: float, delay: float = 0.0) -> None:
+        """Run ``fn`` every ``every`` seconds while leader; the first run waits ``delay`` seconds."""
+        self._jobs.append(Job(name, fn, every, next_due=time.monotonic() + delay))
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "holder": self.holder,
+            "leader": self.is_leader,
+            "jobs": {job.name: job.summary() for job in self._jobs},
+        }
+
+    async def _check_lease(self) -> None:
+        try:
+            leader = await self.acquire(self.lease_name, self.holder, self.lease_seconds)
+        except Exception:
+            logger.warning("Scheduler lease check failed", exc_info=True)
+            leader = False
+        if leader != self.is_leader:
+            logger.info("Scheduler %s %s lease %r", self.holder, "acquired" if leader else "lost", self.lease_name)
+        self.is_leader = leader
+        self._lease_checked = time.monotonic()
+
+    async def run_job(self, job: Job) -> None:
+        job.last_started_ms = clock.now_ms()
+        started = time.perf_counter()
+        try:
+            job.last_result = await job.fn()
+            job.last_error = None
+        except Exception as exc:
+            job.failures += 1
+            job.last_error = f"{type(exc).__name__}: {exc}"
+            logger.exception("Scheduled job %s failed", job.name)
+        job.runs += 1
+        job.last_duration_ms = (time.perf_counter() - started) * 1000.0
+        job.total_duration_ms += job.last_duration_ms
+        job.next_due = time.monotonic() + job.interval
+
+    async def run(self) -> None:
+        """Hold or contend for the lease and run due jobs; run as a background task."""
+        try:
+            while True:
+                if time.monotonic() - self._lease_checked >= self.lease_seconds / 3:
+                    await self._check_lease()
+                if self.is_leader:
+                    for job in self._jobs:
+                        if time.monotonic() >= job.next_due:
+                            await self.run_job(job)
+                await asyncio.sleep(self.tick_seconds)
+        finally:
+            if self.is_leader:
+                self.is_leader = False
+                try:
+                    await asyncio.shield(self.release(self.lease_name, self.holder))
+                except Exception:
+                    logger.warning("Releasing scheduler lease failed", exc_info=True)
@@ -0,0 +1,75 @@
+"""Stateless signed session tokens for anonymous visitors.
+
+A token looks like ``anon.<id>.<expires_ms>.<signature>``. The signature
+is a truncated HMAC-SHA256 over the other parts, so a worker can check a
+token without touching the ``sessions`` table. Tokens never carry a user.
+Logging in still issues a database-backed session.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+from typing import Optional, Tuple
+
+from clock import clock
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "anon"
+
+
+def is_anonymous(token: Optional[str]) -> bool:
+    return bool(token) and token.startswith(PREFIX + ".")
+
+
+class AnonymousTokens:
+    def __init__(self, secret: bytes, *, lifetime_seconds: int) -> None:
+        self.secret = secret
+        self.lifetime_seconds = lifetime_seconds
+
+    def _sign(self, payload: str) -> str:
+        digest = hmac.new(self.secret, payload.encode("ascii"), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest[:18]).decode("ascii")
+
+    def issue(self) -> Tuple[str, int]:
+        """Return ``(token, expires_ms)``."""
+        expires_ms = clock.coarse_ms() + self.lifetime_seconds * 1000
+        payload = f"{PREFIX}.{secrets.token_urlsafe(12)}.{expires_ms}"
+        return f"{payload}.{self._sign(payload)}", expires_ms
+
+    def fingerprint(self, value: str) -> str:
+        """Keyed hash of a cookie or other caller id, for keys that are written to disk.
+
+        Stable across workers and restarts only when ``SESSION_TOKEN_SECRET`` is set.
+        """
+        return hmac.new(self.secret, value.encode("utf-8", "surrogateescape"), hashlib.sha256).hexdigest()[:32]
+
+    def verify(self, token: Optional[str]) -> Optional[int]:
+        """Expiry in epoch ms for a well-signed, unexpired token; otherwise None."""
+        # Issued tokens are ASCII; anything else would make the ASCII encode and compare_digest raise.
+        if not is_anonymous(token) or not token.isascii():
+            return None
+        payload, _, signature = token.rpartition(".")
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        try:
+            expires_ms = int(payload.rsplit(".", 1)[1])
+        except (IndexError, ValueError):
+            return None
+        return expires_ms if expires_ms > clock.coarse_ms() else None
+
+
+def _secret() -> bytes:
+    configured = os.getenv("SESSION_TOKEN_SECRET")
+    if configured:
+        return configured.encode("utf-8")
+    logger.warning("SESSION_TOKEN_SECRET is not set; anonymous session tokens will not verify across workers or restarts")
+    return secrets.token_bytes(32)
+
+
+anonymous_tokens = AnonymousTokens(
+    _secret(),
+    lifetime_seconds=int(os.getenv("ANONYMOUS_SESSION_DAYS", "") or 30) * 86_400,
+)
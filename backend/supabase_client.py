@@ -1,11 +1,20 @@
 """Utility helpers for calling Supabase REST API asynchronously."""
+import asyncio
+import json
+import logging
 import os
-from typing import Any, Dict, Optional
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
 from collections.abc import Iterable
 from urllib.parse import quote
 
 import httpx
 
+from compression import ENCODINGS as COMPRESSION_ENCODINGS, compress
+from log_pipeline import REQUEST_ID_HEADER, correlation_id
+from rate_limit import admission
+from resilience import breaker_for, retry_policy
+
 _SUPABASE_URL = os.getenv("SUPABASE_URL", "").strip() or None
 # Get service role key or fallback to anon key, ensuring no whitespace
 _service_key = (os.getenv("SUPABASE_SERVICE_ROLE_KEY") or "").strip()
@@ -14,12 +23,34 @@ _SUPABASE_KEY = _service_key or _anon_key or None
 
 if _SUPABASE_URL:
     _REST_BASE = _SUPABASE_URL.rstrip("/") + "/rest/v1"
+    _STORAGE_BASE = _SUPABASE_URL.rstrip("/") + "/storage/v1"
 else:
     _REST_BASE = None
+    _STORAGE_BASE = None
 
 _HEADERS: Optional[Dict[str, str]] = None
 _client: Optional[httpx.AsyncClient] = None
 
+# ``in.()`` lists longer than this many URL-encoded characters are split into concurrent sub-requests.
+_IN_FILTER_MAX_CHARS = int(os.getenv("SUPABASE_IN_FILTER_MAX_CHARS", "") or 2000)
+# Selects with more values than this go through the ``select_in`` RPC (my-app/scripts/004) in one POST.
+_IN_FILTER_RPC_THRESHOLD = int(os.getenv("SUPABASE_IN_FILTER_RPC_THRESHOLD", "") or 2000)
+_IN_FILTER_CONCURRENCY = 8
+_select_in_rpc_available = True
+
+# Opt-in ``Content-Encoding`` (gzip or zstd) for large JSON bodies. PostgREST itself does not inflate
+# request bodies, so enable this only when the gateway in front of it does. A rejected compressed body
+# (415, or PostgREST's PGRST102 "invalid JSON") turns it off for the process and is resent as plain JSON.
+_REQUEST_COMPRESSION = (os.getenv("SUPABASE_REQUEST_COMPRESSION") or "").strip().lower() or None
+_REQUEST_COMPRESSION_MIN_BYTES = int(os.getenv("SUPABASE_REQUEST_COMPRESSION_MIN_BYTES", "") or 16384)
+_request_compression_accepted = True
+
+logger = logging.getLogger(__name__)
+
+if _REQUEST_COMPRESSION and _REQUEST_COMPRESSION not in COMPRESSION_ENCODINGS:
+    logger.warning("SUPABASE_REQUEST_COMPRESSION=%s is not available here; request bodies stay uncompressed", _REQUEST_COMPRESSION)
+    _REQUEST_COMPRESSION = None
+
 
 def is_enabled() -> bool:
     """Return True when Supabase credentials are present."""
@@ -50,11 +81,23 @@ async def _get_client() -> httpx.AsyncClient:
         _client = httpx.AsyncClient(
             base_url=_REST_BASE,
             headers=_ensure_headers(),
-            timeout=httpx.Timeout(15.0, read=15.0, write=15.0),
+            timeout=httpx.Timeout(15.0, connect=3.0, read=15.0, write=15.0),
         )
     return _client
 
 
+async def connect() -> None:
+    """Create the shared client and finish the TCP/TLS handshake before the first real request."""
+    client = await _get_client()
+    # Any HTTP answer means the pooled connection is established.
+    await client.head("/")
+
+
+async def probe_table(table: str) -> None:
+    """Cheap existence check; PostgREST answers 404 for unknown relations."""
+    await request("GET", f"/{table}", params={"select": "*", "limit": "0"})
+
+
 async def close_client() -> None:
     """Close the shared HTTP client."""
     global _client
@@ -63,12 +106,16 @@ async def close_client() -> None:
         _client = None
 
 
+def _is_list(value: Any) -> bool:
+    return isinstance(value, Iterable) and not isinstance(value, (str, bytes, bytearray))
+
+
 def _encode_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, str]:
     params: Dict[str, str] = {}
     if not filters:
         return params
     for key, value in filters.items():
-        if isinstance(value, Iterable) and not isinstance(value, (str, bytes, bytearray)):
+        if _is_list(value):
             joined = ",".join(quote(str(v), safe="") for v in value)
             params[key] = f"in.({joined})"
         else:
@@ -76,6 +123,75 @@ def _encode_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, str]:
     return params
 
 
+def _split_filters(filters: Optional[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+    """Split the longest ``in`` list into disjoint chunks that each fit ``_IN_FILTER_MAX_CHARS``.
+
+    Returns ``[filters]`` when nothing needs splitting. Other lists that are
+    still too long are split when each chunk is requested.
+    """
+    lists = {key: [str(v) for v in value] for key, value in (filters or {}).items() if _is_list(value)}
+    if not lists:
+        return [filters]
+    sizes = {key: sum(len(quote(v, safe="")) + 1 for v in values) for key, values in lists.items()}
+    key = max(sizes, key=sizes.__getitem__)
+    if sizes[key] <= _IN_FILTER_MAX_CHARS:
+        return [filters]
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    size = 0
+    for value in dict.fromkeys(lists[key]):
+        cost = len(quote(value, safe="")) + 1
+        if current and size + cost > _IN_FILTER_MAX_CHARS:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(value)
+        size += cost
+    chunks.append(current)
+    return [dict(filters, **{key: chunk}) for chunk in chunks]
+
+
+def _largest_list(filters: Dict[str, Any]) -> str:
+    return max((key for key, value in filters.items() if _is_list(value)), key=lambda key: len(list(filters[key])))
+
+
+def _sort_rows(rows: List[Dict[str, Any]], order: str, desc: bool) -> None:
+    """Order merged chunk results the way PostgREST does: nulls last ascending, first descending."""
+    rows.sort(key=lambda row: (row.get(order) is None, row.get(order) if row.get(order) is not None else 0), reverse=desc)
+
+
+async def _gather_chunks(parts: Sequence[Optional[Dict[str, Any]]], call: Callable[[Optional[Dict[str, Any]]], Awaitable[Any]]) -> List[Any]:
+    semaphore = asyncio.Semaphore(_IN_FILTER_CONCURRENCY)
+
+    async def run(part: Optional[Dict[str, Any]]) -> Any:
+        async with semaphore:
+            return await call(part)
+
+    return await asyncio.gather(*(run(part) for part in parts))
+
+
+_RETRYABLE_STATUS = {429, 502, 503, 504}
+
+
+def _table_of(path: str) -> str:
+    if _STORAGE_BASE and path.startswith(_STORAGE_BASE):
+        return "storage"
+    return path.lstrip("/").split("/", 1)[0].split("?", 1)[0] or "_root"
+
+
+def _is_idempotent(method: str, headers: Dict[str, str]) -> bool:
+    if method in ("GET", "HEAD"):
+        return True
+    return method == "POST" and "resolution=merge-duplicates" in headers.get("Prefer", "")
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
 async def request(
     method: str,
     path: str,
@@ -83,7 +199,16 @@ async def request(
     params: Optional[Dict[str, Any]] = None,
     json_body: Optional[Any] = None,
     headers: Optional[Dict[str, str]] = None,
+    idempotent: Optional[bool] = None,
 ) -> httpx.Response:
+    """Send a REST request with retries for idempotent calls and a per-table circuit breaker.
+
+    Reads and upserts are retried on transient failures (connection errors,
+    timeouts, 429/502/503/504). Plain inserts, updates and deletes are only
+    retried when the connection could not be established. Raises
+    ``CircuitOpenError`` without touching the network while the table's
+    breaker is open.
+    """
     client = await _get_client()
     merged_headers = _ensure_headers().copy()
     if headers:
@@ -91,9 +216,87 @@ async def request(
         for key, value in headers.items():
             if value and value.strip():
                 merged_headers[key] = value
-    response = await client.request(method, path, params=params, json=json_body, headers=merged_headers)
-    response.raise_for_status()
-    return response
+    request_id = correlation_id.get()
+    if request_id:
+        # Lets PostgREST/API gateway logs be matched to the request that caused them.
+        merged_headers[REQUEST_ID_HEADER] = request_id
+    if idempotent is None:
+        idempotent = _is_idempotent(method, merged_headers)
+    content = _compressed_body(json_body, merged_headers)
+    breaker = breaker_for(_table_of(path))
+    retry_policy.record_request()
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        probe = breaker.before_call()
+        retry_after: Optional[float] = None
+        try:
+            async with admission.slot():
+                if content is None:
+                    response = await client.request(method, path, params=params, json=json_body, headers=merged_headers)
+                else:
+                    response = await client.request(method, path, params=params, content=content, headers=merged_headers)
+        except httpx.TransportError as exc:
+            breaker.record_failure()
+            retryable = idempotent or isinstance(exc, httpx.ConnectError)
+            if not retryable or not _should_retry(attempt, started):
+                raise
+        else:
+            if content is not None and _compression_rejected(response):
+                # Nothing was applied; resend the same request uncompressed without spending a retry.
+                # Supabase answered, so close out this attempt before the resend is admitted again.
+                breaker.record_success()
+                content = None
+                del merged_headers["Content-Encoding"]
+                continue
+            if response.status_code < 500 and response.status_code != 429:
+                breaker.record_success()
+                response.raise_for_status()
+                return response
+            breaker.record_failure()
+            if not idempotent or response.status_code not in _RETRYABLE_STATUS or not _should_retry(attempt, started):
+                response.raise_for_status()
+                return response
+            retry_after = _retry_after(response)
+        finally:
+            # Cancellation, admission errors or anything else unrecorded must not strand the half-open probe.
+            if probe:
+                breaker.release_probe()
+        await asyncio.sleep(retry_policy.backoff(attempt, retry_after))
+        attempt += 1
+
+
+def _compressed_body(json_body: Any, headers: Dict[str, str]) -> Optional[bytes]:
+    """Encoded body when upstream compression is on and ``json_body`` is large enough; sets ``Content-Encoding``."""
+    if json_body is None or not _REQUEST_COMPRESSION or not _request_compression_accepted:
+        return None
+    raw = json.dumps(json_body, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+    if len(raw) < _REQUEST_COMPRESSION_MIN_BYTES:
+        return None
+    headers["Content-Encoding"] = _REQUEST_COMPRESSION
+    return compress(raw, _REQUEST_COMPRESSION, level=1)
+
+
+def _compression_rejected(response: httpx.Response) -> bool:
+    global _request_compression_accepted
+    rejected = response.status_code == 415
+    if response.status_code == 400:
+        try:
+            rejected = response.json().get("code") == "PGRST102"
+        except (ValueError, AttributeError):
+            rejected = False
+    if rejected and _request_compression_accepted:
+        _request_compression_accepted = False
+        logger.warning("Supabase rejected %s request bodies; sending uncompressed JSON from now on", _REQUEST_COMPRESSION)
+    return rejected
+
+
+def _should_retry(attempt: int, started: float) -> bool:
+    if attempt + 1 >= retry_policy.max_attempts:
+        return False
+    if time.monotonic() - started >= retry_policy.max_elapsed:
+        return False
+    return retry_policy.try_spend()
 
 
 async def select(
@@ -104,20 +307,65 @@ async def select(
     limit: Optional[int] = None,
     order: Optional[str] = None,
     desc: bool = False,
+    select: str = "*",
 ) -> Any:
-    params: Dict[str, Any] = {"select": "*"}
-    params.update(_encode_filters(filters))
-    if limit is not None:
-        params["limit"] = str(limit)
-    if order:
-        params["order"] = f"{order}.{'desc' if desc else 'asc'}"
-    response = await request("GET", f"/{table}", params=params)
-    data = response.json()
+    """Select rows (``select`` columns); long ``in`` lists are fetched in concurrent chunks and merged, keeping ``order`` and ``limit``."""
+    parts = _split_filters(filters)
+    if len(parts) == 1:
+        params: Dict[str, Any] = {"select": select}
+        params.update(_encode_filters(filters))
+        if limit is not None:
+            params["limit"] = str(limit)
+        if order:
+            params["order"] = f"{order}.{'desc' if desc else 'asc'}"
+        response = await request("GET", f"/{table}", params=params)
+        data = response.json()
+    else:
+        data = await _select_large_in(table, filters, parts, limit=limit, order=order, desc=desc, columns=select)
     if single:
         return data[0] if data else None
     return data
 
 
+async def _select_large_in(
+    table: str,
+    filters: Dict[str, Any],
+    parts: Sequence[Optional[Dict[str, Any]]],
+    *,
+    limit: Optional[int],
+    order: Optional[str],
+    desc: bool,
+    columns: str,
+) -> List[Dict[str, Any]]:
+    global _select_in_rpc_available
+    column = _largest_list(filters)
+    values = [str(v) for v in dict.fromkeys(str(v) for v in filters[column])]
+    # The RPC returns whole rows, so narrowed selects stay on chunked GETs.
+    if _select_in_rpc_available and columns == "*" and len(values) > _IN_FILTER_RPC_THRESHOLD:
+        others = {key: [str(v) for v in value] if _is_list(value) else str(value) for key, value in filters.items() if key != column}
+        args = {
+            "p_table": table,
+            "p_column": column,
+            "p_values": values,
+            "p_filters": others,
+            "p_order": order,
+            "p_desc": desc,
+            "p_limit": limit,
+        }
+        try:
+            return await rpc("select_in", args, idempotent=True)
+        except httpx.HTTPStatusError as exc:
+            if exc.response.status_code not in (401, 403, 404):
+                raise
+            # Migration 004 not applied, or the anon key is in use (it may not execute it); chunked GETs still work.
+            _select_in_rpc_available = False
+    results = await _gather_chunks(parts, lambda part: select(table, filters=part, limit=limit, order=order, desc=desc, select=columns))
+    rows = [row for chunk in results for row in chunk]
+    if order:
+        _sort_rows(rows, order, desc)
+    return rows[:limit] if limit is not None else rows
+
+
 async def insert(
     table: str,
     payload: Any,
@@ -144,6 +392,10 @@ async def update(
     *,
     returning: bool = True,
 ) -> Any:
+    parts = _split_filters(filters)
+    if len(parts) > 1:
+        results = await _gather_chunks(parts, lambda part: update(table, part, values, returning=returning))
+        return [row for chunk in results for row in chunk] if returning else None
     prefer = "return=representation" if returning else "return=minimal"
     headers = {"Prefer": prefer}
     params = _encode_filters(filters)
@@ -152,6 +404,70 @@ async def update(
 
 
 async def delete(table: str, filters: Dict[str, Any]) -> None:
+    parts = _split_filters(filters)
+    if len(parts) > 1:
+        await _gather_chunks(parts, lambda part: delete(table, part))
+        return
     params = _encode_filters(filters)
     await request("DELETE", f"/{table}", params=params)
 
+
+async def rpc(function: str, args: Dict[str, Any], *, idempotent: bool = False) -> Any:
+    """Call a Postgres function exposed by PostgREST; ``None`` for functions returning void."""
+    response = await request("POST", f"/rpc/{function}", json_body=args, idempotent=idempotent)
+    return response.json() if response.content else None
+
+
+async def storage_list(bucket: str, *, prefix: str = "", limit: int = 1000) -> List[Dict[str, Any]]:
+    """List objects in a storage bucket, sorted by name."""
+    body = {"prefix": prefix, "limit": limit, "offset": 0, "sortBy": {"column": "name", "order": "asc"}}
+    response = await request("POST", f"{_STORAGE_BASE}/object/list/{quote(bucket, safe='')}", json_body=body, idempotent=True)
+    return response.json()
+
+
+async def storage_sign(bucket: str, paths: Sequence[str], expires_in: int) -> Dict[str, str]:
+    """Create signed URLs for many objects in one call; returns ``{path: absolute_url}``."""
+    if not paths:
+        return {}
+    body = {"expiresIn": expires_in, "paths": list(paths)}
+    response = await request("POST", f"{_STORAGE_BASE}/object/sign/{quote(bucket, safe='')}", json_body=body, idempotent=True)
+    signed: Dict[str, str] = {}
+    for entry in response.json():
+        url = entry.get("signedURL") or entry.get("signedUrl")
+        if entry.get("path") and url and not entry.get("error"):
+            signed[entry["path"]] = url if url.startswith("http") else f"{_STORAGE_BASE}{url}"
+    return signed
+
+
+async def storage_download(bucket: str, path: str, sink: Callable[[bytes], Awaitable[None]]) -> int:
+    """Stream an object from storage into ``sink`` chunk by chunk; returns the byte count."""
+    segments = path.split("/")
+    if any(segment in ("", ".", "..") or "\\" in segment for segment in segments):
+        raise ValueError(f"Refusing storage object path {path!r}")
+    client = await _get_client()
+    breaker = breaker_for("storage")
+    probe = breaker.before_call()
+    # Every segment is encoded, so an encoded "/" or ".." cannot climb out of /object/<bucket>/.
+    url = f"{_STORAGE_BASE}/object/{quote(bucket, safe='')}/" + "/".join(quote(segment, safe="") for segment in segments)
+    total = 0
+    try:
+        async with admission.slot():
+            async with client.stream("GET", url, headers={"Accept": "*/*"}) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(1024 * 1024):
+                    await sink(chunk)
+                    total += len(chunk)
+    except httpx.HTTPStatusError as exc:
+        if exc.response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    except httpx.TransportError:
+        breaker.record_failure()
+        raise
+    finally:
+        if probe:
+            breaker.release_probe()
+    breaker.record_success()
+    return total
@@ -1,25 +1,47 @@
 """Supabase data helpers used by FastAPI endpoints."""
 from __future__ import annotations
+import asyncio
 import json
 
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 from uuid import uuid4
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
 
+import trajectory
+from clock import clock, ms_to_datetime, ms_to_iso
 from supabase_client import delete as sb_delete
 from supabase_client import insert as sb_insert
+from supabase_client import request as sb_request
+from supabase_client import rpc as sb_rpc
 from supabase_client import select as sb_select
 from supabase_client import update as sb_update
 
 UTC = timezone.utc
 
-def _utc_now() -> datetime:
-    return datetime.now(tz=UTC)
+USERS_TABLE = "users"
+SESSIONS_TABLE = "sessions"
+PAGE_SESSIONS_TABLE = "page_sessions"
+EVENTS_TABLE = "events"
+CURSOR_DWELL_TABLE = "cursor_dwell_metrics"
+CURSOR_TRAJECTORIES_TABLE = "cursor_trajectories"
+VIDEO_PROGRESS_TABLE = "video_progress"
+USER_SCORES_TABLE = "user_scores"
+# Tables the handlers always read or write; ``cursor_trajectories`` only with trajectory storage on.
+TABLES = (USERS_TABLE, SESSIONS_TABLE, PAGE_SESSIONS_TABLE, EVENTS_TABLE, CURSOR_DWELL_TABLE, VIDEO_PROGRESS_TABLE, USER_SCORES_TABLE)
+# Concurrent PATCH requests per ``bulk_update_page_sessions`` call.
+PAGE_SESSION_UPDATE_CONCURRENCY = 8
 
 
-def _serialize_dt(value: Optional[datetime]) -> Optional[str]:
+def _utc_now() -> int:
+    return clock.coarse_ms()
+
+
+def _serialize_dt(value: Union[datetime, int, None]) -> Optional[str]:
+    """Storage boundary: epoch-ms ints (the in-process representation) or datetimes to ISO 8601 UTC."""
     if value is None:
         return None
+    if not isinstance(value, datetime):
+        return ms_to_iso(value)
     if value.tzinfo is None:
         value = value.replace(tzinfo=UTC)
     return value.astimezone(UTC).isoformat()
@@ -41,11 +63,11 @@ def _parse_dt(value: Optional[str]) -> Optional[datetime]:
 async def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     if not email:
         return None
-    return await sb_select("users", filters={"email": email}, single=True)
+    return await sb_select(USERS_TABLE, filters={"email": email}, single=True)
 
 
 async def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
-    return await sb_select("users", filters={"id": user_id}, single=True)
+    return await sb_select(USERS_TABLE, filters={"id": user_id}, single=True)
 
 
 async def create_user(name: str, email: str, password_hash: str) -> Dict[str, Any]:
@@ -54,46 +76,75 @@ async def create_user(name: str, email: str, password_hash: str) -> Dict[str, An
         "email": email,
         "password_hash": password_hash,
     }
-    rows = await sb_insert("users", payload)
+    rows = await sb_insert(USERS_TABLE, payload)
     if not rows:
         raise RuntimeError("Failed to insert user")
     return rows[0]
 
 
 async def update_user(email: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    rows = await sb_update("users", filters={"email": email}, values=fields)
+    rows = await sb_update(USERS_TABLE, filters={"email": email}, values=fields)
     if rows:
         return rows[0]
     return None
 
 
 async def delete_user(email: str) -> None:
-    await sb_delete("users", filters={"email": email})
+    await sb_delete(USERS_TABLE, filters={"email": email})
 
 
 async def list_users() -> List[Dict[str, Any]]:
-    rows = await sb_select("users", order="id")
+    rows = await sb_select(USERS_TABLE, order="id")
     return list(rows)
 
 
+async def existing_user_emails(emails: Sequence[str]) -> Set[str]:
+    """The subset of ``emails`` that already has a ``users`` row; long lists are chunked by ``sb_select``."""
+    if not emails:
+        return set()
+    rows = await sb_select(USERS_TABLE, filters={"email": list(emails)}, select="email")
+    return {row["email"] for row in rows}
+
+
+async def insert_users(records: Sequence[Dict[str, Any]]) -> None:
+    """Insert ``{name, email, password_hash}`` rows in one request."""
+    if records:
+        await sb_insert(USERS_TABLE, list(records), returning=False)
+
+
 async def create_session(user_id: Optional[int], lifetime_minutes: int) -> Dict[str, Any]:
     session_id = str(uuid4())
     now = _utc_now()
-    expires = now + timedelta(minutes=lifetime_minutes) if user_id is not None else None
+    expires = now + lifetime_minutes * 60_000 if user_id is not None else None
     payload = {
         "id": session_id,
         "user_id": user_id,
         "created_at": _serialize_dt(now),
         "expires_at": _serialize_dt(expires),
     }
-    await sb_insert("sessions", payload, returning=False)
-    payload["expires_at"] = expires
-    payload["created_at"] = now
+    await sb_insert(SESSIONS_TABLE, payload, returning=False)
+    payload["expires_at"] = ms_to_datetime(expires)
+    payload["created_at"] = ms_to_datetime(now)
+    return payload
+
+
+async def ensure_anonymous_session(session_id: str, expires_ms: int) -> Dict[str, Any]:
+    """Persist a row for a signed anonymous token once it must be referenced (e.g. by a page session)."""
+    now = _utc_now()
+    payload = {
+        "id": session_id,
+        "user_id": None,
+        "created_at": _serialize_dt(now),
+        "expires_at": _serialize_dt(expires_ms),
+    }
+    await sb_insert(SESSIONS_TABLE, payload, upsert=True, on_conflict="id", returning=False)
+    payload["expires_at"] = ms_to_datetime(expires_ms)
+    payload["created_at"] = ms_to_datetime(now)
     return payload
 
 
 async def get_session(session_id: str) -> Optional[Dict[str, Any]]:
-    record = await sb_select("sessions", filters={"id": session_id}, single=True)
+    record = await sb_select(SESSIONS_TABLE, filters={"id": session_id}, single=True)
     if record:
         record["created_at"] = _parse_dt(record.get("created_at"))
         record["expires_at"] = _parse_dt(record.get("expires_at"))
@@ -101,7 +152,23 @@ async def get_session(session_id: str) -> Optional[Dict[str, Any]]:
 
 
 async def delete_session(session_id: str) -> None:
-    await sb_delete("sessions", filters={"id": session_id})
+    await sb_delete(SESSIONS_TABLE, filters={"id": session_id})
+
+
+async def purge_sessions(expired_before_ms: int, anonymous_before_ms: int, limit: int) -> List[str]:
+    """Delete up to ``limit`` expired sessions, plus anonymous ones created before ``anonymous_before_ms``."""
+    params = {
+        "select": "id",
+        "or": f"(expires_at.lt.{ms_to_iso(expired_before_ms)},and(user_id.is.null,created_at.lt.{ms_to_iso(anonymous_before_ms)}))",
+        "limit": str(limit),
+    }
+    response = await sb_request("GET", f"/{SESSIONS_TABLE}", params=params)
+    ids = [row["id"] for row in response.json()]
+    if ids:
+        # Page sessions keep their analytics; only the link to the dead session goes.
+        await sb_update(PAGE_SESSIONS_TABLE, filters={"user_session_id": ids}, values={"user_session_id": None}, returning=False)
+        await sb_delete(SESSIONS_TABLE, filters={"id": ids})
+    return ids
 
 
 async def create_page_session(psid: str, *, user_session_id: Optional[str], user_id: Optional[int], page: Optional[str]) -> None:
@@ -113,17 +180,27 @@ async def create_page_session(psid: str, *, user_session_id: Optional[str], user
         "page": page,
         "created_at": _serialize_dt(now),
     }
-    await sb_insert("page_sessions", payload, returning=False)
+    await sb_insert(PAGE_SESSIONS_TABLE, payload, returning=False)
 
 
 async def get_page_session(psid: str) -> Optional[Dict[str, Any]]:
-    record = await sb_select("page_sessions", filters={"id": psid}, single=True)
+    record = await sb_select(PAGE_SESSIONS_TABLE, filters={"id": psid}, single=True)
     if record:
         for key in ("created_at", "ended_at", "last_event_at"):
             record[key] = _parse_dt(record.get(key))
     return record
 
 
+async def get_page_sessions(psids: Sequence[str]) -> List[Dict[str, Any]]:
+    if not psids:
+        return []
+    records = await sb_select(PAGE_SESSIONS_TABLE, filters={"id": list(psids)})
+    for record in records:
+        for key in ("created_at", "ended_at", "last_event_at"):
+            record[key] = _parse_dt(record.get(key))
+    return records
+
+
 async def update_page_session(psid: str, values: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     processed: Dict[str, Any] = {}
     for key, value in values.items():
@@ -131,7 +208,7 @@ async def update_page_session(psid: str, values: Dict[str, Any]) -> Optional[Dic
             processed[key] = _serialize_dt(value)
         else:
             processed[key] = value
-    rows = await sb_update("page_sessions", filters={"id": psid}, values=processed)
+    rows = await sb_update(PAGE_SESSIONS_TABLE, filters={"id": psid}, values=processed)
     if rows:
         return rows[0]
     return None
@@ -140,13 +217,97 @@ async def update_page_session(psid: str, values: Dict[str, Any]) -> Optional[Dic
 async def insert_events(events: Sequence[Dict[str, Any]]) -> None:
     if not events:
         return
+    if trajectory.STORAGE_ENABLED:
+        events, segments = trajectory.split_moves(events)
+        # Segments first: their ids are deterministic, so a retry after a failed events insert re-upserts them harmlessly.
+        await insert_trajectory_segments(segments)
+        if not events:
+            return
     payload = []
     for evt in events:
         data = dict(evt)
         for key in ("event_timestamp",):
             data[key] = _serialize_dt(data[key])
         payload.append(data)
-    await sb_insert("events", payload, returning=False)
+    await sb_insert(EVENTS_TABLE, payload, returning=False)
+
+
+async def insert_trajectory_segments(segments: Sequence[Dict[str, Any]]) -> None:
+    if not segments:
+        return
+    payload = [{**segment, "started_at": _serialize_dt(segment["started_at"]), "ended_at": _serialize_dt(segment["ended_at"])} for segment in segments]
+    await sb_insert(CURSOR_TRAJECTORIES_TABLE, payload, upsert=True, on_conflict="id", returning=False)
+
+
+async def fetch_trajectory_segments(psid: str, start_ms: int, end_ms: int) -> List[Dict[str, Any]]:
+    """Segments of a page session overlapping ``[start_ms, end_ms)``, oldest first."""
+    params = {
+        "select": "started_at,ended_at,point_count,stored_points,tolerance_px,points",
+        "page_session_id": f"eq.{psid}",
+        "and": f"(started_at.lt.{ms_to_iso(end_ms)},ended_at.gte.{ms_to_iso(start_ms)})",
+        "order": "started_at.asc",
+    }
+    response = await sb_request("GET", f"/{CURSOR_TRAJECTORIES_TABLE}", params=params)
+    return response.json()
+
+
+async def fetch_move_events(psid: str, start_ms: int, end_ms: int) -> List[Dict[str, Any]]:
+    """Move events still stored as rows (written before segments, or carrying ``data``)."""
+    params = {
+        "select": "event_timestamp,x,y",
+        "page_session_id": f"eq.{psid}",
+        "event_type": f"in.({','.join(sorted(trajectory.MOVE_EVENT_TYPES))})",
+        "and": f"(event_timestamp.gte.{ms_to_iso(start_ms)},event_timestamp.lt.{ms_to_iso(end_ms)},x.not.is.null,y.not.is.null)",
+        "order": "event_timestamp.asc",
+    }
+    response = await sb_request("GET", f"/{EVENTS_TABLE}", params=params)
+    return response.json()
+
+
+async def fetch_event_page(psid: str, after: Optional[Tuple[str, int]], limit: int) -> List[Dict[str, Any]]:
+    """One keyset page of a page session's events ordered by ``(event_timestamp, id)``.
+
+    ``after`` is the previous page's last ``(event_timestamp, id)`` as returned by
+    PostgREST, so the cursor keeps full microsecond precision.
+    """
+    params = {
+        "select": "id,event_type,event_timestamp,data,x,y",
+        "page_session_id": f"eq.{psid}",
+        "order": "event_timestamp.asc,id.asc",
+        "limit": str(limit),
+    }
+    if after is not None:
+        ts = f'"{after[0]}"'
+        params["or"] = f"(event_timestamp.gt.{ts},and(event_timestamp.eq.{ts},id.gt.{after[1]}))"
+    response = await sb_request("GET", f"/{EVENTS_TABLE}", params=params)
+    return response.json()
+
+
+async def fetch_event_points(
+    page: str,
+    start_ms: int,
+    end_ms: int,
+    after_id: int,
+    user_id: Optional[int],
+    event_type: Optional[str],
+    limit: int,
+) -> List[Dict[str, Any]]:
+    """One keyset page (``id > after_id``) of event coordinates for a page in ``[start_ms, end_ms)``."""
+    params = {
+        # The empty inner embed filters on page_sessions without returning its columns.
+        "select": "id,x,y,page_sessions!inner()",
+        "page_sessions.page": f"eq.{page}",
+        "and": f"(event_timestamp.gte.{ms_to_iso(start_ms)},event_timestamp.lt.{ms_to_iso(end_ms)},x.not.is.null,y.not.is.null)",
+        "id": f"gt.{after_id}",
+        "order": "id.asc",
+        "limit": str(limit),
+    }
+    if user_id is not None:
+        params["page_sessions.user_id"] = f"eq.{user_id}"
+    if event_type:
+        params["event_type"] = f"eq.{event_type}"
+    response = await sb_request("GET", f"/{EVENTS_TABLE}", params=params)
+    return response.json()
 
 
 async def upsert_cursor_dwell(records: Sequence[Dict[str, Any]]) -> None:
@@ -162,7 +323,7 @@ async def upsert_cursor_dwell(records: Sequence[Dict[str, Any]]) -> None:
             data["extra_metadata"] = json.dumps(data["extra_metadata"])
         payload.append(data)
     await sb_insert(
-        "cursor_dwell_metrics",
+        CURSOR_DWELL_TABLE,
         payload,
         upsert=True,
         on_conflict="page_session_id,target_key",
@@ -185,7 +346,7 @@ async def update_cursor_dwell_filters(psid: str, target_key: str, values: Dict[s
         else:
             processed[key] = value
     await sb_update(
-        "cursor_dwell_metrics",
+        CURSOR_DWELL_TABLE,
         filters={"page_session_id": psid, "target_key": target_key},
         values=processed,
         returning=False,
@@ -193,11 +354,16 @@ async def update_cursor_dwell_filters(psid: str, target_key: str, values: Dict[s
 
 
 async def fetch_cursor_dwell(psid: str, target_keys: Sequence[str]) -> List[Dict[str, Any]]:
-    if not target_keys:
+    return await fetch_cursor_dwell_many([psid], target_keys)
+
+
+async def fetch_cursor_dwell_many(psids: Sequence[str], target_keys: Sequence[str]) -> List[Dict[str, Any]]:
+    """Dwell rows for any of ``psids`` x ``target_keys``; callers pick the pairs they need."""
+    if not psids or not target_keys:
         return []
     rows = await sb_select(
-        "cursor_dwell_metrics",
-        filters={"page_session_id": psid, "target_key": target_keys},
+        CURSOR_DWELL_TABLE,
+        filters={"page_session_id": list(psids), "target_key": list(target_keys)},
     )
     result: List[Dict[str, Any]] = []
     for row in rows:
@@ -214,12 +380,16 @@ async def fetch_cursor_dwell(psid: str, target_keys: Sequence[str]) -> List[Dict
     return result
 
 
+async def list_cursor_dwell(psid: str) -> List[Dict[str, Any]]:
+    return await sb_select(CURSOR_DWELL_TABLE, filters={"page_session_id": psid}, order="last_updated")
+
+
 async def upsert_video_progress(record: Dict[str, Any]) -> Dict[str, Any]:
     payload = dict(record)
     for key in ("last_event_at", "created_at", "updated_at"):
         payload[key] = _serialize_dt(payload.get(key))
     rows = await sb_insert(
-        "video_progress",
+        VIDEO_PROGRESS_TABLE,
         payload,
         upsert=True,
         on_conflict="user_id,video_id",
@@ -235,7 +405,7 @@ async def upsert_video_progress(record: Dict[str, Any]) -> Dict[str, Any]:
 async def list_video_progress(filters: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
     params: Dict[str, Any] = {k: v for k, v in filters.items() if v is not None}
     rows = await sb_select(
-        "video_progress",
+        VIDEO_PROGRESS_TABLE,
         filters=params,
         limit=limit,
         order="updated_at",
@@ -251,7 +421,7 @@ async def list_video_progress(filters: Dict[str, Any], limit: int) -> List[Dict[
 
 
 async def get_user_score(user_id: str) -> Optional[Dict[str, Any]]:
-    record = await sb_select("user_scores", filters={"user_id": user_id}, single=True)
+    record = await sb_select(USER_SCORES_TABLE, filters={"user_id": user_id}, single=True)
     if record:
         record["updated_at"] = _parse_dt(record.get("updated_at"))
     return record
@@ -266,7 +436,7 @@ async def upsert_user_score(user_id: str, email: Optional[str], total_points: fl
         "updated_at": _serialize_dt(_utc_now()),
     }
     rows = await sb_insert(
-        "user_scores",
+        USER_SCORES_TABLE,
         payload,
         upsert=True,
         on_conflict="user_id",
@@ -278,6 +448,76 @@ async def upsert_user_score(user_id: str, email: Optional[str], total_points: fl
     return record
 
 
+async def list_abandoned_page_sessions(idle_before_ms: int, limit: int) -> List[Dict[str, Any]]:
+    """Open page sessions whose last activity (or creation, if none) is before ``idle_before_ms``."""
+    idle_before = ms_to_iso(idle_before_ms)
+    params = {
+        "select": "id,created_at,last_event_at,click_count,event_count",
+        "ended_at": "is.null",
+        "or": f"(last_event_at.lt.{idle_before},and(last_event_at.is.null,created_at.lt.{idle_before}))",
+        "order": "created_at.asc",
+        "limit": str(limit),
+    }
+    response = await sb_request("GET", f"/{PAGE_SESSIONS_TABLE}", params=params)
+    records = response.json()
+    for record in records:
+        for key in ("created_at", "last_event_at"):
+            record[key] = _parse_dt(record.get(key))
+    return records
+
+
+async def bulk_update_page_sessions(records: Sequence[Dict[str, Any]]) -> None:
+    """PATCH each record's columns onto its page session by id, a few requests at a time.
+
+    Unlike an upsert, a session deleted since it was read is not re-created
+    as a partial row, and records may carry different columns.
+    """
+    semaphore = asyncio.Semaphore(PAGE_SESSION_UPDATE_CONCURRENCY)
+
+    async def patch(rec: Dict[str, Any]) -> None:
+        values = {key: _serialize_dt(value) if key in ("created_at", "ended_at", "last_event_at") else value for key, value in rec.items() if key != "id"}
+        async with semaphore:
+            await sb_update(PAGE_SESSIONS_TABLE, filters={"id": rec["id"]}, values=values, returning=False)
+
+    await asyncio.gather(*(patch(rec) for rec in records))
+
+
+async def close_idle_page_sessions(closes: Sequence[Tuple[Dict[str, Any], Dict[str, Any]]]) -> int:
+    """Apply ``(session, values)`` pairs from ``list_abandoned_page_sessions``; returns how many closed.
+
+    Each PATCH only matches while the session is still open and its
+    ``event_count`` / ``last_event_at`` are what was read, so an ingest batch
+    landing in between is not overwritten with stale counters.
+    """
+    semaphore = asyncio.Semaphore(PAGE_SESSION_UPDATE_CONCURRENCY)
+
+    def unchanged(value: Any) -> str:
+        return "is.null" if value is None else f"eq.{_serialize_dt(value) if isinstance(value, datetime) else value}"
+
+    async def patch(session: Dict[str, Any], values: Dict[str, Any]) -> bool:
+        params = {
+            "select": "id",
+            "id": f"eq.{session['id']}",
+            "ended_at": "is.null",
+            "event_count": unchanged(session.get("event_count")),
+            "last_event_at": unchanged(session.get("last_event_at")),
+        }
+        body = {key: _serialize_dt(value) if key in ("ended_at", "last_event_at") else value for key, value in values.items()}
+        async with semaphore:
+            response = await sb_request("PATCH", f"/{PAGE_SESSIONS_TABLE}", params=params, json_body=body, headers={"Prefer": "return=representation"})
+        return bool(response.json())
+
+    return sum(await asyncio.gather(*(patch(session, values) for session, values in closes)))
+
+
+async def try_acquire_lease(name: str, holder: str, seconds: int) -> bool:
+    return bool(await sb_rpc("try_acquire_lease", {"lease_name": name, "lease_holder": holder, "lease_seconds": seconds}, idempotent=True))
+
+
+async def release_lease(name: str, holder: str) -> None:
+    await sb_rpc("release_lease", {"lease_name": name, "lease_holder": holder}, idempotent=True)
+
+
 async def end_page_session(psid: str, values: Dict[str, Any]) -> None:
     processed = {}
     for key, value in values.items():
@@ -285,7 +525,7 @@ async def end_page_session(psid: str, values: Dict[str, Any]) -> None:
             processed[key] = _serialize_dt(value)
         else:
             processed[key] = value
-    await sb_update("page_sessions", filters={"id": psid}, values=processed, returning=False)
+    await sb_update(PAGE_SESSIONS_TABLE, filters={"id": psid}, values=processed, returning=False)
 
 
 
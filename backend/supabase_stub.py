@@ -0,0 +1,273 @@
+"""In-memory Supabase stand-in for local load replay and benchmarks.
+
+Serves the subset of PostgREST and Storage the backend uses through an
+``httpx.MockTransport``, with optional per-call latency, so the app can be
+driven without a database (see ``traffic_replay.py``). It is not a
+conformance implementation. It supports:
+
+- filters ``eq``/``neq``/``in``/``lt``/``lte``/``gt``/``gte``/``is``, each optionally negated with ``not``;
+- ``and=(...)`` and ``or=(...)`` groups;
+- multi-column ``order``, ``limit`` and ``on_conflict`` upserts;
+- embedded-resource filters, resolved through the ``<table>_id`` column;
+- the RPCs in ``my-app/scripts``.
+"""
+import asyncio
+import json
+import random
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+import httpx
+
+from clock import clock, ms_to_iso
+from compression import decompress
+
+Row = Dict[str, Any]
+Condition = Callable[[Row], bool]
+
+# Tables whose primary key PostgREST would generate as a serial integer.
+SERIAL_TABLES = frozenset({"users", "events", "user_scores"})
+# Columns the migrations default to ``now()``; the repo sends them as null when unset.
+TIMESTAMP_DEFAULTS = ("created_at", "updated_at")
+
+
+def _split_top(text: str) -> List[str]:
+    """Split ``a,b(c,d),e`` on commas outside parentheses."""
+    parts, depth, start = [], 0, 0
+    for index, char in enumerate(text):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(text[start:index])
+            start = index + 1
+    parts.append(text[start:])
+    return [part for part in parts if part]
+
+
+def _coerce(value: Any) -> Any:
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _compare(left: Any, right: str) -> Optional[int]:
+    if left is None:
+        return None
+    a, b = _coerce(left), _coerce(right)
+    if type(a) is not type(b):
+        a, b = str(left), right
+    return (a > b) - (a < b)
+
+
+def _operator(column: str, expression: str) -> Condition:
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    op, _, raw = expression.partition(".")
+    if op == "in":
+        values = {unquote(value).strip('"') for value in _split_top(raw[1:-1])}
+        test = lambda row: row.get(column) is not None and str(_plain(row.get(column))) in values
+    elif op == "is":
+        expected = {"null": None, "true": True, "false": False}[raw]
+        test = lambda row: row.get(column) is expected
+    else:
+        value = unquote(raw).strip('"')
+        checks = {
+            "eq": lambda c: c == 0,
+            "neq": lambda c: c != 0,
+            "lt": lambda c: c < 0,
+            "lte": lambda c: c <= 0,
+            "gt": lambda c: c > 0,
+            "gte": lambda c: c >= 0,
+        }
+        check = checks[op]
+
+        def test(row: Row) -> bool:
+            result = _compare(_plain(row.get(column)), value)
+            return result is not None and check(result)
+
+    return (lambda row: not test(row)) if negate else test
+
+
+def _plain(value: Any) -> Any:
+    # Integral floats print like PostgREST ints ("3", not "3.0") for in() matching.
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def _group(text: str) -> Condition:
+    """Parse one ``col.op.value`` term or a (possibly ``not.``-prefixed) ``and(...)`` / ``or(...)`` group."""
+    negate = text.startswith("not.")
+    body = text[4:] if negate else text
+    for name, combine in (("and(", all), ("or(", any)):
+        if body.startswith(name):
+            inner = [_group(part) for part in _split_top(body[len(name) : -1])]
+            test: Condition = lambda row: combine(condition(row) for condition in inner)
+            return (lambda row: not test(row)) if negate else test
+    column, _, expression = text.partition(".")
+    return _operator(column, expression)
+
+
+class SupabaseStub:
+    def __init__(self, *, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tables: Dict[str, List[Row]] = {}
+        self.calls = 0
+        self._serial: Dict[str, int] = {}
+        self._leases: Dict[str, Tuple[str, int]] = {}
+        self._random = random.Random(seed)
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        if self.latency_ms or self.jitter_ms:
+            await asyncio.sleep(max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0)
+        path = request.url.path
+        if "/storage/v1/" in path:
+            return self._storage(request, path.split("/storage/v1/", 1)[1])
+        if "/rest/v1/" not in path:
+            return httpx.Response(200)
+        name = path.split("/rest/v1/", 1)[1]
+        content = request.content
+        if request.headers.get("content-encoding"):
+            content = decompress(content, request.headers["content-encoding"], 1 << 30)
+        body = json.loads(content) if content else None
+        if name.startswith("rpc/"):
+            return self._rpc(name[4:], body or {})
+        table = self.tables.setdefault(name, [])
+        params = request.url.params.multi_items()
+        if request.method in ("GET", "HEAD"):
+            return httpx.Response(200, json=self._select(name, table, params))
+        if request.method == "POST":
+            return httpx.Response(201, json=self._insert(name, table, body, dict(params), request.headers.get("prefer", "")))
+        matched = [row for row in table if self._matches(row, params)]
+        if request.method == "PATCH":
+            for row in matched:
+                row.update(body or {})
+            return httpx.Response(200, json=matched)
+        if request.method == "DELETE":
+            self.tables[name] = [row for row in table if not any(row is hit for hit in matched)]
+            return httpx.Response(200, json=matched)
+        return httpx.Response(405)
+
+    def _conditions(self, params: List[Tuple[str, str]]) -> List[Condition]:
+        conditions = []
+        for key, value in params:
+            if key in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            if key in ("and", "or"):
+                conditions.append(_group(f"{key}{value}"))
+            elif "." not in key:
+                conditions.append(_operator(key, value))
+        return conditions
+
+    def _matches(self, row: Row, params: List[Tuple[str, str]]) -> bool:
+        return all(condition(row) for condition in self._conditions(params))
+
+    def _embedded(self, row: Row, params: List[Tuple[str, str]]) -> bool:
+        for key, value in params:
+            if "." not in key or key in ("and", "or"):
+                continue
+            table, column = key.split(".", 1)
+            foreign = row.get(f"{table.rstrip('s')}_id")
+            parent = next((candidate for candidate in self.tables.get(table, []) if candidate.get("id") == foreign), None)
+            if parent is None or not _operator(column, value)(parent):
+                return False
+        return True
+
+    def _select(self, name: str, table: List[Row], params: List[Tuple[str, str]]) -> List[Row]:
+        conditions = self._conditions(params)
+        rows = [row for row in table if all(condition(row) for condition in conditions) and self._embedded(row, params)]
+        options = dict(params)
+        for part in reversed(_split_top(options.get("order", ""))):
+            column, _, direction = part.partition(".")
+            descending = direction.startswith("desc")
+            present = [row for row in rows if row.get(column) is not None]
+            missing = [row for row in rows if row.get(column) is None]
+            present.sort(key=lambda row: _coerce(row[column]), reverse=descending)
+            rows = missing + present if descending else present + missing
+        offset = int(options.get("offset", 0))
+        if "limit" in options:
+            rows = rows[offset : offset + int(options["limit"])]
+        columns = options.get("select", "*")
+        if columns != "*":
+            wanted = [column for column in _split_top(columns) if "(" not in column]
+            rows = [{column: row.get(column) for column in wanted} for row in rows]
+        return [dict(row) for row in rows]
+
+    def _insert(self, name: str, table: List[Row], body: Any, params: Dict[str, str], prefer: str) -> List[Row]:
+        items = body if isinstance(body, list) else [body]
+        keys = (params.get("on_conflict") or "id").split(",")
+        ignore = "ignore-duplicates" in prefer
+        merge = "merge-duplicates" in prefer
+        stored = []
+        for item in items:
+            row = dict(item)
+            if "id" not in row and name in SERIAL_TABLES:
+                self._serial[name] = self._serial.get(name, 0) + 1
+                row["id"] = self._serial[name]
+            for column in TIMESTAMP_DEFAULTS:
+                if row.get(column) is None:
+                    row[column] = ms_to_iso(clock.now_ms())
+            existing = None
+            if merge or ignore:
+                existing = next((candidate for candidate in table if all(candidate.get(key) == row.get(key) for key in keys)), None)
+            if existing is not None:
+                if merge:
+                    existing.update({key: value for key, value in row.items() if key not in TIMESTAMP_DEFAULTS or item.get(key) is not None})
+                stored.append(dict(existing))
+                continue
+            table.append(row)
+            stored.append(dict(row))
+        return stored
+
+    def _rpc(self, function: str, args: Dict[str, Any]) -> httpx.Response:
+        now = clock.now_ms()
+        if function == "try_acquire_lease":
+            holder, expires = self._leases.get(args["lease_name"], (None, 0))
+            if holder in (None, args["lease_holder"]) or expires < now:
+                self._leases[args["lease_name"]] = (args["lease_holder"], now + int(args["lease_seconds"]) * 1000)
+                return httpx.Response(200, json=True)
+            return httpx.Response(200, json=False)
+        if function == "release_lease":
+            if self._leases.get(args["lease_name"], (None, 0))[0] == args["lease_holder"]:
+                del self._leases[args["lease_name"]]
+            return httpx.Response(204)
+        if function == "select_in":
+            values = set(args["p_values"])
+            rows = [row for row in self.tables.get(args["p_table"], []) if str(_plain(row.get(args["p_column"]))) in values]
+            for key, value in (args.get("p_filters") or {}).items():
+                allowed = set(value) if isinstance(value, list) else {value}
+                rows = [row for row in rows if str(_plain(row.get(key))) in allowed]
+            if args.get("p_order"):
+                rows.sort(key=lambda row: _coerce(row.get(args["p_order"])) or 0, reverse=bool(args.get("p_desc")))
+            return httpx.Response(200, json=rows[: args["p_limit"]] if args.get("p_limit") else rows)
+        return httpx.Response(404, json={"code": "PGRST202", "message": f"Could not find the function {function}"})
+
+    def _storage(self, request: httpx.Request, path: str) -> httpx.Response:
+        if path.startswith("object/list/"):
+            return httpx.Response(200, json=[])
+        if path.startswith("object/sign/"):
+            body = json.loads(request.content)
+            return httpx.Response(200, json=[{"path": name, "signedURL": f"/object/sign/{name}?token=stub", "error": None} for name in body["paths"]])
+        return httpx.Response(404, json={"error": "not_found"})
+
+
+def install(stub: SupabaseStub) -> None:
+    """Point ``supabase_client`` at ``stub``; call after SUPABASE_URL/KEY are set and before the app starts."""
+    import supabase_client
+
+    supabase_client._client = httpx.AsyncClient(
+        base_url=supabase_client._REST_BASE,
+        headers=supabase_client._ensure_headers(),
+        transport=stub.transport(),
+    )
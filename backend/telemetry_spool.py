@@ -0,0 +1,387 @@
+"""Durable on-disk spool for telemetry writes that could not reach Supabase.
+
+Records are appended to segmented, append-only files (``segment-<n>.log``)
+as ``<crc32> <json>`` lines. Appends go to the OS page cache immediately and
+are fsynced in groups (every ``fsync_every`` records or ``fsync_interval``
+seconds, whichever comes first); journal entries share the same group
+commit. A background replayer seals the active
+segment, hands each kind's records to its registered bulk handler and
+journals every batch key as it completes, so a batch is applied once even
+if the process restarts mid-replay. Fully replayed segments are deleted.
+
+Each process claims its own ``worker-<n>`` subdirectory of the spool
+directory by holding an ``fcntl.flock`` lease on it, so workers never share
+segments or the journal. A slot whose owner exited is reclaimed, and its
+backlog replayed, by the next process to start.
+"""
+import asyncio
+import json
+import logging
+import mmap
+import os
+import uuid
+import zlib
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from resilience import CircuitOpenError
+from worker_slots import claim_slot
+
+logger = logging.getLogger(__name__)
+
+STAGE_DONE = "done"
+
+
+@dataclass
+class SpoolRecord:
+    key: str
+    kind: str
+    payload: Dict[str, Any]
+    stage: Optional[str] = None
+
+
+MarkStage = Callable[[str, str], None]
+Handler = Callable[[List[SpoolRecord], MarkStage], Awaitable[None]]
+
+
+def is_transient_failure(exc: BaseException) -> bool:
+    """True for Supabase failures worth spooling and retrying later."""
+    if isinstance(exc, (CircuitOpenError, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return False
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _journal_entry(key: str, stage: str) -> str:
+    # JSON, because keys are client-influenced and may contain spaces or newlines.
+    return json.dumps([key, stage]) + "\n"
+
+
+def _write_journal(path: str, entries: List[Tuple[str, str]]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(_journal_entry(key, stage) for key, stage in entries)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _sync_and_close(files: List[Any]) -> None:
+    for f in files:
+        try:
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+
+class TelemetrySpool:
+    def __init__(
+        self,
+        directory: str,
+        *,
+        segment_bytes: int = 4 * 1024 * 1024,
+        fsync_every: int = 64,
+        fsync_interval: float = 0.2,
+        replay_interval: float = 5.0,
+        use_mmap: bool = False,
+    ) -> None:
+        self.root = directory
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval = fsync_interval
+        self.replay_interval = replay_interval
+        self.use_mmap = use_mmap
+        self._handlers: Dict[str, Handler] = {}
+        self._opened = False
+        self._active = None
+        # Segments rotated out by ``append``; ``flush`` fsyncs and closes them off the event loop.
+        self._sealed: List[Any] = []
+        self._active_index = 0
+        self._active_size = 0
+        self._unsynced = 0
+        self._sync_requested: Optional[asyncio.Event] = None
+        self._stages: Dict[str, str] = {}
+        self._journal = None
+        self._journal_unsynced = 0
+        # Journal lines marked while a compaction snapshot is being written.
+        self._compacting: Optional[List[str]] = None
+        self._pending = 0
+        self._drain_lock: Optional[asyncio.Lock] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._lease = None
+
+    def __len__(self) -> int:
+        self._open()
+        return self._pending
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self._handlers[kind] = handler
+
+    # -- files -----------------------------------------------------------------
+
+    def _segment_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"segment-{index:08d}.log")
+
+    def _segment_indexes(self) -> List[int]:
+        indexes = []
+        for name in os.listdir(self.directory):
+            if name.startswith("segment-") and name.endswith(".log"):
+                try:
+                    indexes.append(int(name[len("segment-") : -len(".log")]))
+                except ValueError:
+                    continue
+        return sorted(indexes)
+
+    def _journal_path(self) -> str:
+        return os.path.join(self.directory, "applied.journal")
+
+    def _open(self) -> None:
+        if self._opened:
+            return
+        slot, self._lease = claim_slot(lambda slot: os.path.join(self.root, f"worker-{slot}", ".lease"))
+        self.directory = os.path.join(self.root, f"worker-{slot}")
+        os.makedirs(self.directory, exist_ok=True)
+        torn = False
+        try:
+            with open(self._journal_path(), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        key, stage = json.loads(line)
+                    except ValueError:
+                        # Torn final line from a crash mid-write.
+                        torn = True
+                        continue
+                    self._stages[key] = stage
+        except FileNotFoundError:
+            pass
+        self._journal = open(self._journal_path(), "a", encoding="utf-8")
+        if torn:
+            # Rewrite so new entries do not land on the end of the torn line; startup only, so inline.
+            _write_journal(self._journal_path() + ".tmp", list(self._stages.items()))
+            self._journal.close()
+            os.replace(self._journal_path() + ".tmp", self._journal_path())
+            self._journal = open(self._journal_path(), "a", encoding="utf-8")
+        indexes = self._segment_indexes()
+        for index in indexes:
+            for record in self._read_segment(self._segment_path(index)):
+                if self._stages.get(record.key) != STAGE_DONE:
+                    self._pending += 1
+        self._active_index = (indexes[-1] if indexes else 0) + 1
+        self._opened = True
+
+    def _ensure_active(self) -> None:
+        if self._active is None:
+            path = self._segment_path(self._active_index)
+            self._active = open(path, "ab")
+            self._active_size = self._active.tell()
+
+    def _seal_active(self) -> None:
+        """Rotate to a new segment; the old one is fsynced and closed by the next ``flush``."""
+        if self._active is None:
+            return
+        self._active.flush()
+        self._sealed.append(self._active)
+        self._active = None
+        self._active_index += 1
+        self._unsynced = 0
+        if self._sync_requested is not None:
+            self._sync_requested.set()
+
+    def _read_segment(self, path: str) -> Iterator[SpoolRecord]:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            if self.use_mmap:
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                lines = iter(source.readline, b"")
+            else:
+                source = None
+                lines = iter(f.readline, b"")
+            try:
+                for raw in lines:
+                    if not raw.endswith(b"\n"):
+                        logger.warning("Ignoring torn record at end of %s", path)
+                        break
+                    crc_hex, _, body = raw[:-1].partition(b" ")
+                    try:
+                        if int(crc_hex, 16) != zlib.crc32(body):
+                            raise ValueError("crc mismatch")
+                        data = json.loads(body)
+                    except ValueError:
+                        logger.warning("Skipping corrupt record in %s", path)
+                        continue
+                    yield SpoolRecord(data["key"], data["kind"], data["payload"], self._stages.get(data["key"]))
+            finally:
+                if source is not None:
+                    source.close()
+
+    # -- writing -----------------------------------------------------------------
+
+    def append(self, kind: str, payload: Dict[str, Any], key: Optional[str] = None) -> str:
+        """Append one batch; returns its idempotency key. Durable after the next group fsync."""
+        self._open()
+        key = key or uuid.uuid4().hex
+        body = json.dumps({"key": key, "kind": kind, "payload": payload}, separators=(",", ":"), default=str).encode("utf-8")
+        line = b"%08x " % zlib.crc32(body) + body + b"\n"
+        self._ensure_active()
+        self._active.write(line)
+        self._active_size += len(line)
+        self._unsynced += 1
+        self._pending += 1
+        if self._active_size >= self.segment_bytes:
+            self._seal_active()
+        elif self._unsynced >= self.fsync_every and self._sync_requested is not None:
+            self._sync_requested.set()
+        return key
+
+    async def flush(self) -> None:
+        """Fsync pending appends and journal entries, and close sealed segments, in a worker thread.
+
+        Serialized, so no file is closed or replaced while a thread still syncs it.
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            sealed, self._sealed = self._sealed, []
+            if sealed:
+                await asyncio.to_thread(_sync_and_close, sealed)
+            if self._active is not None and self._unsynced:
+                self._active.flush()
+                self._unsynced = 0
+                await asyncio.to_thread(os.fsync, self._active.fileno())
+            if self._journal is not None and self._journal_unsynced:
+                self._journal_unsynced = 0
+                await asyncio.to_thread(os.fsync, self._journal.fileno())
+
+    def mark(self, key: str, stage: str) -> None:
+        """Journal a stage; durable after the next group fsync, like ``append``."""
+        previous = self._stages.get(key)
+        self._stages[key] = stage
+        entry = _journal_entry(key, stage)
+        self._journal.write(entry)
+        self._journal.flush()
+        if self._compacting is not None:
+            self._compacting.append(entry)
+        self._journal_unsynced += 1
+        if self._journal_unsynced >= self.fsync_every and self._sync_requested is not None:
+            self._sync_requested.set()
+        if stage == STAGE_DONE and previous != STAGE_DONE:
+            self._pending -= 1
+
+    async def _compact_journal(self, dropped: List[str]) -> None:
+        """Rewrite the journal without ``dropped``; the snapshot is written in a worker thread."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        for key in dropped:
+            self._stages.pop(key, None)
+        tmp_path = self._journal_path() + ".tmp"
+        self._compacting = []
+        try:
+            await asyncio.to_thread(_write_journal, tmp_path, list(self._stages.items()))
+            async with self._flush_lock:
+                # No awaits from here on: entries marked during the snapshot go into the new file.
+                journal = open(tmp_path, "a", encoding="utf-8")
+                journal.writelines(self._compacting)
+                journal.flush()
+                os.replace(tmp_path, self._journal_path())
+                self._journal.close()
+                self._journal = journal
+                self._journal_unsynced = len(self._compacting)
+        finally:
+            self._compacting = None
+
+    # -- replay ------------------------------------------------------------------
+
+    async def drain(self) -> int:
+        """Replay sealed segments in bulk; stops at the first transient failure."""
+        self._open()
+        if self._drain_lock is None:
+            self._drain_lock = asyncio.Lock()
+        async with self._drain_lock:
+            if self._active is not None and self._active_size:
+                self._seal_active()
+            await self.flush()
+            replayed = 0
+            for index in self._segment_indexes():
+                if self._active is not None and index == self._active_index:
+                    break
+                path = self._segment_path(index)
+                records = list(self._read_segment(path))
+                by_kind: Dict[str, List[SpoolRecord]] = {}
+                for record in records:
+                    if record.stage != STAGE_DONE:
+                        by_kind.setdefault(record.kind, []).append(record)
+                for kind, batch in by_kind.items():
+                    handler = self._handlers.get(kind)
+                    if handler is None:
+                        logger.warning("No spool handler for %s; leaving %d records", kind, len(batch))
+                        return replayed
+                    try:
+                        await handler(batch, self.mark)
+                    except Exception as exc:
+                        if is_transient_failure(exc):
+                            return replayed
+                        logger.exception("Dropping %d spooled %s records after replay failure", len(batch), kind)
+                    for record in batch:
+                        if self._stages.get(record.key) != STAGE_DONE:
+                            self.mark(record.key, STAGE_DONE)
+                    await self.flush()
+                    replayed += len(batch)
+                os.remove(path)
+                await self._compact_journal([record.key for record in records])
+            return replayed
+
+    async def run(self) -> None:
+        """Group-commit fsyncs and periodic replay; run as a background task."""
+        self._open()
+        self._sync_requested = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        next_replay = loop.time() + self.replay_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._sync_requested.wait(), timeout=self.fsync_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._sync_requested.clear()
+            await self.flush()
+            if self._pending and loop.time() >= next_replay:
+                try:
+                    await self.drain()
+                except Exception:
+                    logger.exception("Telemetry spool replay failed")
+                next_replay = loop.time() + self.replay_interval
+
+    async def close(self) -> None:
+        if not self._opened:
+            return
+        self._seal_active()
+        await self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._lease is not None:
+            self._lease.close()
+            self._lease = None
+        self._opened = False
+        self._pending = 0
+        self._stages.clear()
+
+
+telemetry_spool = TelemetrySpool(
+    os.getenv("TELEMETRY_SPOOL_DIR") or os.path.join(os.path.dirname(__file__), "data", "spool"),
+    segment_bytes=int(_env_float("TELEMETRY_SPOOL_SEGMENT_BYTES", 4 * 1024 * 1024)),
+    fsync_every=int(_env_float("TELEMETRY_SPOOL_FSYNC_EVERY", 64)),
+    fsync_interval=_env_float("TELEMETRY_SPOOL_FSYNC_SECONDS", 0.2),
+    replay_interval=_env_float("TELEMETRY_SPOOL_REPLAY_SECONDS", 5.0),
+    use_mmap=os.getenv("TELEMETRY_SPOOL_MMAP", "").lower() in ("1", "true", "yes"),
+)
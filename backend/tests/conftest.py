@@ -0,0 +1,10 @@
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# supabase_client reads its settings at import; the stub answers every request.
+os.environ.setdefault("SUPABASE_URL", "http://supabase.stub")
+os.environ.setdefault("SUPABASE_ANON_KEY", "stub")
@@ -0,0 +1,50 @@
+import gzip
+
+import pytest
+
+from compression import BodyTooLarge, UnsupportedEncoding, compress, decompress, negotiate
+
+
+def test_gzip_round_trip():
+    body = b'{"events": []}' * 100
+    assert decompress(compress(body, "gzip"), "gzip", limit=len(body)) == body
+
+
+def test_concatenated_gzip_members_are_one_body():
+    assert decompress(gzip.compress(b"abc") + gzip.compress(b"def"), "gzip", limit=6) == b"abcdef"
+
+
+def test_gzip_over_limit_raises():
+    with pytest.raises(BodyTooLarge):
+        decompress(gzip.compress(b"x" * 1000), "gzip", limit=999)
+
+
+def test_concatenated_members_count_toward_limit():
+    with pytest.raises(BodyTooLarge):
+        decompress(gzip.compress(b"x" * 600) + gzip.compress(b"x" * 600), "gzip", limit=1000)
+
+
+def test_identity_over_limit_raises():
+    with pytest.raises(BodyTooLarge):
+        decompress(b"x" * 11, "identity", limit=10)
+
+
+def test_truncated_gzip_is_rejected():
+    data = gzip.compress(b"x" * 1000)
+    with pytest.raises(ValueError):
+        decompress(data[:-8], "gzip", limit=2000)
+
+
+def test_corrupt_gzip_is_rejected():
+    with pytest.raises(ValueError):
+        decompress(b"\x1f\x8b not gzip", "gzip", limit=100)
+
+
+def test_unknown_encoding_raises():
+    with pytest.raises(UnsupportedEncoding):
+        decompress(b"", "br", limit=100)
+
+
+def test_negotiate_respects_q_values():
+    assert negotiate("gzip;q=0, identity") is None
+    assert negotiate("br, gzip;q=0.5") == "gzip"
@@ -0,0 +1,49 @@
+import asyncio
+
+import supabase_client
+import supabase_repo
+import supabase_stub
+
+
+def _run(coro):
+    async def main():
+        stub = supabase_stub.SupabaseStub()
+        supabase_stub.install(stub)
+        try:
+            return await coro(stub)
+        finally:
+            await supabase_client.close_client()
+
+    return asyncio.run(main())
+
+
+def test_event_pages_cover_ties_exactly_once():
+    timestamps = ["2026-10-19T10:00:00.000001+00:00"] * 5 + ["2026-10-19T10:00:00.5+00:00"] * 3 + ["2026-10-19T10:00:01+00:00"]
+
+    async def scenario(stub):
+        stub.tables["events"] = [{"id": i + 1, "page_session_id": "p", "event_type": "click", "event_timestamp": ts, "data": None, "x": 0, "y": 0} for i, ts in enumerate(timestamps)]
+        stub.tables["events"].append({"id": 99, "page_session_id": "other", "event_type": "click", "event_timestamp": timestamps[0], "data": None, "x": 0, "y": 0})
+        seen, after = [], None
+        while True:
+            page = await supabase_repo.fetch_event_page("p", after, limit=2)
+            seen.extend(row["id"] for row in page)
+            if len(page) < 2:
+                return seen
+            after = (page[-1]["event_timestamp"], page[-1]["id"])
+
+    assert _run(scenario) == list(range(1, len(timestamps) + 1))
+
+
+def test_point_pages_resume_after_id():
+    async def scenario(stub):
+        stub.tables["page_sessions"] = [{"id": "p", "page": "/a"}, {"id": "q", "page": "/b"}]
+        stub.tables["events"] = [
+            {"id": i, "page_session_id": "p" if i % 2 else "q", "event_type": "move", "event_timestamp": "2026-10-19T10:00:00+00:00", "x": i, "y": i}
+            for i in range(1, 11)
+        ]
+        start, end = 1_790_848_800_000 - 3_600_000 * 24 * 365, 1_790_848_800_000 + 3_600_000 * 24 * 365
+        first = await supabase_repo.fetch_event_points("/a", start, end, 0, None, None, 3)
+        rest = await supabase_repo.fetch_event_points("/a", start, end, first[-1]["id"], None, None, 10)
+        return [row["id"] for row in first], [row["id"] for row in rest]
+
+    assert _run(scenario) == ([1, 3, 5], [7, 9])
@@ -0,0 +1,34 @@
+import math
+
+from rate_limit import TokenBucket
+
+
+def test_bucket_starts_full_and_empties():
+    bucket = TokenBucket(rate=1.0, capacity=3.0)
+    bucket.updated = 0.0
+    assert [bucket.try_take(now=0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_take(now=0.0) == 1.0
+
+
+def test_bucket_refills_at_rate_up_to_capacity():
+    bucket = TokenBucket(rate=2.0, capacity=4.0)
+    bucket.updated = 0.0
+    bucket.try_take(cost=4.0, now=0.0)
+    assert bucket.try_take(cost=3.0, now=1.0) == 0.5
+    assert bucket.tokens == 2.0
+    bucket.try_take(cost=0.0, now=100.0)
+    assert bucket.tokens == 4.0
+
+
+def test_denied_take_does_not_spend_tokens():
+    bucket = TokenBucket(rate=1.0, capacity=2.0)
+    bucket.updated = 0.0
+    assert bucket.try_take(cost=5.0, now=0.0) == 3.0
+    assert bucket.tokens == 2.0
+
+
+def test_zero_rate_never_refills():
+    bucket = TokenBucket(rate=0.0, capacity=1.0)
+    bucket.updated = 0.0
+    bucket.try_take(now=0.0)
+    assert math.isinf(bucket.try_take(now=1_000.0))
@@ -0,0 +1,61 @@
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _open(breaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.before_call() is False
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("t", failure_threshold=3, reset_timeout=10.0)
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.failures == 0
+    _open(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as exc:
+        breaker.before_call()
+    assert exc.value.retry_after == 10.0
+
+
+def test_half_open_admits_a_single_probe(clock):
+    breaker = CircuitBreaker("t", failure_threshold=1, reset_timeout=10.0)
+    _open(breaker)
+    clock[0] += 10.0
+    assert breaker.before_call() is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.before_call() is False
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker("t", failure_threshold=5, reset_timeout=10.0)
+    _open(breaker)
+    clock[0] += 10.0
+    assert breaker.before_call() is True
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open
+
+
+def test_released_probe_frees_the_slot(clock):
+    breaker = CircuitBreaker("t", failure_threshold=1, reset_timeout=10.0)
+    _open(breaker)
+    clock[0] += 10.0
+    assert breaker.before_call() is True
+    breaker.release_probe()
+    assert breaker.before_call() is True
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+
+import httpx
+
+from telemetry_spool import STAGE_DONE, TelemetrySpool
+
+
+def _transient():
+    request = httpx.Request("POST", "http://supabase.stub/rest/v1/events")
+    return httpx.HTTPStatusError("unavailable", request=request, response=httpx.Response(503, request=request))
+
+
+def test_drain_replays_each_record_once(tmp_path):
+    applied = []
+
+    async def handler(batch, mark):
+        applied.extend(record.payload["n"] for record in batch)
+
+    async def scenario():
+        spool = TelemetrySpool(str(tmp_path), segment_bytes=200)
+        spool.register("events", handler)
+        for n in range(20):
+            spool.append("events", {"n": n})
+        assert len(spool) == 20
+        assert await spool.drain() == 20
+        assert len(spool) == 0
+        assert await spool.drain() == 0
+        await spool.close()
+
+    asyncio.run(scenario())
+    assert sorted(applied) == list(range(20))
+
+
+def test_journaled_stage_survives_restart(tmp_path):
+    seen = []
+
+    async def failing(batch, mark):
+        for record in batch:
+            mark(record.key, "inserted")
+        raise _transient()
+
+    async def resuming(batch, mark):
+        seen.extend((record.key, record.stage) for record in batch)
+
+    async def scenario():
+        spool = TelemetrySpool(str(tmp_path))
+        spool.register("events", failing)
+        spool.append("events", {"n": 1}, key="batch-1")
+        assert await spool.drain() == 0
+        await spool.close()
+
+        restarted = TelemetrySpool(str(tmp_path))
+        restarted.register("events", resuming)
+        assert len(restarted) == 1
+        assert await restarted.drain() == 1
+        await restarted.close()
+
+        again = TelemetrySpool(str(tmp_path))
+        assert len(again) == 0
+        await again.close()
+
+    asyncio.run(scenario())
+    assert seen == [("batch-1", "inserted")]
+
+
+def test_done_records_are_not_replayed_after_restart(tmp_path):
+    async def scenario():
+        spool = TelemetrySpool(str(tmp_path))
+        spool.append("events", {"n": 1}, key="a")
+        spool.append("events", {"n": 2}, key="b")
+        spool._open()
+        spool.mark("a", STAGE_DONE)
+        await spool.close()
+
+        restarted = TelemetrySpool(str(tmp_path))
+        assert len(restarted) == 1
+        await restarted.close()
+
+    asyncio.run(scenario())
+
+
+def test_torn_journal_line_is_skipped(tmp_path):
+    async def scenario():
+        spool = TelemetrySpool(str(tmp_path))
+        spool.append("events", {"n": 1}, key="key with spaces\nand a newline")
+        spool.mark("key with spaces\nand a newline", "inserted")
+        await spool.close()
+        journal = os.path.join(spool.directory, "applied.journal")
+        with open(journal, "a", encoding="utf-8") as f:
+            f.write('["half-written", "do')
+
+        restarted = TelemetrySpool(str(tmp_path))
+        restarted._open()
+        assert restarted._stages == {"key with spaces\nand a newline": "inserted"}
+        restarted.mark("next", "inserted")
+        await restarted.close()
+        with open(journal, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f]
+        assert entries == [["key with spaces\nand a newline", "inserted"], ["next", "inserted"]]
+
+    asyncio.run(scenario())
+
+
+def test_corrupt_segment_record_is_skipped(tmp_path):
+    applied = []
+
+    async def handler(batch, mark):
+        applied.extend(record.payload["n"] for record in batch)
+
+    async def scenario():
+        spool = TelemetrySpool(str(tmp_path))
+        spool.append("events", {"n": 1})
+        spool.append("events", {"n": 2})
+        await spool.close()
+        segment = os.path.join(spool.directory, sorted(name for name in os.listdir(spool.directory) if name.startswith("segment-"))[0])
+        with open(segment, "rb") as f:
+            lines = f.readlines()
+        with open(segment, "wb") as f:
+            f.write(lines[0].replace(b'"n":1', b'"n":7') + lines[1])
+
+        restarted = TelemetrySpool(str(tmp_path))
+        restarted.register("events", handler)
+        await restarted.drain()
+        await restarted.close()
+
+    asyncio.run(scenario())
+    assert applied == [2]
@@ -0,0 +1,47 @@
+import pytest
+
+import trajectory
+from trajectory import decode, encode, simplify, split_moves
+
+
+@pytest.mark.parametrize("value", [0, 1, -1, 63, -64, 64, 127, 128, -129, 2 ** 31, -(2 ** 40), 1_790_000_000_000])
+def test_varint_round_trip(value):
+    out = bytearray()
+    trajectory._write_varint(out, value)
+    assert trajectory._read_varint(bytes(out), 0) == (value, len(out))
+
+
+def test_encode_decode_round_trip():
+    points = [(1_790_000_000_000, 10, 20), (1_790_000_000_016, 12, 19), (1_790_000_000_033, 0, -5), (1_790_000_009_000, 3840, 2160)]
+    assert decode(encode(points)) == points
+
+
+def test_small_deltas_take_three_bytes_per_point():
+    points = [(1_790_000_000_000 + 16 * i, 100 + i, 200 - i) for i in range(100)]
+    # 70 and 100 both encode their count in two bytes.
+    assert len(encode(points)) - len(encode(points[:70])) == 3 * 30
+
+
+def test_decode_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        decode(b"\x07\x00")
+    with pytest.raises(ValueError):
+        decode(b"")
+
+
+def test_simplify_keeps_endpoints_and_drops_collinear_points():
+    points = [(i, i, 0) for i in range(10)]
+    assert simplify(points, 0.5) == [points[0], points[-1]]
+    assert simplify(points, 0) == points
+
+
+def test_split_moves_segments_at_gaps_and_keeps_other_rows():
+    def move(ts, x):
+        return {"page_session_id": "p", "event_type": "mousemove", "event_timestamp": ts, "x": x, "y": 0, "data": None}
+
+    click = {"page_session_id": "p", "event_type": "click", "event_timestamp": 5, "x": 1, "y": 1, "data": None}
+    rows = [move(0, 1), move(16, 2), click, move(16 + trajectory.MAX_GAP_MS + 1, 3)]
+    remaining, segments = split_moves(rows, tolerance_px=0)
+    assert remaining == [click]
+    assert [segment["point_count"] for segment in segments] == [2, 1]
+    assert trajectory.decode_segment(segments[0]) == [(0, 1, 0), (16, 2, 0)]
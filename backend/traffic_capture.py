@@ -0,0 +1,235 @@
+"""Sanitized request capture for load replay (``traffic_replay.py``).
+
+With ``TRAFFIC_CAPTURE_PATH`` set, ``TrafficCaptureMiddleware`` appends
+one JSON line per request to a gzip file (``{pid}`` in the path is
+replaced so workers do not share a file). Each line records:
+
+- the route template with its path parameters;
+- the query string and JSON body;
+- the body size, status and handler time.
+
+Identifying values are replaced by keyed hashes, which stay consistent
+within one capture: emails, names, passwords, user ids, session cookies
+and page-session ids. The replay can therefore still tie requests of the
+same client and page session together. Other values (event types,
+coordinates, durations) are kept so the replayed load has the same shape.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from compression import decompress
+
+logger = logging.getLogger(__name__)
+
+PII_KEYS = frozenset({"email", "user_email", "name", "password", "user_id", "session_id", "psid", "token"})
+# Responses whose new id later requests refer to; the replay maps the captured hash to the live id.
+ID_ISSUING_ROUTES = frozenset({"/page-sessions/start"})
+MAX_CAPTURED_BODY = 4 * 1024 * 1024
+
+_EMAIL = re.compile(r"[^@\s]+@[^@\s]+")
+
+
+class TrafficRecorder:
+    def __init__(self, path: str, *, salt: bytes, flush_every: int = 256, flush_seconds: float = 5.0) -> None:
+        self.path = path
+        self.salt = salt
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._buffer: List[str] = []
+        self._flushed_at = time.monotonic()
+        self.recorded = 0
+        self.dropped = 0
+        # Batches (or a threading.Event marker from ``close``) for the writer thread.
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=64)
+        self._thread: Optional[threading.Thread] = None
+
+    def pseudonym(self, key: str, value: str) -> str:
+        digest = hmac.new(self.salt, value.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+        # Keep emails shaped like emails so replayed bodies still pass validation.
+        return f"h{digest}@capture.invalid" if key.endswith("email") or _EMAIL.fullmatch(value) else f"h{digest}"
+
+    def sanitize(self, value: Any, key: str = "") -> Any:
+        if isinstance(value, dict):
+            return {k: self.sanitize(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.sanitize(item, key) for item in value]
+        if isinstance(value, str) and key in PII_KEYS:
+            return self.pseudonym(key, value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and key in PII_KEYS:
+            return self.pseudonym(key, str(value))
+        return value
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        self._buffer.append(json.dumps(entry, separators=(",", ":")))
+        self.recorded += 1
+        if len(self._buffer) >= self.flush_every or time.monotonic() - self._flushed_at >= self.flush_seconds:
+            self.flush()
+
+    def flush(self) -> None:
+        """Hand the buffered lines to the writer thread; never blocks the caller."""
+        self._flushed_at = time.monotonic()
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(lines)
+        except queue.Full:
+            # The disk is not keeping up; dropping keeps the event loop free.
+            self.dropped += len(lines)
+            return
+        if self.dropped:
+            logger.warning("Traffic capture writer fell behind; dropped %d records", self.dropped)
+            self.dropped = 0
+
+    def close(self, timeout: float = 5.0) -> bool:
+        """Flush and wait until everything handed over so far is on disk; blocking, for shutdown."""
+        self.flush()
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            self._write(item)
+
+    def _write(self, lines: List[str]) -> None:
+        try:
+            # Each write appends a gzip member; gzip readers treat the file as one stream.
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError:
+            logger.exception("Writing traffic capture to %s failed; dropped %d records", self.path, len(lines))
+
+
+class TrafficCaptureMiddleware:
+    """Pure ASGI middleware so streamed responses are passed through untouched."""
+
+    def __init__(self, app: Any, recorder: TrafficRecorder) -> None:
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started_ms = int(time.time() * 1000)
+        started = time.perf_counter()
+        body = bytearray()
+        body_size = 0
+        state: Dict[str, Any] = {"status": 0, "response": bytearray(), "first_byte_ms": None}
+
+        async def capture_receive() -> Dict[str, Any]:
+            nonlocal body_size
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                body_size += len(chunk)
+                if len(body) + len(chunk) <= MAX_CAPTURED_BODY:
+                    body.extend(chunk)
+            return message
+
+        async def capture_send(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["first_byte_ms"] = (time.perf_counter() - started) * 1000.0
+            elif message["type"] == "http.response.body" and _route_path(scope) in ID_ISSUING_ROUTES:
+                state["response"].extend(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            try:
+                self.recorder.record(self._entry(scope, started_ms, started, bytes(body), body_size, state))
+            except Exception:
+                logger.exception("Traffic capture failed for %s", scope.get("path"))
+
+    def _entry(self, scope: Dict[str, Any], started_ms: int, started: float, body: bytes, body_size: int, state: Dict[str, Any]) -> Dict[str, Any]:
+        recorder = self.recorder
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        query = {}
+        for pair in (scope.get("query_string") or b"").decode("latin-1").split("&"):
+            if pair:
+                key, _, value = pair.partition("=")
+                query[key] = value
+        entry: Dict[str, Any] = {
+            "t": started_ms,
+            "m": scope["method"],
+            "r": _route_path(scope) or scope["path"],
+            "p": recorder.sanitize({key: str(value) for key, value in (scope.get("path_params") or {}).items()}),
+            "q": recorder.sanitize(query),
+            "bs": body_size,
+            "s": state["status"],
+            "d": round((time.perf_counter() - started) * 1000.0, 3),
+            "ttfb": round(state["first_byte_ms"], 3) if state["first_byte_ms"] is not None else None,
+        }
+        if body and body_size <= MAX_CAPTURED_BODY and "json" in headers.get("content-type", ""):
+            try:
+                # Replays send bodies uncompressed; the encoding is kept for reference.
+                if headers.get("content-encoding"):
+                    entry["ce"] = headers["content-encoding"]
+                    body = decompress(body, headers["content-encoding"], MAX_CAPTURED_BODY)
+                entry["b"] = recorder.sanitize(json.loads(body))
+            except ValueError:
+                entry["b"] = None
+        if headers.get("idempotency-key"):
+            entry["ik"] = recorder.pseudonym("idempotency_key", headers["idempotency-key"])
+        session = _cookie(headers.get("cookie", ""), "session_id")
+        psid = (scope.get("path_params") or {}).get("psid")
+        if state["response"]:
+            try:
+                issued = json.loads(bytes(state["response"])).get("id")
+            except (ValueError, AttributeError):
+                issued = None
+            if issued:
+                entry["o"] = recorder.pseudonym("psid", str(issued))
+        if session:
+            entry["c"] = "s:" + recorder.pseudonym("session_id", session)
+        elif psid:
+            entry["c"] = "p:" + recorder.pseudonym("psid", psid)
+        elif entry.get("o"):
+            entry["c"] = "p:" + entry["o"]
+        return entry
+
+
+def _route_path(scope: Dict[str, Any]) -> Optional[str]:
+    route = scope.get("route")
+    return getattr(route, "path", None)
+
+
+def _cookie(header: str, name: str) -> Optional[str]:
+    for part in header.split(";"):
+        key, _, value = part.strip().partition("=")
+        if key == name and value:
+            return value
+    return None
+
+
+def recorder_from_env() -> Optional[TrafficRecorder]:
+    path = os.getenv("TRAFFIC_CAPTURE_PATH")
+    if not path:
+        return None
+    salt = os.getenv("TRAFFIC_CAPTURE_SALT")
+    return TrafficRecorder(path.replace("{pid}", str(os.getpid())), salt=salt.encode("utf-8") if salt else secrets.token_bytes(16))
@@ -0,0 +1,279 @@
+"""Replay a ``traffic_capture.py`` capture against the app and compare builds.
+
+    python traffic_replay.py run capture.jsonl.gz --speed 1 --scale 4 --output build-a.json
+    python traffic_replay.py compare build-a.json build-b.json --threshold 20
+
+``run`` starts the app in-process against ``supabase_stub.SupabaseStub``
+(``--db-latency-ms`` / ``--db-jitter-ms`` model the database round trip). It
+sends every captured request through ``httpx.ASGITransport``, at the original
+pacing divided by ``--speed``; ``--speed 0`` sends as fast as each client's
+previous response allows. Each captured client (session cookie or page
+session) replays its requests in order on its own connection. ``--scale N``
+runs N independent copies of every client at once. Page-session ids issued
+during the replay stand in for the captured hashes. The output is per-route
+latency percentiles, errors and status mismatches as JSON.
+
+``compare`` prints per-route p50/p95 deltas and exits 1 when a route with at
+least ``--min-count`` samples regressed its p95 by more than ``--threshold``
+percent.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import re
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+_ROUTE_PARAM = re.compile(r"\{(\w+)(?::[^}]*)?\}")
+
+
+def load_capture(path: str) -> List[Dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    return {
+        "p50_ms": round(_percentile(samples, 0.50), 3),
+        "p90_ms": round(_percentile(samples, 0.90), 3),
+        "p95_ms": round(_percentile(samples, 0.95), 3),
+        "p99_ms": round(_percentile(samples, 0.99), 3),
+        "max_ms": round(max(samples), 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+    }
+
+
+class _Replica:
+    """Live ids for one copy of the captured traffic."""
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.psids: Dict[str, str] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def psid(self, client: httpx.AsyncClient, hashed: str) -> str:
+        if hashed in self.psids:
+            return self.psids[hashed]
+        if hashed not in self._pending:
+            # Started before the capture window (or by another client); open a stand-in session.
+            self._pending[hashed] = asyncio.ensure_future(client.post("/page-sessions/start", json={"page": "/replay"}))
+        response = await self._pending[hashed]
+        self.psids.setdefault(hashed, response.json()["id"])
+        return self.psids[hashed]
+
+
+class Replayer:
+    def __init__(self, app: Any, records: List[Dict[str, Any]], *, speed: float, scale: int) -> None:
+        self.app = app
+        self.records = records
+        self.speed = speed
+        self.scale = scale
+        self.samples: Dict[str, List[float]] = {}
+        self.captured: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.mismatches: Dict[str, int] = {}
+
+    def _clients(self) -> List[List[Dict[str, Any]]]:
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for index, record in enumerate(self.records):
+            groups.setdefault(record.get("c") or f"#{index}", []).append(record)
+        return list(groups.values())
+
+    async def run(self) -> float:
+        started = time.perf_counter()
+        replicas = [_Replica(index) for index in range(self.scale)]
+        await asyncio.gather(*(self._client(replica, records, started) for replica in replicas for records in self._clients()))
+        return time.perf_counter() - started
+
+    async def _client(self, replica: _Replica, records: List[Dict[str, Any]], started: float) -> None:
+        origin = self.records[0]["t"]
+        transport = httpx.ASGITransport(app=self.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=60.0) as client:
+            if (records[0].get("c") or "").startswith("s:"):
+                # Captured clients carried a session cookie; an anonymous one keeps session-linked paths exercised.
+                await client.post("/logout")
+            for record in records:
+                if self.speed > 0:
+                    delay = (record["t"] - origin) / 1000.0 / self.speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await self._send(client, replica, record)
+
+    async def _send(self, client: httpx.AsyncClient, replica: _Replica, record: Dict[str, Any]) -> None:
+        key = f"{record['m']} {record['r']}"
+        self.captured.setdefault(key, []).append(record.get("d") or 0.0)
+        params = {name: await self._value(client, replica, name, value) for name, value in (record.get("p") or {}).items()}
+        path = _ROUTE_PARAM.sub(lambda match: str(params.get(match.group(1), "")), record["r"])
+        query = "&".join([f"{name}={await self._value(client, replica, name, value)}" for name, value in (record.get("q") or {}).items()])
+        headers = {"Idempotency-Key": f"{record['ik']}-{replica.index}"} if record.get("ik") else {}
+        body = await self._rewrite(client, replica, record["b"]) if "b" in record else None
+        request = client.build_request(record["m"], path + (f"?{query}" if query else ""), json=body, headers=headers)
+        sent = time.perf_counter()
+        try:
+            response = await client.send(request)
+        except Exception:
+            self.errors[key] = self.errors.get(key, 0) + 1
+            return
+        self.samples.setdefault(key, []).append((time.perf_counter() - sent) * 1000.0)
+        if response.status_code >= 500:
+            self.errors[key] = self.errors.get(key, 0) + 1
+        if response.status_code != record.get("s"):
+            self.mismatches[key] = self.mismatches.get(key, 0) + 1
+        if record.get("o") and response.status_code == 200:
+            replica.psids.setdefault(record["o"], response.json()["id"])
+
+    async def _value(self, client: httpx.AsyncClient, replica: _Replica, name: str, value: Any) -> Any:
+        return await replica.psid(client, value) if name == "psid" and isinstance(value, str) else value
+
+    async def _rewrite(self, client: httpx.AsyncClient, replica: _Replica, value: Any, key: str = "") -> Any:
+        if isinstance(value, dict):
+            return {k: await self._rewrite(client, replica, v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [await self._rewrite(client, replica, item, key) for item in value]
+        return await self._value(client, replica, key, value)
+
+    def report(self, wall_seconds: float) -> Dict[str, Any]:
+        routes = {}
+        for key in sorted(set(self.captured)):
+            samples = self.samples.get(key, [])
+            routes[key] = {
+                "count": len(samples),
+                "errors": self.errors.get(key, 0),
+                "status_mismatches": self.mismatches.get(key, 0),
+                **summarize(samples),
+                "captured_p50_ms": summarize(self.captured[key]).get("p50_ms"),
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            "requests": total,
+            "wall_seconds": round(wall_seconds, 3),
+            "throughput_rps": round(total / wall_seconds, 1) if wall_seconds else None,
+            "routes": routes,
+        }
+
+
+def _prepare_environment() -> None:
+    # Must run before ``main`` is imported: its settings are read at import time.
+    scratch = tempfile.mkdtemp(prefix="traffic-replay-")
+    os.environ.update(
+        {
+            "SUPABASE_URL": "http://supabase.stub",
+            "SUPABASE_ANON_KEY": "stub",
+            "SCHEDULER_ENABLED": "0",
+            "TELEMETRY_SPOOL_DIR": os.path.join(scratch, "spool"),
+            "FEATURE_STORE_PATH": os.path.join(scratch, "features.npz"),
+            "VIDEO_CACHE_DIR": os.path.join(scratch, "video_cache"),
+        }
+    )
+    # The scratch spool needs a stable caller-hash key; one run is one process, so any value will do.
+    os.environ.setdefault("SESSION_TOKEN_SECRET", secrets.token_hex(32))
+    for name in ("SUPABASE_SERVICE_ROLE_KEY", "CACHE_REDIS_URL", "TRAFFIC_CAPTURE_PATH"):
+        os.environ.pop(name, None)
+
+
+async def _replay(args: argparse.Namespace) -> Dict[str, Any]:
+    _prepare_environment()
+    import supabase_stub
+
+    stub = supabase_stub.SupabaseStub(latency_ms=args.db_latency_ms, jitter_ms=args.db_jitter_ms, seed=args.seed)
+    supabase_stub.install(stub)
+    import main
+
+    records = load_capture(args.capture)
+    if not records:
+        raise SystemExit(f"{args.capture} holds no requests")
+    replayer = Replayer(main.app, records, speed=args.speed, scale=args.scale)
+    async with main.app.router.lifespan_context(main.app):
+        wall_seconds = await replayer.run()
+    report = replayer.report(wall_seconds)
+    report.update(
+        {
+            "capture": os.path.basename(args.capture),
+            "captured_requests": len(records),
+            "captured_seconds": round((records[-1]["t"] - records[0]["t"]) / 1000.0, 3),
+            "speed": args.speed,
+            "scale": args.scale,
+            "db_latency_ms": args.db_latency_ms,
+            "db_calls": stub.calls,
+        }
+    )
+    return report
+
+
+def compare(baseline: Dict[str, Any], candidate: Dict[str, Any], *, threshold: float, min_count: int) -> Tuple[List[str], List[str]]:
+    """Return ``(table lines, regressed route keys)``."""
+    lines = [f"{'route':<52} {'count':>7} {'p50 ms':>17} {'p95 ms':>17} {'p95 %':>7}"]
+    regressed = []
+    for key in sorted(set(baseline["routes"]) | set(candidate["routes"])):
+        old, new = baseline["routes"].get(key), candidate["routes"].get(key)
+        if not old or not new or not old.get("count") or not new.get("count"):
+            lines.append(f"{key:<52} {'only in ' + ('candidate' if new else 'baseline'):>7}")
+            continue
+        delta = (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100.0 if old["p95_ms"] else 0.0
+        flag = ""
+        if delta > threshold and min(old["count"], new["count"]) >= min_count:
+            regressed.append(key)
+            flag = "  REGRESSED"
+        lines.append(
+            f"{key:<52} {new['count']:>7} {old['p50_ms']:>8.2f}>{new['p50_ms']:<8.2f} {old['p95_ms']:>8.2f}>{new['p95_ms']:<8.2f} {delta:>+6.1f}%{flag}"
+        )
+    return lines, regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="replay a capture and report latencies")
+    run.add_argument("capture")
+    run.add_argument("--speed", type=float, default=1.0, help="pacing multiplier; 0 sends back to back")
+    run.add_argument("--scale", type=int, default=1, help="concurrent copies of every captured client")
+    run.add_argument("--db-latency-ms", type=float, default=2.0)
+    run.add_argument("--db-jitter-ms", type=float, default=0.0)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output", help="write the report here as well as to stdout")
+    diff = commands.add_parser("compare", help="compare two run reports")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    diff.add_argument("--threshold", type=float, default=20.0, help="allowed p95 increase in percent")
+    diff.add_argument("--min-count", type=int, default=20, help="ignore routes with fewer samples")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = asyncio.run(_replay(args))
+        text = json.dumps(report, indent=2, sort_keys=True)
+        print(text)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    lines, regressed = compare(baseline, candidate, threshold=args.threshold, min_count=args.min_count)
+    print("\n".join(lines))
+    if regressed:
+        print(f"p95 regressed by more than {args.threshold:g}% on: {', '.join(regressed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Compressed storage for cursor trajectories.
+
+With ``CURSOR_TRAJECTORY_STORAGE`` on, move events without extra ``data``
+are not stored as one ``events`` row each. Runs of them per page session
+become ``cursor_trajectories`` segments
+(``my-app/scripts/005_create_cursor_trajectories.sql``). A segment holds its
+points as ``(t_ms, x, y)`` triples: a format byte, then the point count,
+the first point, and then deltas from the previous point, all as zigzag
+LEB128 varints. Consecutive moves are a few pixels and ~16 ms apart, so
+most points take three bytes. With ``tolerance_px`` above zero, points
+within that distance of the simplified path (Ramer-Douglas-Peucker) are
+dropped before encoding.
+"""
+import os
+import uuid
+from typing import Any, Dict, List, Sequence, Tuple
+
+from clock import to_ms
+
+Point = Tuple[int, int, int]
+
+FORMAT_VERSION = 1
+MOVE_EVENT_TYPES = frozenset({"mousemove", "pointermove", "touchmove"})
+MAX_SEGMENT_POINTS = 4096
+# A pause longer than this starts a new segment, so segment time ranges stay tight.
+MAX_GAP_MS = 10_000
+
+STORAGE_ENABLED = os.getenv("CURSOR_TRAJECTORY_STORAGE", "").lower() in ("1", "true", "yes")
+TOLERANCE_PX = float(os.getenv("CURSOR_TRAJECTORY_TOLERANCE_PX", "") or 0.0)
+
+_SEGMENT_NAMESPACE = uuid.UUID("6f0c2a57-3d1e-4f4b-9a55-2c8e1f7b9d10")
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(blob: bytes, pos: int) -> Tuple[int, int]:
+    shift = 0
+    value = 0
+    while True:
+        byte = blob[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def encode(points: Sequence[Point]) -> bytes:
+    out = bytearray([FORMAT_VERSION])
+    _write_varint(out, len(points))
+    prev = (0, 0, 0)
+    for point in points:
+        for value, base in zip(point, prev):
+            _write_varint(out, value - base)
+        prev = point
+    return bytes(out)
+
+
+def decode(blob: bytes) -> List[Point]:
+    if not blob or blob[0] != FORMAT_VERSION:
+        raise ValueError("Unknown trajectory format")
+    count, pos = _read_varint(blob, 1)
+    points: List[Point] = []
+    t = x = y = 0
+    for _ in range(count):
+        dt, pos = _read_varint(blob, pos)
+        dx, pos = _read_varint(blob, pos)
+        dy, pos = _read_varint(blob, pos)
+        t, x, y = t + dt, x + dx, y + dy
+        points.append((t, x, y))
+    return points
+
+
+def _distance_sq(point: Point, start: Point, end: Point) -> float:
+    """Squared distance from ``point`` to the segment ``start``-``end`` in the x/y plane."""
+    px, py = point[1] - start[1], point[2] - start[2]
+    dx, dy = end[1] - start[1], end[2] - start[2]
+    length_sq = dx * dx + dy * dy
+    if length_sq:
+        along = max(0.0, min(1.0, (px * dx + py * dy) / length_sq))
+        px -= along * dx
+        py -= along * dy
+    return px * px + py * py
+
+
+def simplify(points: Sequence[Point], tolerance_px: float) -> List[Point]:
+    """Ramer-Douglas-Peucker over x/y; endpoints are always kept."""
+    if tolerance_px <= 0 or len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    limit = tolerance_px * tolerance_px
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        worst, worst_index = 0.0, -1
+        for index in range(first + 1, last):
+            distance = _distance_sq(points[index], points[first], points[last])
+            if distance > worst:
+                worst, worst_index = distance, index
+        if worst > limit:
+            keep[worst_index] = True
+            stack.append((first, worst_index))
+            stack.append((worst_index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _is_compressible(row: Dict[str, Any]) -> bool:
+    return row.get("event_type") in MOVE_EVENT_TYPES and row.get("data") is None and row.get("x") is not None and row.get("y") is not None
+
+
+def _segment_record(psid: str, points: List[Point], tolerance_px: float) -> Dict[str, Any]:
+    stored = simplify(points, tolerance_px)
+    started_at, ended_at = points[0][0], points[-1][0]
+    return {
+        # Deterministic so a retried write upserts the same segment instead of duplicating it.
+        "id": str(uuid.uuid5(_SEGMENT_NAMESPACE, f"{psid}|{started_at}|{ended_at}|{len(points)}")),
+        "page_session_id": psid,
+        "started_at": started_at,
+        "ended_at": ended_at,
+        "point_count": len(points),
+        "stored_points": len(stored),
+        "tolerance_px": tolerance_px,
+        "points": "\\x" + encode(stored).hex(),
+    }
+
+
+def split_moves(rows: Sequence[Dict[str, Any]], tolerance_px: float = TOLERANCE_PX) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Split event rows into ``(rows still stored as events, trajectory segment records)``.
+
+    Moves are grouped per page session in time order and cut into segments
+    at ``MAX_GAP_MS`` pauses or every ``MAX_SEGMENT_POINTS`` points.
+    """
+    remaining: List[Dict[str, Any]] = []
+    moves: Dict[str, List[Point]] = {}
+    for row in rows:
+        if _is_compressible(row):
+            moves.setdefault(row["page_session_id"], []).append((to_ms(row["event_timestamp"]), int(row["x"]), int(row["y"])))
+        else:
+            remaining.append(row)
+    segments: List[Dict[str, Any]] = []
+    for psid, points in moves.items():
+        points.sort(key=lambda point: point[0])
+        start = 0
+        for index in range(1, len(points) + 1):
+            if index == len(points) or index - start >= MAX_SEGMENT_POINTS or points[index][0] - points[index - 1][0] > MAX_GAP_MS:
+                segments.append(_segment_record(psid, points[start:index], tolerance_px))
+                start = index
+    return remaining, segments
+
+
+def decode_segment(record: Dict[str, Any]) -> List[Point]:
+    """Points of a stored segment; PostgREST returns ``bytea`` as ``\\x``-prefixed hex."""
+    raw = record["points"]
+    return decode(bytes.fromhex(raw[2:] if raw.startswith("\\x") else raw))
@@ -0,0 +1,297 @@
+"""Content-addressed local disk cache for video files, filled on demand.
+
+Blobs are stored under ``blobs/<sha[:2]>/<sha>`` so identical uploads under
+different names share one file. ``index.json`` maps object names to blobs
+and records sizes and last access times. When the cache grows past
+``max_bytes``, the least recently used blobs are evicted. Misses are filled
+from the mounted source directories first (``premade videos/`` by default)
+and then from the storage bucket. Concurrent requests for the same object
+share one fill.
+
+All workers on a host share the directory. Each keeps its own view of the
+index and, after a fill, merges it into ``index.json`` under an
+``fcntl.flock`` on ``index.lock``, evicting from the merged index. A blob
+another worker evicted is noticed on lookup and filled again.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import httpx
+
+import supabase_client
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mov", ".m4v")
+# Partial downloads untouched for this long belong to a worker that died mid-fill.
+STALE_PART_SECONDS = 15 * 60
+
+Names = Dict[str, str]
+Blobs = Dict[str, Dict[str, float]]
+
+
+def normalize_name(name: str) -> str:
+    """Loose key so ``Monday 6:30 am.mp4`` matches the filesystem-safe ``Monday 630 am.mp4``."""
+    base = os.path.basename(name.replace("\\", "/"))
+    return re.sub(r"[^a-z0-9.]", "", base.lower())
+
+
+def is_safe_name(name: str) -> bool:
+    """Object names may not climb out of the bucket: no ``..`` segments, leading ``/``, backslashes or NULs."""
+    if not name or name.startswith("/") or "\\" in name or "\x00" in name:
+        return False
+    return all(segment not in ("", ".", "..") for segment in name.split("/"))
+
+
+class VideoDiskCache:
+    def __init__(self, directory: str, *, max_bytes: int, source_dirs: List[str], bucket: str) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.source_dirs = source_dirs
+        self.bucket = bucket
+        self._names: Dict[str, str] = {}
+        self._blobs: Dict[str, Dict[str, float]] = {}
+        self._sources: Optional[Dict[str, str]] = None
+        self._fills: Dict[str, "asyncio.Future[Optional[str]]"] = {}
+        self._prefetches: Dict[str, asyncio.Task] = {}
+        self._loaded = False
+
+    # -- index -------------------------------------------------------------------
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "blobs", digest[:2], digest)
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(os.path.join(self.directory, "blobs"), exist_ok=True)
+        now = time.time()
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            if entry.endswith(".part"):
+                try:
+                    if now - os.path.getmtime(path) > STALE_PART_SECONDS:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+        self._names, self._blobs = self._read_index()
+
+    def _read_index(self) -> Tuple[Names, Blobs]:
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}, {}
+        blobs = {digest: meta for digest, meta in data.get("blobs", {}).items() if os.path.exists(self._blob_path(digest))}
+        names = {name: digest for name, digest in data.get("names", {}).items() if digest in blobs}
+        return names, blobs
+
+    def _sync_index(self, names: Names, blobs: Blobs, keep: str) -> Tuple[Names, Blobs, Set[str]]:
+        """Merge this worker's view into ``index.json`` and evict past ``max_bytes``, under the index lock.
+
+        Runs in a worker thread. Returns the merged names and blobs, plus the
+        digests from ``blobs`` that are gone (evicted here or by another worker).
+        """
+        with open(os.path.join(self.directory, "index.lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            merged_names, merged_blobs = self._read_index()
+            for digest, meta in blobs.items():
+                if digest in merged_blobs:
+                    merged_blobs[digest]["atime"] = max(merged_blobs[digest]["atime"], meta["atime"])
+                elif os.path.exists(self._blob_path(digest)):
+                    merged_blobs[digest] = dict(meta)
+            merged_names.update((name, digest) for name, digest in names.items() if digest in merged_blobs)
+            total = sum(meta["size"] for meta in merged_blobs.values())
+            for digest, meta in sorted(merged_blobs.items(), key=lambda item: item[1]["atime"]):
+                if total <= self.max_bytes:
+                    break
+                if digest == keep:
+                    continue
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+                total -= meta["size"]
+                del merged_blobs[digest]
+                logger.info("Evicted cached video blob %s (%d bytes)", digest, meta["size"])
+            merged_names = {name: digest for name, digest in merged_names.items() if digest in merged_blobs}
+            tmp_path = self._index_path() + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"names": merged_names, "blobs": merged_blobs}, f)
+            os.replace(tmp_path, self._index_path())
+        return merged_names, merged_blobs, set(blobs) - set(merged_blobs)
+
+    async def _save(self, keep: str) -> None:
+        names, blobs, gone = await asyncio.to_thread(self._sync_index, dict(self._names), {digest: dict(meta) for digest, meta in self._blobs.items()}, keep)
+        # Entries filled while the thread ran are kept; the next save merges them.
+        for digest in gone:
+            self._blobs.pop(digest, None)
+        self._blobs.update(blobs)
+        self._names = {name: digest for name, digest in {**names, **self._names}.items() if digest in self._blobs}
+
+    def _forget(self, digest: str) -> None:
+        self._blobs.pop(digest, None)
+        self._names = {name: d for name, d in self._names.items() if d != digest}
+
+    @property
+    def total_bytes(self) -> int:
+        return int(sum(meta["size"] for meta in self._blobs.values()))
+
+    # -- sources -----------------------------------------------------------------
+
+    def _local_source(self, name: str) -> Optional[str]:
+        if self._sources is None:
+            sources: Dict[str, str] = {}
+            for root_dir in self.source_dirs:
+                for root, _dirs, files in os.walk(root_dir):
+                    for file_name in files:
+                        if file_name.lower().endswith(VIDEO_EXTENSIONS):
+                            sources.setdefault(normalize_name(file_name), os.path.join(root, file_name))
+            self._sources = sources
+        return self._sources.get(normalize_name(name))
+
+    def _ingest_file(self, source_path: str) -> str:
+        """Hash-copy a local file into the blob store; returns its digest."""
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        with os.fdopen(fd, "wb") as out, open(source_path, "rb") as src:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        return self._commit(tmp_path, digest.hexdigest())
+
+    def _commit(self, tmp_path: str, digest: str) -> str:
+        blob_path = self._blob_path(digest)
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+        return digest
+
+    async def _download(self, name: str) -> str:
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        out = os.fdopen(fd, "wb")
+
+        async def sink(chunk: bytes) -> None:
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+
+        try:
+            await supabase_client.storage_download(self.bucket, name, sink)
+        except BaseException:
+            out.close()
+            os.remove(tmp_path)
+            raise
+        out.close()
+        return await asyncio.to_thread(self._commit, tmp_path, digest.hexdigest())
+
+    # -- public API --------------------------------------------------------------
+
+    def cached_path(self, name: str) -> Optional[str]:
+        self._load()
+        digest = self._names.get(name)
+        if digest is None:
+            return None
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            # Evicted by another worker; the caller fills it again.
+            self._forget(digest)
+            return None
+        self._blobs[digest]["atime"] = time.time()
+        return path
+
+    async def _fill(self, name: str) -> Optional[str]:
+        source = self._local_source(name)
+        if source is not None:
+            digest = await asyncio.to_thread(self._ingest_file, source)
+        elif supabase_client.is_enabled():
+            try:
+                digest = await self._download(name)
+            except httpx.HTTPStatusError as exc:
+                # Storage answers 400 as well as 404 for missing objects.
+                if exc.response.status_code in (400, 404):
+                    return None
+                raise
+        else:
+            return None
+        size = os.path.getsize(self._blob_path(digest))
+        self._blobs[digest] = {"size": size, "atime": time.time()}
+        self._names[name] = digest
+        await self._save(keep=digest)
+        return self._blob_path(digest)
+
+    async def path_for(self, name: str) -> Optional[str]:
+        """Local path for ``name``, filling the cache on a miss; None when no source has it."""
+        if not is_safe_name(name):
+            return None
+        path = self.cached_path(name)
+        if path is not None:
+            return path
+        pending = self._fills.get(name)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future: "asyncio.Future[Optional[str]]" = asyncio.get_running_loop().create_future()
+        self._fills[name] = future
+        try:
+            path = await self._fill(name)
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception()
+            raise
+        else:
+            future.set_result(path)
+            return path
+        finally:
+            self._fills.pop(name, None)
+
+    def prefetch(self, names: List[str]) -> None:
+        """Start background fills for ``names`` that are not cached yet; never blocks the caller."""
+        for name in names:
+            if name in self._prefetches or name in self._fills or self.cached_path(name) is not None:
+                continue
+            task = asyncio.create_task(self._prefetch_one(name))
+            self._prefetches[name] = task
+            task.add_done_callback(lambda _task, name=name: self._prefetches.pop(name, None))
+
+    async def _prefetch_one(self, name: str) -> None:
+        try:
+            await self.path_for(name)
+        except Exception:
+            logger.warning("Prefetching %s into the video cache failed", name, exc_info=True)
+
+
+def _default_source_dirs() -> List[str]:
+    configured = os.getenv("VIDEO_SOURCE_DIRS")
+    if configured:
+        return [path for path in configured.split(os.pathsep) if path]
+    return [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "premade videos")]
+
+
+video_cache = VideoDiskCache(
+    os.getenv("VIDEO_CACHE_DIR") or os.path.join(os.path.dirname(__file__), "data", "video_cache"),
+    max_bytes=int(os.getenv("VIDEO_CACHE_MAX_BYTES", "") or 2 * 1024 ** 3),
+    source_dirs=_default_source_dirs(),
+    bucket=os.getenv("SUPABASE_VIDEO_BUCKET", "videos"),
+)
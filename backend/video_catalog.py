@@ -0,0 +1,186 @@
+"""Video catalog merging ``data/videos.json`` with the storage bucket, with cached signed URLs."""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import supabase_client
+
+logger = logging.getLogger(__name__)
+
+BUCKET = os.getenv("SUPABASE_VIDEO_BUCKET", "videos")
+SIGNED_URL_TTL = int(os.getenv("SUPABASE_SIGNED_URL_TTL", "") or 3600)
+LISTING_TTL = float(os.getenv("VIDEO_CATALOG_LISTING_TTL", "") or 300)
+# Re-sign once less than this fraction of the signed URL lifetime remains.
+REFRESH_FRACTION = 0.2
+
+
+def object_name(file_url: str, bucket: str = BUCKET) -> str:
+    """Map a ``videos.json`` ``file_url`` such as ``videos/Intro.mp4`` to its object name."""
+    name = file_url.lstrip("/")
+    prefix = bucket + "/"
+    return name[len(prefix):] if name.startswith(prefix) else name
+
+
+class VideoCatalog:
+    def __init__(self, videos_file: str, *, bucket: str = BUCKET, signed_ttl: int = SIGNED_URL_TTL, listing_ttl: float = LISTING_TTL) -> None:
+        self.videos_file = videos_file
+        self.bucket = bucket
+        self.signed_ttl = signed_ttl
+        self.listing_ttl = listing_ttl
+        self._listing: List[str] = []
+        self._listing_at = 0.0
+        self._signed: Dict[str, Tuple[str, float]] = {}
+        self._metadata_mtime: Optional[float] = None
+        self._metadata: Dict[str, Dict[str, Any]] = {}
+        self._snapshot: Optional[Tuple[List[Dict[str, Any]], str]] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._refresher: Optional[asyncio.Task] = None
+
+    # -- sources -----------------------------------------------------------------
+
+    def _load_metadata(self) -> bool:
+        try:
+            mtime = os.path.getmtime(self.videos_file)
+        except OSError:
+            mtime = None
+        if mtime == self._metadata_mtime:
+            return False
+        metadata: Dict[str, Dict[str, Any]] = {}
+        if mtime is not None:
+            try:
+                with open(self.videos_file, "r", encoding="utf-8-sig") as f:
+                    entries = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                logger.warning("Could not read %s", self.videos_file, exc_info=True)
+                entries = []
+            for entry in entries:
+                if entry.get("file_url"):
+                    metadata.setdefault(object_name(entry["file_url"], self.bucket), entry)
+        self._metadata = metadata
+        self._metadata_mtime = mtime
+        return True
+
+    async def _refresh_listing(self) -> None:
+        objects = await supabase_client.storage_list(self.bucket)
+        self._listing = [obj["name"] for obj in objects if obj.get("name") and not obj["name"].endswith("/") and obj.get("id") is not None]
+        self._listing_at = time.monotonic()
+
+    def _needs_signing(self, paths: List[str]) -> List[str]:
+        threshold = time.time() + self.signed_ttl * REFRESH_FRACTION
+        return [path for path in paths if self._signed.get(path, ("", 0.0))[1] <= threshold]
+
+    async def _sign(self, paths: List[str]) -> None:
+        if not paths:
+            return
+        expires_at = time.time() + self.signed_ttl
+        signed = await supabase_client.storage_sign(self.bucket, paths, self.signed_ttl)
+        for path, url in signed.items():
+            self._signed[path] = (url, expires_at)
+
+    async def ensure_signed(self, paths: List[str]) -> Dict[str, Tuple[str, float]]:
+        """Return ``{path: (signed_url, expires_at)}``, signing in one call only the paths nearing expiry."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            stale = self._needs_signing(paths)
+            if stale:
+                try:
+                    await self._sign(stale)
+                except Exception:
+                    logger.warning("Signing %d video URLs failed", len(stale), exc_info=True)
+                else:
+                    if self._snapshot is not None:
+                        self._snapshot = self._build()
+        now = time.time()
+        return {path: self._signed[path] for path in paths if path in self._signed and self._signed[path][1] > now}
+
+    # -- snapshot ----------------------------------------------------------------
+
+    def _paths(self) -> List[str]:
+        paths = list(self._listing)
+        seen = set(paths)
+        for name in self._metadata:
+            if name not in seen:
+                paths.append(name)
+                seen.add(name)
+        return paths
+
+    def _build(self) -> Tuple[List[Dict[str, Any]], str]:
+        now = time.time()
+        items: List[Dict[str, Any]] = []
+        for path in self._paths():
+            meta = self._metadata.get(path, {})
+            url, expires_at = self._signed.get(path, ("", 0.0))
+            signed = bool(url) and expires_at > now
+            items.append(
+                {
+                    "file_name": path,
+                    "file_url": url if signed else f"/{self.bucket}/{path}",
+                    "signed": signed,
+                    "expires_at": int(expires_at) if signed else None,
+                    "stream_url": f"/videos/stream/{quote(path)}",
+                    "id": meta.get("id"),
+                    "title": meta.get("title"),
+                    "description": meta.get("description"),
+                }
+            )
+        body = json.dumps(items, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        return items, etag
+
+    async def refresh(self, *, force_listing: bool = False) -> None:
+        """Refresh the bucket listing when stale and re-sign URLs nearing expiry, in bulk."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            changed = self._load_metadata()
+            if force_listing or time.monotonic() - self._listing_at > self.listing_ttl:
+                try:
+                    await self._refresh_listing()
+                    changed = True
+                except Exception:
+                    logger.warning("Storage listing failed; serving cached catalog", exc_info=True)
+            stale = self._needs_signing(self._paths())
+            if stale:
+                try:
+                    await self._sign(stale)
+                    changed = True
+                except Exception:
+                    logger.warning("Signing %d video URLs failed", len(stale), exc_info=True)
+            if changed or self._snapshot is None:
+                self._snapshot = self._build()
+
+    async def snapshot(self) -> Tuple[List[Dict[str, Any]], str]:
+        """Return ``(items, etag)``; only touches storage when the cache cannot serve the request."""
+        if self._load_metadata():
+            self._snapshot = None
+        if self._snapshot is None:
+            await self.refresh()
+        elif time.monotonic() - self._listing_at > self.listing_ttl or self._needs_signing(self._paths()):
+            # Cached URLs still have REFRESH_FRACTION of their lifetime left; re-sign off the request path.
+            self._schedule_refresh()
+        return self._snapshot
+
+    async def contains(self, name: str) -> bool:
+        """Whether ``name`` is listed in the bucket or ``videos.json``; only those may be streamed."""
+        await self.snapshot()
+        return name in self._metadata or name in self._listing
+
+    def _schedule_refresh(self) -> None:
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.create_task(self.refresh())
+
+    async def run(self) -> None:
+        """Background loop re-signing URLs before they expire so requests never wait on storage."""
+        interval = max(30.0, min(self.listing_ttl, self.signed_ttl * REFRESH_FRACTION / 2))
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Video catalog refresh failed")
+            await asyncio.sleep(interval)
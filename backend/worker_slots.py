@@ -0,0 +1,36 @@
+"""Per-process slots for on-disk state that uvicorn/gunicorn workers must not share.
+
+``claim_slot`` leases the lowest numbered slot no live process holds, using
+an ``fcntl.flock`` on a lease file. The kernel drops the lock when its
+holder exits, so a restarted worker takes over the slot, and the state, of
+one that is gone.
+"""
+import os
+from typing import IO, Callable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def claim_slot(lease_path: Callable[[str], str]) -> Tuple[str, Optional[IO[str]]]:
+    """Return ``(slot, lease)``; keep ``lease`` open for as long as the slot is in use.
+
+    ``lease_path(slot)`` names the lease file for a slot. Without ``fcntl``
+    (non-POSIX hosts) the slot is named after the pid and nothing is locked.
+    """
+    if fcntl is None:
+        return f"pid{os.getpid()}", None
+    index = 0
+    while True:
+        path = lease_path(str(index))
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        lease = open(path, "a")
+        try:
+            fcntl.flock(lease.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lease.close()
+            index += 1
+            continue
+        return str(index), lease
@@ -6,6 +6,7 @@ import { useParams, useRouter } from "next/navigation"
 import VideoPlayer from "@/components/video-player"
 import { STUDY_STREAMS_VIDEO_FALLBACK_URL } from "@/lib/video-constants"
 import { resolveVideoUrl } from "@/lib/video-url"
+import { prefetchNextAssets } from "@/lib/next-assets"
 import { Button } from "@/components/ui/button"
 import {
   fetchLatestProgressForVideo,
@@ -90,7 +91,7 @@ export default function NextVideoPage() {
 
     const load = async () => {
       try {
-        const res = await fetch("/api/videos")
+        const res = await fetch("/api/videos/catalog")
         if (!res.ok) throw new Error("Failed to fetch videos")
         const videos = (await res.json()) as { file_url: string }[]
         if (!active) return
@@ -117,6 +118,12 @@ export default function NextVideoPage() {
     }
   }, [sequence, sequenceIndex])
 
+  useEffect(() => {
+    if (sequence) {
+      void prefetchNextAssets(subject)
+    }
+  }, [sequence, sequenceIndex, subject])
+
   useEffect(() => {
     let cancelled = false
 
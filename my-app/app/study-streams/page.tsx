@@ -10,6 +10,7 @@ import Header from "@/components/header"
 import VideoPlayer from "@/components/video-player"
 import { STUDY_STREAMS_VIDEO_FALLBACK_URL } from "@/lib/video-constants"
 import { resolveVideoUrl } from "@/lib/video-url"
+import { prefetchNextAssets } from "@/lib/next-assets"
 import { recordVideoProgressEvent, fetchLatestProgressForVideo, fetchVideoProgress, type VideoProgressRecord } from "@/lib/video-progress"
 import { Button } from "@/components/ui/button"
 import { Card } from "@/components/ui/card"
@@ -605,6 +606,9 @@ export default function StudyStreamsPage() {
     setPendingStream(streamId)
     setIsLoading(true)
     setTimerVisible(false)
+    if (streamId === "consulting") {
+      void prefetchNextAssets(streamId)
+    }
     setTimerProgress(1)
     timerStartedRef.current = false
 
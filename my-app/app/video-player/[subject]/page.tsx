@@ -52,7 +52,7 @@ export default function VideoPlayerPage() {
 
     const loadVideo = async () => {
       try {
-        const res = await fetch("/api/videos")
+        const res = await fetch("/api/videos/catalog")
         if (!res.ok) throw new Error("Failed to fetch videos")
         const videos = (await res.json()) as { file_url: string }[]
         if (!active) return
@@ -2,7 +2,15 @@
 
 import { createContext, useCallback, useContext, useEffect, useMemo, useState } from "react"
 
-import { fetchScoreSummary, recordScoreEvent, type ScoreEventOptions, type ScoreSummary } from "@/lib/user-score"
+import { subscribeLiveUpdates } from "@/lib/live-updates"
+import {
+  fetchScoreSummary,
+  recordScoreEvent,
+  rememberScoreSummary,
+  type ScoreEventOptions,
+  type ScoreSummary,
+} from "@/lib/user-score"
+import { rememberVideoProgress, type VideoProgressRecord } from "@/lib/video-progress"
 
 interface ScoreContextValue {
   summary: ScoreSummary | null
@@ -46,6 +54,21 @@ export function ScoreProvider({ children }: { children: React.ReactNode }) {
     }
   }, [])
 
+  useEffect(() => {
+    const unsubscribeScore = subscribeLiveUpdates("score", (data) => {
+      const next = data as ScoreSummary
+      setSummary(next)
+      void rememberScoreSummary(next)
+    })
+    const unsubscribeProgress = subscribeLiveUpdates("progress", (data) => {
+      void rememberVideoProgress(data as VideoProgressRecord)
+    })
+    return () => {
+      unsubscribeScore()
+      unsubscribeProgress()
+    }
+  }, [])
+
   const recordScore = useCallback(async (options: ScoreEventOptions) => {
     if (!initialised) {
       await refresh()
@@ -29,6 +29,18 @@ type CursorDwellUpdate = {
   metadata?: Record<string, unknown>
 }
 
+type IngestSession = {
+  psid: string
+  events: QueuedEvent[]
+  cursor: CursorDwellUpdate[]
+  end?: { ended_at: string; duration_seconds: number | null }
+}
+
+type IngestEnvelope = {
+  envelope_id: string
+  sessions: IngestSession[]
+}
+
 type CursorTargetState = {
   def: CursorTargetDefinition
   inside: boolean
@@ -40,6 +52,11 @@ type CursorTargetState = {
 const MIN_CURSOR_BATCH_MS = 250
 const DEFAULT_SOURCE_KEY = "__default__"
 
+const makeBatchId = () =>
+  typeof crypto !== "undefined" && typeof crypto.randomUUID === "function"
+    ? crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+
 const nowMs = () =>
   typeof performance !== "undefined" && typeof performance.now === "function" ? performance.now() : Date.now()
 
@@ -48,6 +65,7 @@ export default function SessionTracker() {
   const psidRef = useRef<string | null>(null)
   const startRef = useRef<number | null>(null)
   const queueRef = useRef<QueuedEvent[]>([])
+  const unsentEnvelopesRef = useRef<IngestEnvelope[]>([])
   const prevPathRef = useRef<string | null>(null)
 
   const targetSourcesRef = useRef(new Map<string, CursorTargetDefinition[]>())
@@ -196,43 +214,47 @@ export default function SessionTracker() {
   )
 
   const flushQueue = useCallback(
-    async (forceCursor = false) => {
+    async (forceCursor = false, end?: IngestSession["end"], useBeacon = false) => {
       const psid = psidRef.current
       if (!psid) return
 
       const events = queueRef.current
       queueRef.current = []
-
-      const cursorUpdates = cursorPendingRef.current.concat(gatherCursorUpdates(forceCursor))
+      const cursor = cursorPendingRef.current.concat(gatherCursorUpdates(forceCursor))
       cursorPendingRef.current = []
 
-      if (!events.length && !cursorUpdates.length) {
-        return
+      // Envelopes that failed to send keep their id so a retry is deduplicated server-side.
+      // Leftovers from earlier pages travel in their own envelopes alongside the current one.
+      const envelopes = unsentEnvelopesRef.current
+      unsentEnvelopesRef.current = []
+      if (events.length || cursor.length || end) {
+        envelopes.push({ envelope_id: makeBatchId(), sessions: [{ psid, events, cursor, ...(end ? { end } : {}) }] })
       }
 
-      if (events.length) {
-        try {
-          await fetch(`/api/page-sessions/${psid}/events-batch`, {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ events }),
-            keepalive: true,
-          })
-        } catch {
-          queueRef.current.unshift(...events)
+      for (const envelope of envelopes) {
+        const body = JSON.stringify(envelope)
+        if (useBeacon && typeof navigator !== "undefined" && typeof navigator.sendBeacon === "function") {
+          try {
+            if (navigator.sendBeacon("/api/page-sessions/ingest", new Blob([body], { type: "application/json" }))) {
+              continue
+            }
+          } catch {
+            // fall back to fetch
+          }
         }
-      }
-
-      if (cursorUpdates.length) {
         try {
-          await fetch(`/api/page-sessions/${psid}/cursor-dwell`, {
+          const res = await fetch("/api/page-sessions/ingest", {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ items: cursorUpdates }),
+            headers: { "Content-Type": "application/json", "Idempotency-Key": envelope.envelope_id },
+            body,
             keepalive: true,
           })
+          // Shed (429) or failed upstream (5xx): keep the envelope for the next flush. Other 4xx will not succeed on retry.
+          if (res.status === 429 || res.status >= 500) {
+            unsentEnvelopesRef.current.push(envelope)
+          }
         } catch {
-          cursorPendingRef.current.unshift(...cursorUpdates)
+          unsentEnvelopesRef.current.push(envelope)
         }
       }
     },
@@ -241,40 +263,9 @@ export default function SessionTracker() {
 
   const endSession = useCallback(
     async (useBeacon = false, forceCursorFlush = false) => {
-      const psid = psidRef.current
-      if (!psid) return
-      await flushQueue(forceCursorFlush)
-      const endedAt = new Date().toISOString()
+      if (!psidRef.current) return
       const duration = startRef.current ? Math.floor((Date.now() - startRef.current) / 1000) : null
-      const body = JSON.stringify({ ended_at: endedAt, duration_seconds: duration })
-      if (useBeacon && typeof navigator !== "undefined" && typeof navigator.sendBeacon === "function") {
-        try {
-          const blob = new Blob([body], { type: "application/json" })
-          navigator.sendBeacon(`/api/page-sessions/${psid}/end`, blob)
-        } catch {
-          try {
-            await fetch(`/api/page-sessions/${psid}/end`, {
-              method: "POST",
-              headers: { "Content-Type": "application/json" },
-              body,
-              keepalive: true,
-            })
-          } catch {
-            // ignore
-          }
-        }
-      } else {
-        try {
-          await fetch(`/api/page-sessions/${psid}/end`, {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body,
-            keepalive: true,
-          })
-        } catch {
-          // ignore
-        }
-      }
+      await flushQueue(forceCursorFlush, { ended_at: new Date().toISOString(), duration_seconds: duration }, useBeacon)
       psidRef.current = null
       startRef.current = null
     },
@@ -0,0 +1,63 @@
+"use client"
+
+import { resolveUserIdentity } from "@/lib/user-identity"
+
+export type LiveUpdateEvent = "score" | "progress"
+
+type Handler = (data: unknown) => void
+
+const handlers: Record<LiveUpdateEvent, Set<Handler>> = {
+  score: new Set(),
+  progress: new Set(),
+}
+
+let source: EventSource | null = null
+let connecting: Promise<void> | null = null
+
+function handlerCount() {
+  return handlers.score.size + handlers.progress.size
+}
+
+function dispatch(event: LiveUpdateEvent, raw: string) {
+  let data: unknown
+  try {
+    data = JSON.parse(raw)
+  } catch {
+    return
+  }
+  handlers[event].forEach((handler) => handler(data))
+}
+
+async function connect() {
+  if (typeof window === "undefined" || typeof EventSource === "undefined") return
+  const identity = await resolveUserIdentity()
+  const params = new URLSearchParams()
+  if (identity.userId) params.set("user_id", identity.userId)
+  if (identity.email) params.set("user_email", identity.email)
+  if (!params.size || source || !handlerCount()) return
+
+  // One shared stream per tab; EventSource reconnects on its own after network errors.
+  source = new EventSource(`/api/live/updates?${params.toString()}`, { withCredentials: true })
+  ;(Object.keys(handlers) as LiveUpdateEvent[]).forEach((event) => {
+    source?.addEventListener(event, (message) => dispatch(event, (message as MessageEvent<string>).data))
+  })
+}
+
+/** Subscribe to pushed score/progress updates; returns an unsubscribe function. */
+export function subscribeLiveUpdates(event: LiveUpdateEvent, handler: Handler): () => void {
+  handlers[event].add(handler)
+  if (!source && !connecting) {
+    connecting = connect()
+      .catch((error) => console.warn("Failed to open live updates stream", error))
+      .finally(() => {
+        connecting = null
+      })
+  }
+  return () => {
+    handlers[event].delete(handler)
+    if (!handlerCount() && source) {
+      source.close()
+      source = null
+    }
+  }
+}
@@ -0,0 +1,54 @@
+"use client"
+
+import { resolveUserIdentity } from "@/lib/user-identity"
+
+export interface NextAsset {
+  video_id: string
+  file_name: string
+  url: string | null
+  expires_at: number | null
+  stream_url: string
+}
+
+export interface NextAssetsManifest {
+  stream: string
+  current: { video_id: string; progress: number | null; position_seconds: number | null } | null
+  assets: NextAsset[]
+}
+
+const HINTED = new Set<string>()
+
+function addPrefetchHint(url: string) {
+  if (typeof document === "undefined" || HINTED.has(url)) return
+  HINTED.add(url)
+  const link = document.createElement("link")
+  link.rel = "prefetch"
+  link.as = "video"
+  link.href = url
+  document.head.appendChild(link)
+}
+
+/**
+ * Ask the backend which clips of `stream` this viewer will play next. The backend
+ * pre-signs and warms them; this helper adds prefetch hints so the browser starts
+ * buffering before the current clip ends.
+ */
+export async function prefetchNextAssets(stream: string, lookahead = 2): Promise<NextAssetsManifest | null> {
+  const identity = await resolveUserIdentity()
+  const params = new URLSearchParams({ stream, lookahead: String(lookahead) })
+  if (identity.userId) params.set("user_id", identity.userId)
+  if (identity.email) params.set("user_email", identity.email)
+
+  try {
+    const res = await fetch(`/api/videos/next-assets?${params.toString()}`, { credentials: "include" })
+    if (!res.ok) return null
+    const manifest = (await res.json()) as NextAssetsManifest
+    manifest.assets.forEach((asset) => {
+      if (asset.url) addPrefetchHint(asset.url)
+    })
+    return manifest
+  } catch (error) {
+    console.warn("Failed to prefetch next assets", error)
+    return null
+  }
+}
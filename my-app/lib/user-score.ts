@@ -10,6 +10,8 @@ export interface ScoreEventOptions {
   pointsEarned: number
   pointsPossible: number
   source?: string
+  /** Reuse the same key when retrying so the backend does not count the event twice. */
+  idempotencyKey?: string
 }
 
 const SCORE_CACHE_PREFIX = "exploreyou.score"
@@ -65,6 +67,15 @@ function writeCachedSummary(cacheKey: string, value: ScoreSummary) {
   }
 }
 
+/** Store a summary pushed over the live updates stream so the next read skips the network. */
+export async function rememberScoreSummary(summary: ScoreSummary) {
+  const identity = await resolveUserIdentity()
+  const userKey = getUserKey(identity)
+  if (userKey) {
+    writeCachedSummary(makeCacheKey(userKey), summary)
+  }
+}
+
 export async function fetchScoreSummary(force = false): Promise<ScoreSummary | null> {
   const identity = await resolveUserIdentity(force)
   if (!identity.userId && !identity.email) {
@@ -110,11 +121,17 @@ export async function recordScoreEvent(options: ScoreEventOptions): Promise<Scor
   }
   const userKey = getUserKey(identity)
   const cacheKey = userKey ? makeCacheKey(userKey) : null
+  const idempotencyKey =
+    options.idempotencyKey ??
+    (typeof crypto !== "undefined" && typeof crypto.randomUUID === "function" ? crypto.randomUUID() : undefined)
 
   try {
     const res = await fetch("/api/scores/events", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: {
+        "Content-Type": "application/json",
+        ...(idempotencyKey ? { "Idempotency-Key": idempotencyKey } : {}),
+      },
       credentials: "include",
       body: JSON.stringify({
         points_earned: Math.max(0, options.pointsEarned),
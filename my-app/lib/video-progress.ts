@@ -100,6 +100,15 @@ function writeCachedRecord(cacheKey: string, record: VideoProgressRecord) {
   }
 }
 
+/** Store a record pushed over the live updates stream so resume lookups skip the network. */
+export async function rememberVideoProgress(record: VideoProgressRecord) {
+  const identity = await resolveUserIdentity()
+  const userKey = getUserKey(identity)
+  if (userKey && record.video_id) {
+    writeCachedRecord(makeCacheKey(userKey, record.video_id), record)
+  }
+}
+
 export async function recordVideoProgressEvent(options: RecordVideoProgressOptions) {
   const identity = await resolveUserIdentity()
   if (!identity.userId && !identity.email) {
@@ -0,0 +1,43 @@
+-- Lease rows used by the backend scheduler to elect one worker for maintenance jobs
+create table if not exists public.scheduler_leases (
+  name text primary key,
+  holder text not null,
+  expires_at timestamptz not null
+);
+
+-- Only the backend (service role) touches leases; no policies, so anon/authenticated see nothing.
+alter table public.scheduler_leases enable row level security;
+
+-- Claims or renews a lease; true when lease_holder owns it afterwards.
+-- Uses the database clock so worker clock skew cannot split leadership.
+create or replace function public.try_acquire_lease(lease_name text, lease_holder text, lease_seconds integer)
+returns boolean
+language sql
+as $$
+  with claimed as (
+    insert into public.scheduler_leases as l (name, holder, expires_at)
+    values (lease_name, lease_holder, now() + make_interval(secs => lease_seconds))
+    on conflict (name) do update
+      set holder = excluded.holder, expires_at = excluded.expires_at
+      where l.holder = excluded.holder or l.expires_at < now()
+    returning 1
+  )
+  select exists (select 1 from claimed);
+$$;
+
+create or replace function public.release_lease(lease_name text, lease_holder text)
+returns void
+language sql
+as $$
+  delete from public.scheduler_leases where name = lease_name and holder = lease_holder;
+$$;
+
+-- Functions are executable by PUBLIC by default; with the anon key anyone could hold a lease forever.
+revoke execute on function public.try_acquire_lease(text, text, integer), public.release_lease(text, text)
+  from public, anon, authenticated;
+grant execute on function public.try_acquire_lease(text, text, integer), public.release_lease(text, text)
+  to service_role;
+
+-- Supports the abandoned page-session sweep
+create index if not exists ix_page_sessions_open on public.page_sessions (last_event_at)
+  where ended_at is null;
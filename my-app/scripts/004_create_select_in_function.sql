@@ -0,0 +1,55 @@
+-- Set-membership read for backend queries whose in() list is too long for a URL.
+-- Called by supabase_client.select via POST /rpc/select_in; values arrive as text
+-- and are cast to the column's type so the column's index is still used.
+create or replace function public.select_in(
+  p_table text,
+  p_column text,
+  p_values text[],
+  p_filters jsonb default '{}'::jsonb,
+  p_order text default null,
+  p_desc boolean default false,
+  p_limit integer default null
+)
+returns setof jsonb
+language plpgsql
+stable
+security invoker
+as $$
+declare
+  column_type text;
+  sql_text text;
+  f record;
+begin
+  select format_type(a.atttypid, a.atttypmod) into column_type
+  from pg_attribute a
+  where a.attrelid = format('public.%I', p_table)::regclass
+    and a.attname = p_column
+    and not a.attisdropped;
+  if column_type is null then
+    raise exception 'unknown column %.%', p_table, p_column;
+  end if;
+
+  sql_text := format('select to_jsonb(t) from public.%I t where t.%I = any($1::%s[])', p_table, p_column, column_type);
+  for f in select key, value from jsonb_each(coalesce(p_filters, '{}'::jsonb)) loop
+    if jsonb_typeof(f.value) = 'array' then
+      sql_text := sql_text || format(' and t.%I::text in (select jsonb_array_elements_text(%L::jsonb))', f.key, f.value);
+    else
+      sql_text := sql_text || format(' and t.%I::text = %L', f.key, f.value #>> '{}');
+    end if;
+  end loop;
+  if p_order is not null then
+    sql_text := sql_text || format(' order by t.%I %s', p_order, case when p_desc then 'desc nulls first' else 'asc nulls last' end);
+  end if;
+  if p_limit is not null then
+    sql_text := sql_text || format(' limit %s', p_limit);
+  end if;
+
+  return query execute sql_text using p_values;
+end;
+$$;
+
+-- Reads any table in public; only the backend (service role) may call it.
+revoke execute on function public.select_in(text, text, text[], jsonb, text, boolean, integer)
+  from public, anon, authenticated;
+grant execute on function public.select_in(text, text, text[], jsonb, text, boolean, integer)
+  to service_role;
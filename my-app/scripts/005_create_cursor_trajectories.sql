@@ -0,0 +1,16 @@
+-- Compressed cursor paths written by the backend when CURSOR_TRAJECTORY_STORAGE is on.
+-- points is the varint delta encoding from backend/trajectory.py; point_count is the
+-- number of move events received, stored_points what is left after simplification.
+create table if not exists public.cursor_trajectories (
+  id uuid primary key,
+  page_session_id varchar not null references public.page_sessions (id) on delete cascade,
+  started_at timestamptz not null,
+  ended_at timestamptz not null,
+  point_count integer not null,
+  stored_points integer not null,
+  tolerance_px real not null default 0,
+  points bytea not null
+);
+
+create index if not exists ix_cursor_trajectories_session
+  on public.cursor_trajectories (page_session_id, started_at);
@@ -0,0 +1,8 @@
+-- Keyset reads for GET /page-sessions/{psid}/timeline: events of one page session
+-- ordered by (event_timestamp, id), resumed after the last row of the previous page.
+create index if not exists ix_events_session_timeline
+  on public.events (page_session_id, event_timestamp, id);
+
+-- Dwell totals of a page session in update order.
+create index if not exists ix_cursor_dwell_metrics_session
+  on public.cursor_dwell_metrics (page_session_id, last_updated);